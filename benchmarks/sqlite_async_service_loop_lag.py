@@ -0,0 +1,110 @@
+"""
+Event-loop lag of SqliteAsyncService under concurrent load.
+
+A ticker coroutine sleeps for 1ms in a loop and records how late it wakes up,
+while many coroutines store and look up credentials concurrently. The
+`BlockingSqliteService` below reproduces the previous implementation, which
+ran the sqlite3 calls and the commits on the event loop thread.
+
+Usage:
+    python -m benchmarks.sqlite_async_service_loop_lag [--ops 2000] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from l402.client.credentials import L402Credentials, SqliteAsyncService
+from l402.client.credentials.sqlite_async_service import INSERT_SQL
+
+QUERY_SQL = """
+    SELECT macaroon, preimage, invoice
+    FROM credentials
+    WHERE location = ?
+    ORDER BY created_at DESC
+    LIMIT 1
+"""
+
+
+class BlockingSqliteService:
+    """The previous SqliteAsyncService: blocking sqlite3 calls on the loop."""
+
+    def __init__(self, path):
+        reference = SqliteAsyncService(path)
+        reference.close()
+        self.conn = sqlite3.connect(path)
+
+    async def store(self, credentials):
+        row = (credentials.location, credentials.macaroon, credentials.preimage,
+               credentials.invoice, datetime.now())
+        self.conn.execute(INSERT_SQL, row)
+        self.conn.commit()
+
+    async def get(self, location):
+        return self.conn.execute(QUERY_SQL, (location,)).fetchone()
+
+    def close(self):
+        self.conn.close()
+
+
+async def ticker(lags, stop, interval=0.001):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def worker(service, ops, worker_id):
+    for i in range(ops):
+        location = f"https://example.com/{worker_id}/{i % 10}"
+        if i % 4 == 0:
+            credentials = L402Credentials(f"macaroon{i}", f"preimage{i}", f"invoice{i}")
+            credentials.set_location(location)
+            await service.store(credentials)
+        else:
+            await service.get(location)
+
+
+async def run(service, ops, concurrency):
+    lags, stop = [], asyncio.Event()
+    ticker_task = asyncio.create_task(ticker(lags, stop))
+
+    start = time.perf_counter()
+    per_worker = ops // concurrency
+    await asyncio.gather(*[worker(service, per_worker, w) for w in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker_task
+    return elapsed, lags
+
+
+def report(name, ops, elapsed, lags):
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    p99 = lags_ms[int(len(lags_ms) * 0.99) - 1] if len(lags_ms) > 1 else lags_ms[0]
+    print(f"{name:>10}: {ops / elapsed:8.0f} ops/s | loop lag mean {statistics.mean(lags_ms):6.2f}ms"
+          f" p99 {p99:6.2f}ms max {lags_ms[-1]:6.2f}ms | ticks {len(lags)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, factory in (("before", BlockingSqliteService), ("after", SqliteAsyncService)):
+            service = factory(os.path.join(tmp, f"{name}.db"))
+            try:
+                elapsed, lags = asyncio.run(run(service, args.ops, args.concurrency))
+            finally:
+                service.close()
+            report(name, args.ops, elapsed, lags)
+
+
+if __name__ == "__main__":
+    main()
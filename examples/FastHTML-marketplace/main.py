@@ -4,7 +4,7 @@ import uuid
 from starlette.responses import RedirectResponse, FileResponse, PlainTextResponse
 from starlette.datastructures import UploadFile
 # from l402_decorator import FastHTML_l402_decorator
-from l402.server import Authenticator, FastHTML_l402_decorator
+from l402.server import Authenticator, PaidDownloads
 from l402.server.invoice_provider import FewsatsInvoiceProvider
 # from replit.object_storage import Client
 from l402.server.macaroons import SqliteMacaroonService
@@ -29,6 +29,9 @@ authenticator = Authenticator(location='localhost:8000',
                               invoice_provider=fewsats_provider,
                               macaroon_service=macaroon_service)
 
+# Serves the paid files, with Range support for resumed downloads.
+downloads = PaidDownloads(authenticator)
+
 
 db = database('data/marketplace.db')
 items = db.t.items
@@ -133,7 +136,6 @@ async def post(request):
     return item.__ft__()
 
 @rt("/download/{id:int}", methods=["GET"])
-@FastHTML_l402_decorator(authenticator, lambda req: (100, 'USD', 'Download of an item'))
 async def download_file(req, id: int):
     item = items.get(id)
     if not item or not item.file_path:
@@ -143,8 +145,10 @@ async def download_file(req, id: int):
     if not os.path.exists(file_path):
         return PlainTextResponse("File not found", status_code=404)
     
-    return FileResponse(
+    return await downloads.serve(
+        req,
         file_path,
+        (100, 'USD', 'Download of an item'),
         filename=os.path.basename(file_path),
         media_type='application/octet-stream'
     )
@@ -1,8 +1,9 @@
 from .client import Client
-from .hub_service import HubService
+from .hub_service import HubService, AsyncHubService
 from .credentials import L402Credentials, CredentialsService, parse_http_402_response
-from .preimage_provider import PreimageProvider
-from .requests import Session
+from .preimage_provider import PreimageProvider, AsyncPreimageProvider
+from .requests import Session, L402Adapter, L402Session
+from .payment_lock import FilePaymentLock, PaymentLockTimeout
 
 # Create the singleton instance
 requests = Session()
\ No newline at end of file
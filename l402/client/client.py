@@ -1,8 +1,32 @@
 import httpx
 import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, Optional
 
-from .preimage_provider import PreimageProvider
-from .credentials import CredentialsService, parse_http_402_response
+from .preimage_provider import PreimageProvider, AsyncPreimageProvider, as_async_preimage_provider
+from .credentials import CredentialsService, CredentialsPolicy, L402Credentials, parse_http_402_response
+from .credentials.credentials_service import _invalidate
+from .payment_lock import FilePaymentLock
+
+# Default number of URLs prefetched concurrently.
+DEFAULT_PREFETCH_CONCURRENCY = 10
+
+# Request arguments that carry a body, for httpx and requests.
+BODY_ARGUMENTS = ("content", "data", "files", "json")
+
+class _PaymentFlight:
+    """
+    Per-location state shared by the requests in flight for that location.
+
+    The lock makes sure only one of them pays a 402 challenge, the others wait
+    and reuse the credentials it obtained.
+    """
+    __slots__ = ("lock", "credentials", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.credentials: Optional[L402Credentials] = None
+        self.users = 0
 
 class Client:
     """
@@ -10,27 +34,83 @@ class Client:
     with 402 Payment Required responses.
     """
 
-    def __init__(self, preimage_provider: PreimageProvider = None, 
-                 credentials_service: CredentialsService = None):
-        self._preimage_provider = preimage_provider
+    def __init__(self, preimage_provider: AsyncPreimageProvider = None, 
+                 credentials_service: CredentialsService = None,
+                 limits: httpx.Limits = None, http2: bool = False, timeout: float = 30.0,
+                 policy: CredentialsPolicy = None, payment_lock: FilePaymentLock = None,
+                 preflight: Optional[str] = None):
+        """
+        Args:
+            preimage_provider (AsyncPreimageProvider): Pays the invoices of the 402 challenges.
+                Synchronous providers are run in a thread pool.
+            credentials_service (CredentialsService): Stores and retrieves the L402 credentials.
+            limits (httpx.Limits): Connection pool limits, httpx defaults are used if not set.
+            http2 (bool): Enables HTTP/2, it requires the `h2` package.
+            timeout (float): Timeout in seconds for the HTTP requests.
+            policy (CredentialsPolicy): Decides which URLs reuse the credentials
+                paid for a URL, by default only the URL itself.
+            payment_lock (FilePaymentLock): Elects a single payer per location
+                among the processes sharing the credentials service.
+            preflight (str): HTTP method of a body-less probe sent before
+                requests with a body when there are no credentials yet, e.g.
+                "HEAD". The challenge is paid first, so the body is sent once.
+                Disabled by default.
+        """
+        self._preimage_provider = as_async_preimage_provider(preimage_provider)
         self._credentials_service = credentials_service
+        self._policy = policy or CredentialsPolicy()
+        self._payment_lock = payment_lock
+        self._preflight = preflight
+
+        self._limits = limits or httpx.Limits()
+        self._http2 = http2
+        self._timeout = timeout
+        self._http_client: Optional[httpx.AsyncClient] = None
+
+        self._flights: Dict[str, _PaymentFlight] = {}
+
+    async def __aenter__(self) -> "Client":
+        self._get_http_client()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def aclose(self):
+        """Closes the pooled connections."""
+        if self._http_client is not None:
+            http_client, self._http_client = self._http_client, None
+            await http_client.aclose()
 
-        self._lock = asyncio.Lock()
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Returns the long-lived HTTP client, it is created on first use."""
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(
+                limits=self._limits, http2=self._http2, timeout=self._timeout,
+            )
+        return self._http_client
 
     @property
-    def preimage_provider(self) -> PreimageProvider:
+    def preimage_provider(self) -> AsyncPreimageProvider:
         return self._preimage_provider
 
     @property
     def credentials_service(self) -> CredentialsService:
         return self._credentials_service
 
-    def configure(self, preimage_provider: PreimageProvider = None, credentials_service: CredentialsService = None):
+    @property
+    def policy(self) -> CredentialsPolicy:
+        return self._policy
+
+    def configure(self, preimage_provider: PreimageProvider = None, credentials_service: CredentialsService = None,
+                  policy: CredentialsPolicy = None):
         """Configures the client with the given services."""
         if preimage_provider:
-            self._preimage_provider = preimage_provider
+            self._preimage_provider = as_async_preimage_provider(preimage_provider)
         if credentials_service:
             self._credentials_service = credentials_service
+        if policy:
+            self._policy = policy
 
     def _add_authorization_header(self, kwargs, credentials):
         """Adds the L402 Authorization header to the request."""
@@ -40,7 +120,7 @@ class Client:
     async def _handle_402_payment_required(self, url: str, response: httpx.Response) -> CredentialsService:
         """Handles a 402 Payment Required response."""
         creds = parse_http_402_response(response)
-        creds.set_location(url)
+        creds.set_location(self.policy.scope(url))
         preimage = await self.preimage_provider.get_preimage(creds.invoice)
         if not preimage:
             raise Exception("Payment failed.")
@@ -49,17 +129,186 @@ class Client:
         await self.credentials_service.store(creds)
         return creds
 
+    def _join_flight(self, location: str) -> _PaymentFlight:
+        """Registers a request in flight for the given location."""
+        flight = self._flights.get(location)
+        if flight is None:
+            flight = self._flights[location] = _PaymentFlight()
+        flight.users += 1
+        return flight
+
+    def _leave_flight(self, location: str, flight: _PaymentFlight):
+        """Unregisters a request, the state is dropped with the last one."""
+        flight.users -= 1
+        if flight.users == 0:
+            del self._flights[location]
+
+    async def _pay_once(self, flight: _PaymentFlight, url: str, response: httpx.Response,
+                        used_creds: Optional[L402Credentials]) -> L402Credentials:
+        """
+        Pays the 402 challenge unless a concurrent request already did it.
+
+        If another request obtained new credentials while this one was in
+        flight, those are returned. A new payment is only made when there are
+        none or they are the ones the server just rejected. With a payment
+        lock, the same applies to the requests of other processes.
+        """
+        async with flight.lock:
+            paid = flight.credentials
+            if paid is not None and not _same_credentials(paid, used_creds):
+                return paid
+
+            if self._payment_lock is None:
+                flight.credentials = await self._pay(url, response, used_creds)
+                return flight.credentials
+
+            async with self._payment_lock.acquire_async(self.policy.scope(url)):
+                stored = await self.credentials_service.get(url)
+                if stored is not None and not _same_credentials(stored, used_creds):
+                    flight.credentials = stored
+                else:
+                    flight.credentials = await self._pay(url, response, used_creds)
+                return flight.credentials
+
+    async def _pay(self, url: str, response: httpx.Response,
+                   used_creds: Optional[L402Credentials]) -> L402Credentials:
+        if used_creds is not None:
+            await _invalidate(self.credentials_service, url)
+        return await self._handle_402_payment_required(url, response)
+
     async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
-        async with self._lock:
+        # Requests whose credentials share a scope share the payment as well.
+        scope = self.policy.scope(url)
+        flight = self._join_flight(scope)
+        try:
+            creds = await self.credentials_service.get(url)
+            if creds is None and self._preflight and _has_body(kwargs):
+                creds = await self._preflight_challenge(flight, url, kwargs)
+            if creds:
+                self._add_authorization_header(kwargs, creds)
+
+            client = self._get_http_client()
+            response = await client.request(method, url, **kwargs)
+            if response.status_code != 402:
+                return response
+
+            new_creds = await self._pay_once(flight, url, response, creds)
+            self._add_authorization_header(kwargs, new_creds)
+            return await client.request(method, url, **kwargs)
+        finally:
+            self._leave_flight(scope, flight)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        Streaming version of `request`, used as an async context manager:
+
+            async with client.stream("GET", url) as response:
+                async for chunk in response.aiter_bytes():
+                    ...
+
+        The 402 challenge is negotiated on the response headers, its body is
+        never read, and the paid response body is left unread so it can be
+        consumed incrementally.
+        """
+        scope = self.policy.scope(url)
+        flight = self._join_flight(scope)
+        try:
             creds = await self.credentials_service.get(url)
+            if creds is None and self._preflight and _has_body(kwargs):
+                creds = await self._preflight_challenge(flight, url, kwargs)
             if creds:
                 self._add_authorization_header(kwargs, creds)
 
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.request(method, url, **kwargs)
+            client = self._get_http_client()
+            async with client.stream(method, url, **kwargs) as response:
                 if response.status_code != 402:
-                    return response
+                    yield response
+                    return
+
+            new_creds = await self._pay_once(flight, url, response, creds)
+            self._add_authorization_header(kwargs, new_creds)
+            async with client.stream(method, url, **kwargs) as response:
+                yield response
+        finally:
+            self._leave_flight(scope, flight)
+
+    async def _preflight_challenge(self, flight: _PaymentFlight, url: str, kwargs) -> Optional[L402Credentials]:
+        """Pays the challenge of a body-less probe, None if it needs no payment."""
+        probe_kwargs = {key: kwargs[key] for key in ("headers", "params", "cookies") if key in kwargs}
+        response = await self._probe(self._preflight, url, **probe_kwargs)
+        if response.status_code != 402:
+            return None
+        return await self._pay_once(flight, url, response, None)
+
+    async def _probe(self, method: str, url: str, **kwargs) -> httpx.Response:
+        client = self._get_http_client()
+        async with client.stream(method, url, **kwargs) as response:
+            # The body is not needed, the challenge is in the headers.
+            pass
+        return response
+
+    async def prefetch(self, urls: Iterable[str], concurrency: int = DEFAULT_PREFETCH_CONCURRENCY,
+                       method: str = "GET", **kwargs) -> Dict[str, Optional[L402Credentials]]:
+        """
+        Obtains the credentials for the given URLs ahead of time.
+
+        Each URL without credentials is probed and, if the server answers with
+        a 402, the challenge is paid and the credentials are stored, so that
+        the real requests are authenticated on the first attempt. Only the
+        response headers of the probes are read. URLs sharing a policy scope
+        are probed once.
+
+        Args:
+            urls (Iterable[str]): The URLs that will be requested.
+            concurrency (int): The maximum number of URLs prefetched at once.
+            method (str): The HTTP method of the probe requests.
+            **kwargs: Extra arguments for the probe requests, e.g. headers.
+
+        Returns:
+            Dict[str, Optional[L402Credentials]]: The credentials for each URL,
+                None for the URLs that did not require a payment.
+        """
+        scopes: Dict[str, str] = {}
+        for url in urls:
+            scopes.setdefault(url, self.policy.scope(url))
+
+        representatives: Dict[str, str] = {}
+        for url, scope in scopes.items():
+            representatives.setdefault(scope, url)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def prefetch_one(url: str):
+            async with semaphore:
+                return await self._prefetch(method, url, **kwargs)
+
+        results = await asyncio.gather(*[prefetch_one(url) for url in representatives.values()])
+        by_scope = dict(zip(representatives.keys(), results))
+        return {url: by_scope[scope] for url, scope in scopes.items()}
+
+    async def _prefetch(self, method: str, url: str, **kwargs) -> Optional[L402Credentials]:
+        scope = self.policy.scope(url)
+        flight = self._join_flight(scope)
+        try:
+            creds = await self.credentials_service.get(url)
+            if creds:
+                return creds
+
+            response = await self._probe(method, url, **kwargs)
+            if response.status_code != 402:
+                return None
+
+            return await self._pay_once(flight, url, response, creds)
+        finally:
+            self._leave_flight(scope, flight)
+
+def _has_body(kwargs) -> bool:
+    return any(kwargs.get(key) is not None for key in BODY_ARGUMENTS)
 
-                new_creds = await self._handle_402_payment_required(url, response)
-                self._add_authorization_header(kwargs, new_creds)
-                return await client.request(method, url, **kwargs)
+def _same_credentials(a: Optional[L402Credentials], b: Optional[L402Credentials]) -> bool:
+    if a is b:
+        return True
+    if a is None or b is None:
+        return False
+    return a.macaroon == b.macaroon
@@ -1,4 +1,9 @@
 from .credentials import L402Credentials, parse_http_402_response, _parse_l402_challenge
 from .sqlite_credentials_service import SqliteCredentialsService
 from .sqlite_async_service import SqliteAsyncService
-from .credentials_service import CredentialsService
\ No newline at end of file
+from .credentials_service import CredentialsService
+from .cached_credentials_service import CredentialsCache, CachedAsyncService, CachedCredentialsService
+from .policies import (
+    CredentialsPolicy, ExactPolicy, OriginPolicy, PathPrefixPolicy, PatternPolicy,
+    PrefixIndex, candidate_locations,
+)
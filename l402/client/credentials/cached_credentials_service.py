@@ -0,0 +1,160 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from .credentials import L402Credentials
+from .credentials_service import CredentialsService, _invalidate, _invalidate_sync
+from .policies import WILDCARD, candidate_locations
+
+# Returned by `CredentialsCache.get` when the location is not cached.
+MISS = object()
+
+class CredentialsCache:
+    """
+    Bounded LRU cache of L402Credentials by location with a time-to-live.
+
+    Lookups return the entry of the longest matching location, so credentials
+    cached under a prefix such as "https://example.com/api/*" serve every URL
+    below it. Locations known to have no credentials can be cached as well,
+    for `negative_ttl` seconds, so that repeated lookups for free resources do
+    not reach the underlying service either.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0, negative_ttl: float = 0.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, location: str):
+        """Return the cached credentials (possibly None) or `MISS`."""
+        match = self._match(location)
+        if match is None:
+            return MISS
+
+        self._entries.move_to_end(match)
+        return self._entries[match][1]
+
+    def _match(self, location: str) -> Optional[str]:
+        """Return the key of the longest live entry for the location."""
+        now = time.monotonic()
+        for i, candidate in enumerate(candidate_locations(location)):
+            entry = self._entries.get(candidate)
+            if entry is None:
+                continue
+
+            expires_at, credentials = entry
+            if expires_at <= now:
+                del self._entries[candidate]
+                continue
+
+            # Misses are cached for exact locations only.
+            if credentials is None and i > 0:
+                continue
+
+            return candidate
+        return None
+
+    def put(self, location: str, credentials: Optional[L402Credentials]):
+        """Cache the credentials for a location, None caches a miss."""
+        ttl = self.ttl if credentials is not None else self.negative_ttl
+        if ttl <= 0:
+            self._entries.pop(location, None)
+            return
+
+        self._entries[location] = (time.monotonic() + ttl, credentials)
+        self._entries.move_to_end(location)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, location: str):
+        """Drop the entry that `get(location)` would return."""
+        match = self._match(location)
+        if match is not None:
+            del self._entries[match]
+
+    def discard_misses(self):
+        """Drop every cached miss, e.g. after storing prefix credentials."""
+        for location in [l for l, (_, c) in self._entries.items() if c is None]:
+            del self._entries[location]
+
+    def clear(self):
+        self._entries.clear()
+
+
+class CachedAsyncService(CredentialsService):
+    """
+    CachedAsyncService wraps an asynchronous credentials service with an
+    in-memory `CredentialsCache`.
+
+    The cache is warmed on `store()` and the entry is dropped on `invalidate()`,
+    so the per-request lookup is a dict access for as long as the credentials
+    keep being accepted.
+    """
+
+    def __init__(self, service: CredentialsService, max_size: int = 1024,
+                 ttl: float = 300.0, negative_ttl: float = 0.0):
+        self.service = service
+        self.cache = CredentialsCache(max_size, ttl, negative_ttl)
+
+    async def store(self, credentials: L402Credentials):
+        await self.service.store(credentials)
+        _cache_stored(self.cache, credentials)
+
+    async def get(self, location: str) -> Optional[L402Credentials]:
+        credentials = self.cache.get(location)
+        if credentials is not MISS:
+            return credentials
+
+        credentials = await self.service.get(location)
+        _cache_found(self.cache, location, credentials)
+        return credentials
+
+    async def invalidate(self, location: str):
+        self.cache.discard(location)
+        await _invalidate(self.service, location)
+
+
+class CachedCredentialsService():
+    """
+    CachedCredentialsService is the synchronous counterpart of
+    `CachedAsyncService`, for services such as `SqliteCredentialsService`.
+    """
+
+    def __init__(self, service, max_size: int = 1024, ttl: float = 300.0, negative_ttl: float = 0.0):
+        self.service = service
+        self.cache = CredentialsCache(max_size, ttl, negative_ttl)
+
+    def store(self, credentials: L402Credentials):
+        self.service.store(credentials)
+        _cache_stored(self.cache, credentials)
+
+    def get(self, location: str) -> Optional[L402Credentials]:
+        credentials = self.cache.get(location)
+        if credentials is not MISS:
+            return credentials
+
+        credentials = self.service.get(location)
+        _cache_found(self.cache, location, credentials)
+        return credentials
+
+    def invalidate(self, location: str):
+        self.cache.discard(location)
+        _invalidate_sync(self.service, location)
+
+
+def _cache_stored(cache: CredentialsCache, credentials: L402Credentials):
+    cache.put(credentials.location, credentials)
+    # Prefix credentials now cover locations that may be cached as misses.
+    if credentials.location.endswith(WILDCARD):
+        cache.discard_misses()
+
+
+def _cache_found(cache: CredentialsCache, location: str, credentials: Optional[L402Credentials]):
+    # Credentials found through a prefix are cached under that prefix, so
+    # they serve the other URLs below it as well.
+    matched_location = getattr(credentials, "location", None) or location
+    cache.put(matched_location, credentials)
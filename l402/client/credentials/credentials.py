@@ -23,9 +23,9 @@ class L402Credentials:
        return f"L402 {self.macaroon}:{self.preimage}"
     
     def set_location(self, location: str):
-        # TODO(positiveblue): we need something like "policies". Policies will 
-        # allow us to define the conditions under which a credential can be used.
-        # By now we will simply set the url.
+        # The location is either the exact url the credentials were paid for
+        # or a prefix ending in "/*" chosen by a `CredentialsPolicy`, which
+        # makes them usable for every url below it.
         self.location = location
 
 
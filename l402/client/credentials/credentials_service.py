@@ -1,4 +1,7 @@
+import asyncio
+import inspect
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 from .credentials import L402Credentials
 
@@ -37,4 +40,57 @@ class CredentialsService(ABC):
         Raises:
             NotImplementedError: This method must be implemented by any concrete class that inherits from this ABC.
         """
-        pass
\ No newline at end of file
+        pass
+
+    async def invalidate(self, location: str):
+        """
+        Discard the credentials for a given location after the server rejected them.
+
+        Services that keep no derived state can ignore it, which is the default.
+
+        Args:
+            location (str): The location whose credentials were rejected.
+        """
+        pass
+
+
+async def _invalidate(service, location: str):
+    """
+    Call the `invalidate` of a service used by the asynchronous clients.
+    Duck-typed services that only implement `get` and `store` are skipped.
+    """
+    invalidate = getattr(service, "invalidate", None)
+    if invalidate is None:
+        return
+
+    result = invalidate(location)
+    if inspect.isawaitable(result):
+        await result
+
+def _invalidate_sync(service, location: str):
+    """
+    Synchronous counterpart of `_invalidate`, for the services of SyncClient.
+    An asynchronous `invalidate`, e.g. the one inherited from
+    `CredentialsService`, is run to completion.
+    """
+    invalidate = getattr(service, "invalidate", None)
+    if invalidate is None:
+        return
+
+    result = invalidate(location)
+    if inspect.isawaitable(result):
+        _run_awaitable(result)
+
+def _run_awaitable(awaitable):
+    async def wait():
+        return await awaitable
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(wait())
+
+    # Called from a thread running an event loop, which cannot be blocked
+    # on, the awaitable gets a loop of its own.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, wait()).result()
@@ -0,0 +1,117 @@
+from typing import Dict, Generic, Iterable, List, Optional, Tuple, TypeVar
+from urllib.parse import urlsplit
+
+# Suffix of the locations that cover every URL below a path prefix, e.g.
+# "https://api.example.com/v0/items/*".
+WILDCARD = "/*"
+
+T = TypeVar("T")
+
+
+def candidate_locations(url: str) -> List[str]:
+    """
+    Return the locations whose credentials can be used for the URL, the most
+    specific first: the URL itself and then every path prefix up to the origin.
+
+        https://example.com/api/items/1?page=2
+        https://example.com/api/items/*
+        https://example.com/api/*
+        https://example.com/*
+    """
+    parts = urlsplit(url)
+    origin = f"{parts.scheme}://{parts.netloc}"
+    segments = (parts.path or "/").split("/")
+
+    candidates = [url]
+    for i in range(len(segments) - 1, 0, -1):
+        candidates.append(origin + "/".join(segments[:i]) + WILDCARD)
+    return candidates
+
+
+class PrefixIndex(Generic[T]):
+    """
+    Maps locations, exact URLs or wildcard prefixes, to values and finds the
+    longest one that matches a URL with one dict lookup per path segment.
+    """
+
+    def __init__(self, items: Iterable[Tuple[str, T]] = ()):
+        self._entries: Dict[str, T] = dict(items)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __setitem__(self, location: str, value: T):
+        self._entries[location] = value
+
+    def __delitem__(self, location: str):
+        del self._entries[location]
+
+    def longest_match(self, url: str) -> Optional[Tuple[str, T]]:
+        """Return the (location, value) of the most specific match or None."""
+        for location in candidate_locations(url):
+            if location in self._entries:
+                return location, self._entries[location]
+        return None
+
+
+class CredentialsPolicy:
+    """
+    A credentials policy decides the location under which the credentials
+    paid for a URL are stored, and therefore which other URLs reuse them.
+
+    The default policy scopes the credentials to the exact URL.
+    """
+
+    def scope(self, url: str) -> str:
+        return url
+
+
+class ExactPolicy(CredentialsPolicy):
+    """Credentials are only used for the URL they were paid for."""
+
+
+class OriginPolicy(CredentialsPolicy):
+    """Credentials are used for every URL of the same scheme, host and port."""
+
+    def scope(self, url: str) -> str:
+        return candidate_locations(url)[-1]
+
+
+class PathPrefixPolicy(CredentialsPolicy):
+    """
+    Credentials are used for every URL below a path prefix.
+
+    By default the prefix is the parent "directory" of the URL, so paying for
+    `/api/items/1` unlocks `/api/items/2`. With `depth` the prefix is made of
+    the first `depth` path segments instead, e.g. depth 1 is `/api/*`.
+    """
+
+    def __init__(self, depth: Optional[int] = None):
+        self.depth = depth
+
+    def scope(self, url: str) -> str:
+        prefixes = candidate_locations(url)[1:]
+        if self.depth is None:
+            return prefixes[0]
+
+        # The prefixes go from the longest to the origin, which has depth 0.
+        index = max(len(prefixes) - 1 - self.depth, 0)
+        return prefixes[index]
+
+
+class PatternPolicy(CredentialsPolicy):
+    """
+    Credentials are scoped to the most specific of a set of explicit patterns,
+    exact URLs or prefixes ending in "/*". URLs matching no pattern use the
+    fallback policy.
+    """
+
+    def __init__(self, patterns: Iterable[str], fallback: CredentialsPolicy = None):
+        self.patterns = PrefixIndex((pattern, pattern) for pattern in patterns)
+        self.fallback = fallback or ExactPolicy()
+
+    def scope(self, url: str) -> str:
+        match = self.patterns.longest_match(url)
+        if match is None:
+            return self.fallback.scope(url)
+        return match[0]
@@ -1,9 +1,14 @@
 import os
+import asyncio
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from .credentials import L402Credentials
 from .credentials_service import CredentialsService
+from .policies import candidate_locations
+from .sqlite_schema import PRUNE_SQL, lookup_params, lookup_sql, migrate
 
 def adapt_datetime(dt):
     return dt.isoformat()
@@ -13,95 +18,184 @@ def adapt_datetime(dt):
 # The custom adapter converts datetime objects to ISO 8601 string format for storage in the database
 sqlite3.register_adapter(datetime, adapt_datetime)
 
+INSERT_SQL = """
+    INSERT INTO credentials (
+        location, macaroon, preimage, invoice, created_at
+    ) VALUES (
+        ?, ?, ?, ?, ?
+    );
+"""
+
+DELETE_SQL = """
+    DELETE FROM credentials WHERE location = ?
+"""
+
 class SqliteAsyncService(CredentialsService):
     """
     SqliteAsyncService is an asynchronous SQLite-based credentials service for L402.
+
+    SQLite calls never run on the event loop. Writes go through a single
+    dedicated writer thread that batches all the pending `store()` calls into
+    one commit. Reads run on a separate pool of threads with their own
+    connections, so with WAL enabled they are not blocked by the writer.
+    In-memory databases cannot be shared between connections, so they are
+    read and written from the writer thread only.
     """
 
-    def __init__(self, path=None):
+    def __init__(self, path=None, readers: int = 4):
         self.db_path = path or os.path.join(os.path.expanduser('~'), 'credentials.db')
-        self.conn = sqlite3.connect(self.db_path)
+        self._in_memory = self.db_path == ":memory:"
+
+        # The writer connection is only used from the writer thread, once the
+        # table has been created.
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        if not self._in_memory:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
         self._create_table()
 
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="l402-sqlite-writer")
+        if self._in_memory:
+            self._reader = self._writer
+        else:
+            self._reader = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="l402-sqlite-reader")
+
+        self._local = threading.local()
+        self._reader_conns = []
+
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._flush_scheduled = False
+
     def _create_table(self):
-        create_table_sql = """
-            CREATE TABLE IF NOT EXISTS credentials (
-                -- id is the primary key of the table.
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-
-                -- location is the url for the resource.
-                location TEXT NOT NULL,
-
-                -- macaroon is the base64 encoded macaroon needed in the
-                -- L402 request header.
-                macaroon TEXT NOT NULL,
-
-                -- preimage is the preimage linked to the macaroon payment
-                -- hash. Also needed in the L402 request header.
-                preimage TEXT,
-
-                -- invoice is the LN invoice that was paid to complete the
-                -- credentials.
-                invoice TEXT NOT NULL,
-
-                -- created_at is the date and time when the credentials were
-                -- created.
-                created_at DATETIME NOT NULL
-            );
-            
-            CREATE INDEX IF NOT EXISTS credentials_location_index ON credentials (location);
-        """
-        cursor = self.conn.cursor()
-        cursor.executescript(create_table_sql)
-        self.conn.commit()
-    
-    async def store(self, credentials: L402Credentials):
-        insert_sql = """
-            INSERT INTO credentials (
-                location, macaroon, preimage, invoice, created_at
-            ) VALUES (
-                ?, ?, ?, ?, ?
-            );
-        """
+        migrate(self.conn)
 
-        location = credentials.location
-        macaroon = credentials.macaroon
-        preimage = credentials.preimage
-        invoice = credentials.invoice
-        created_at = datetime.now()
+    def _reader_conn(self) -> sqlite3.Connection:
+        """Returns the connection of the current reader thread."""
+        if self._in_memory:
+            return self.conn
 
-        cursor = self.conn.cursor()
-        cursor.execute(
-            (insert_sql), 
-            (location, macaroon, preimage, invoice, created_at),
-        )
-        self.conn.commit()
-    
-    async def get(self, location: str):
-        query_sql = """
-            SELECT macaroon, preimage, invoice
-            FROM credentials
-            WHERE location = ?
-            ORDER BY created_at DESC
-            LIMIT 1
-        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._local.conn = conn
+            self._reader_conns.append(conn)
+        return conn
 
-        cursor = self.conn.cursor()
-        cursor.execute(
-            query_sql, (location,)
+    async def store(self, credentials: L402Credentials):
+        row = (
+            credentials.location,
+            credentials.macaroon,
+            credentials.preimage,
+            credentials.invoice,
+            datetime.now(),
         )
 
-        row = cursor.fetchone()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._pending_lock:
+            self._pending.append((row, loop, future))
+            if not self._flush_scheduled:
+                self._flush_scheduled = True
+                self._writer.submit(self._flush)
+
+        await future
+
+    def _flush(self):
+        """Commits all the pending rows at once, runs on the writer thread."""
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+            self._flush_scheduled = False
+
+        rows = [row for row, _, _ in batch]
+        error = self._write(rows)
+        if error is not None and len(rows) > 1:
+            # One bad row fails the whole transaction, write the rows one at a
+            # time so that only the stores of the bad ones fail.
+            errors = [self._write([row]) for row in rows]
+        else:
+            errors = [error] * len(rows)
+
+        for (_, loop, future), error in zip(batch, errors):
+            loop.call_soon_threadsafe(_resolve, future, error)
+
+    def _write(self, rows):
+        """Inserts the rows in one transaction, returns the error that rolled it back, if any."""
+        try:
+            self.conn.executemany(INSERT_SQL, rows)
+            # The new credentials supersede the previous ones of their location.
+            locations = {row[0] for row in rows}
+            self.conn.executemany(PRUNE_SQL, [(location, location) for location in locations])
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            return e
+        return None
+
+    async def get(self, location: str):
+        loop = asyncio.get_running_loop()
+        row = await loop.run_in_executor(self._reader, self._query, location)
         if row:
-            macaroon, preimage, invoice = row
+            matched_location, macaroon, preimage, invoice = row
             credentials = L402Credentials(macaroon, preimage, invoice)
-            credentials.set_location(location)
+            credentials.set_location(matched_location)
             return credentials
         
         return None
 
+    def _query(self, location: str, conn: sqlite3.Connection = None):
+        candidates = candidate_locations(location)
+        cursor = (conn or self._reader_conn()).cursor()
+        cursor.execute(lookup_sql(len(candidates)), lookup_params(candidates))
+        return cursor.fetchone()
+
+    async def invalidate(self, location: str):
+        """
+        Delete the credentials that `get(location)` returns, after the server
+        rejected them, so that less specific credentials or a new payment
+        stored under a shorter scope are not shadowed by them.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, self._delete_match, location)
+
+    def _delete_match(self, location: str):
+        """Runs on the writer thread, after any store() queued before it."""
+        row = self._query(location, self.conn)
+        if row is None:
+            return
+
+        self.conn.execute(DELETE_SQL, (row[0],))
+        self.conn.commit()
+
+    def close(self):
+        """
+        Wait for the pending writes and close the SQLite connections.
+        """
+        self._shutdown(wait=True)
+
+    def _shutdown(self, wait: bool):
+        self._writer.shutdown(wait=wait)
+        if self._reader is not self._writer:
+            self._reader.shutdown(wait=wait)
+
+        for conn in self._reader_conns:
+            conn.close()
+        self._reader_conns = []
+        self.conn.close()
+
     def __del__(self):
         """
-        Close the SQLite connection.
+        Close the SQLite connections.
         """
-        self.conn.close()
\ No newline at end of file
+        # Queued work keeps a reference to the service, so there is nothing
+        # left to wait for once it is being collected.
+        if hasattr(self, "_writer"):
+            self._shutdown(wait=False)
+
+def _resolve(future: asyncio.Future, error):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(None)
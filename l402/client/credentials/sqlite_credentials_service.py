@@ -4,6 +4,8 @@ from datetime import datetime
 
 from .credentials import L402Credentials
 from .credentials_service import CredentialsService
+from .policies import candidate_locations
+from .sqlite_schema import PRUNE_SQL, lookup_params, lookup_sql, migrate
 
 def adapt_datetime(dt):
     return dt.isoformat()
@@ -21,25 +23,16 @@ class SqliteCredentialsService():
     def __init__(self, path=None):
         self.db_path = path or os.path.join(os.path.expanduser('~'), 'credentials.db')
         self.conn = sqlite3.connect(self.db_path)
+        if self.db_path != ":memory:":
+            # WAL lets several processes share the database, readers do not
+            # block the writer storing freshly paid credentials.
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
         self._create_table()
 
     def _create_table(self):
-        create_table_sql = """
-            CREATE TABLE IF NOT EXISTS credentials (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                location TEXT NOT NULL,
-                macaroon TEXT NOT NULL,
-                preimage TEXT,
-                invoice TEXT NOT NULL,
-                created_at DATETIME NOT NULL
-            );
-            
-            CREATE INDEX IF NOT EXISTS credentials_location_index ON credentials (location);
-        """
-        cursor = self.conn.cursor()
-        cursor.executescript(create_table_sql)
-        self.conn.commit()
-    
+        migrate(self.conn)
+
     def store(self, credentials: L402Credentials):
         insert_sql = """
             INSERT INTO credentials (
@@ -55,29 +48,39 @@ class SqliteCredentialsService():
 
         cursor = self.conn.cursor()
         cursor.execute(insert_sql, (location, macaroon, preimage, invoice, created_at))
+        # The new credentials supersede the previous ones of the location.
+        cursor.execute(PRUNE_SQL, (location, location))
         self.conn.commit()
     
     def get(self, location: str):
-        query_sql = """
-            SELECT macaroon, preimage, invoice
-            FROM credentials
-            WHERE location = ?
-            ORDER BY created_at DESC
-            LIMIT 1
-        """
+        candidates = candidate_locations(location)
 
         cursor = self.conn.cursor()
-        cursor.execute(query_sql, (location,))
+        cursor.execute(lookup_sql(len(candidates)), lookup_params(candidates))
 
         row = cursor.fetchone()
         if row:
-            macaroon, preimage, invoice = row
+            matched_location, macaroon, preimage, invoice = row
             credentials = L402Credentials(macaroon, preimage, invoice)
-            credentials.set_location(location)
+            credentials.set_location(matched_location)
             return credentials
         
         return None
 
+    def invalidate(self, location: str):
+        """
+        Delete the credentials that `get(location)` returns, after the server
+        rejected them, so that less specific credentials or a new payment
+        stored under a shorter scope are not shadowed by them.
+        """
+        credentials = self.get(location)
+        if credentials is None:
+            return
+
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM credentials WHERE location = ?", (credentials.location,))
+        self.conn.commit()
+
     def __del__(self):
         """
         Close the SQLite connection.
@@ -0,0 +1,91 @@
+import sqlite3
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS credentials (
+        -- id is the primary key of the table.
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+
+        -- location is the url for the resource.
+        location TEXT NOT NULL,
+
+        -- macaroon is the base64 encoded macaroon needed in the
+        -- L402 request header.
+        macaroon TEXT NOT NULL,
+
+        -- preimage is the preimage linked to the macaroon payment
+        -- hash. Also needed in the L402 request header.
+        preimage TEXT,
+
+        -- invoice is the LN invoice that was paid to complete the
+        -- credentials.
+        invoice TEXT NOT NULL,
+
+        -- created_at is the date and time when the credentials were
+        -- created.
+        created_at DATETIME NOT NULL
+    )
+"""
+
+# Deletes the credentials of a location that are older than its latest row,
+# they can never be returned by a lookup again.
+PRUNE_SQL = """
+    DELETE FROM credentials
+    WHERE location = ?
+    AND id < (SELECT max(id) FROM credentials WHERE location = ?)
+"""
+
+def lookup_sql(candidates: int) -> str:
+    """
+    Lookup of the credentials of the first of `candidates` locations that has
+    any, see `candidate_locations`, with `lookup_params` as parameters.
+    """
+    order = " ".join("WHEN ? THEN ?" for _ in range(candidates))
+    return f"""
+        SELECT location, macaroon, preimage, invoice
+        FROM credentials
+        WHERE location IN ({", ".join("?" * candidates)})
+        ORDER BY CASE location {order} END, created_at DESC
+        LIMIT 1
+    """
+
+def lookup_params(candidates):
+    """The parameters of `lookup_sql` for the candidate locations, most specific first."""
+    order = [param for i, location in enumerate(candidates) for param in (location, i)]
+    return [*candidates, *order]
+
+# Migrations indexed by the schema version they upgrade to, the version of a
+# database is kept in `PRAGMA user_version`. Version 0 is the original table
+# with an index on location only.
+MIGRATIONS = {
+    1: [
+        # Lookups filter on location and sort on created_at.
+        "CREATE INDEX IF NOT EXISTS credentials_location_created_at_index ON credentials (location, created_at)",
+        "DROP INDEX IF EXISTS credentials_location_index",
+        # Keep the latest credentials of every location only.
+        "DELETE FROM credentials WHERE id NOT IN (SELECT max(id) FROM credentials GROUP BY location)",
+    ],
+}
+
+SCHEMA_VERSION = max(MIGRATIONS)
+
+def migrate(conn: sqlite3.Connection):
+    """
+    Creates the credentials table or upgrades an existing one to the latest
+    schema version. Safe to call from several processes at once, the
+    migration runs in a write transaction.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(CREATE_TABLE_SQL)
+
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target in range(version + 1, SCHEMA_VERSION + 1):
+            for statement in MIGRATIONS[target]:
+                conn.execute(statement)
+
+        if version < SCHEMA_VERSION:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
@@ -1,20 +1,54 @@
 import httpx
+from typing import Optional
 
-from .preimage_provider import PreimageProvider
-from .credentials import CredentialsService, parse_http_402_response
+from .preimage_provider import PreimageProvider, as_async_preimage_provider
+from .credentials import CredentialsService, CredentialsPolicy, parse_http_402_response
+from .origin_cache import OriginCache, origin_of
+from .payment_lock import FilePaymentLock
+from .client import _same_credentials
+from .credentials.credentials_service import _invalidate
+
+# Headers describing the request body, dropped from the preflight probes.
+BODY_HEADERS = ("content-length", "content-type", "transfer-encoding")
 
 _default_preimage_provider = None
 _default_credentials_service = None
+_default_policy = None
+_default_payment_lock = None
 
-def configure(preimage_provider: PreimageProvider, credentials_service: CredentialsService):
+def configure(preimage_provider: PreimageProvider, credentials_service: CredentialsService,
+              policy: CredentialsPolicy = None, payment_lock: FilePaymentLock = None):
     global _default_preimage_provider
     global _default_credentials_service
+    global _default_policy
+    global _default_payment_lock
 
-    _default_preimage_provider = preimage_provider
+    # Synchronous providers are run in a thread pool so that paying an
+    # invoice does not block the event loop.
+    _default_preimage_provider = as_async_preimage_provider(preimage_provider)
     _default_credentials_service = credentials_service
+    _default_policy = policy or CredentialsPolicy()
+    _default_payment_lock = payment_lock
     
 class AsyncClient(httpx.AsyncClient):
-    def __init__(self, *args, **kwargs):
+    """
+    Drop-in replacement for `httpx.AsyncClient` that handles 402 Payment
+    Required responses.
+
+    The client learns which origins use L402 and skips the credentials lookup
+    for the ones that never challenged it, see `OriginCache`. The first 402
+    from such an origin flips it back.
+
+    Streaming works as with `httpx.AsyncClient`, `client.stream(...)` only
+    reads the headers of a 402 before paying and retrying.
+
+    With `l402_preflight`, e.g. "HEAD", requests with a body and no
+    credentials are preceded by a body-less probe with that method, so the
+    challenge is paid before the body is sent and the body is sent once.
+    """
+
+    def __init__(self, *args, l402_origin_ttl: float = 300.0, l402_origin_cache_size: int = 1024,
+                 l402_preflight: Optional[str] = None, **kwargs):
         super().__init__(*args, **kwargs)
 
         if _default_preimage_provider is None or _default_credentials_service is None:
@@ -22,6 +56,10 @@ class AsyncClient(httpx.AsyncClient):
         
         self._preimage_provider = _default_preimage_provider
         self._credentials_service = _default_credentials_service
+        self._policy = _default_policy
+        self._payment_lock = _default_payment_lock
+        self._origins = OriginCache(l402_origin_cache_size, l402_origin_ttl)
+        self._preflight = l402_preflight
     
     def _add_authorization_header(self, request, credentials):
         """Adds the L402 Authorization header to the request."""
@@ -30,7 +68,7 @@ class AsyncClient(httpx.AsyncClient):
     async def _handle_402_payment_required(self, url: str, response: httpx.Response) -> CredentialsService:
         """Handles a 402 Payment Required response."""
         creds = parse_http_402_response(response)
-        creds.set_location(url)
+        creds.set_location(self._policy.scope(url))
         preimage = await self._preimage_provider.get_preimage(creds.invoice)
         if not preimage:
             raise Exception("Payment failed.")
@@ -39,18 +77,79 @@ class AsyncClient(httpx.AsyncClient):
         await self._credentials_service.store(creds)
 
         return creds
+
+    async def _pay_once(self, url: str, response: httpx.Response, used_creds):
+        """
+        Pays the 402 challenge. With a payment lock, credentials stored by
+        another process while waiting for the lock are used instead.
+        """
+        if self._payment_lock is None:
+            return await self._pay(url, response, used_creds)
+
+        async with self._payment_lock.acquire_async(self._policy.scope(url)):
+            stored = await self._credentials_service.get(url)
+            if stored is not None and not _same_credentials(stored, used_creds):
+                return stored
+            return await self._pay(url, response, used_creds)
+
+    async def _pay(self, url: str, response: httpx.Response, used_creds):
+        if used_creds:
+            await _invalidate(self._credentials_service, url)
+        return await self._handle_402_payment_required(url, response)
+
+    async def _preflight_challenge(self, request: httpx.Request):
+        """Pays the challenge of a body-less probe, None if it needs no payment."""
+        headers = httpx.Headers(request.headers)
+        for name in BODY_HEADERS:
+            headers.pop(name, None)
+
+        probe = self.build_request(self._preflight, request.url, headers=headers)
+        response = await super().send(probe, stream=True)
+        await response.aclose()
+        if response.status_code != 402:
+            return None
+        return await self._pay_once(str(request.url), response, None)
     
     async def send(self, request, *args, **kwargs):
         url = str(request.url)
-        creds = await self._credentials_service.get(url)
+        origin = origin_of(request.url)
+
+        skipped_lookup = self._origins.is_free(origin)
+        creds = None if skipped_lookup else await self._credentials_service.get(url)
+        if creds is None and not skipped_lookup and self._preflight and _has_body(request):
+            creds = await self._preflight_challenge(request)
         if creds:
             self._add_authorization_header(request, creds)
 
         response = await super().send(request, *args, **kwargs)
         if response.status_code != 402:
+            if creds:
+                self._origins.mark_paid(origin)
+            else:
+                self._origins.mark_free(origin)
             return response
 
-        new_creds = await self._handle_402_payment_required(url, response)
+        self._origins.mark_paid(origin)
+
+        # Credentials stored before the origin was marked free may still be
+        # valid, try them before paying again.
+        if skipped_lookup:
+            creds = await self._credentials_service.get(url)
+            if creds:
+                await response.aclose()
+                self._add_authorization_header(request, creds)
+                response = await super().send(request, *args, **kwargs)
+                if response.status_code != 402:
+                    return response
+
+        # The challenge is in the headers, close the 402 before retrying so
+        # that streamed responses give their connection back.
+        await response.aclose()
+        new_creds = await self._pay_once(url, response, creds)
         self._add_authorization_header(request, new_creds)
         return await super().send(request, *args, **kwargs)
-    
+
+def _has_body(request: httpx.Request) -> bool:
+    if "transfer-encoding" in request.headers:
+        return True
+    return request.headers.get("content-length", "0") != "0"
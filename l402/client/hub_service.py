@@ -1,60 +1,65 @@
+import httpx
+import asyncio
 import requests
-from typing import Optional
+from typing import Dict, Iterable, Optional
 from urllib.parse import quote
 import os
-from .credentials import L402Credentials, CredentialsService
-from .preimage_provider import PreimageProvider
+from .credentials import L402Credentials, CredentialsService, CredentialsCache
+from .credentials.cached_credentials_service import MISS, _cache_stored
+from .preimage_provider import PreimageProvider, AsyncPreimageProvider
 
-class HubService(CredentialsService, PreimageProvider):
-    def __init__(self, api_key: str = None, api_url: str = "https://hub-5n97k.ondigitalocean.app/", ignore_existing_credentials: bool = False):
+class _HubServiceBase:
+    """
+    Configuration, requests and responses shared by the hub services.
+
+    Lookups are cached locally: purchases for `cache_ttl` seconds and URLs
+    that were never purchased for `negative_cache_ttl` seconds, which is the
+    common case for most of the traffic.
+    """
+
+    def __init__(self, api_key: str = None, api_url: str = "https://hub-5n97k.ondigitalocean.app/", ignore_existing_credentials: bool = False,
+                 cache_size: int = 1024, cache_ttl: float = 300.0, negative_cache_ttl: float = 30.0):
         self.api_url = api_url
         self.api_key = api_key or os.environ.get("HUB_API_KEY")
         self.ignore_existing_credentials = ignore_existing_credentials
         if not self.api_key:
             raise ValueError("API key must be provided either as an argument or in the HUB_API_KEY environment variable")
 
-    def store(self, credentials: L402Credentials):
-        # The store method is left empty as it's filled by the purchase itself
-        pass
-
-    def get(self, location: str, ) -> Optional[L402Credentials]:
-        if self.ignore_existing_credentials:
-            return None
+        self.cache = CredentialsCache(cache_size, cache_ttl, negative_cache_ttl)
 
-        headers = self._get_headers()
+    def _purchase_url(self, location: str) -> str:
         encoded_location = quote(location)
-        response = requests.get(
-            f"{self.api_url}/v0/l402/purchases/by-url?l402_url={encoded_location}",
-            headers=headers
-        )
-        
+        return f"{self.api_url}/v0/l402/purchases/by-url?l402_url={encoded_location}"
+
+    def _payment_url(self) -> str:
+        return f"{self.api_url}/v0/l402/purchases/direct"
+
+    def _payment_data(self, invoice: str) -> dict:
+        return {
+            "invoice": invoice,
+            "macaroon": "",
+            "l402_url": "",
+            "description": "Invoice payment for preimage retrieval"
+        }
+
+    def _process_purchase(self, location: str, response) -> Optional[L402Credentials]:
         if response.status_code == 404:
+            self.cache.put(location, None)
             return None
         elif response.status_code != 200:
             raise Exception(f"Failed to retrieve credentials: {response.text}")
 
         purchase = response.json()
-        return L402Credentials(
+        credentials = L402Credentials(
             macaroon=purchase["macaroon"],
             preimage=purchase["preimage"],
             invoice=purchase["invoice"]
         )
+        credentials.set_location(location)
+        self.cache.put(location, credentials)
+        return credentials
 
-    def get_preimage(self, invoice: str) -> str:
-        headers = self._get_headers()
-        data = {
-            "invoice": invoice,
-            "macaroon": "",
-            "l402_url": "",
-            "description": "Invoice payment for preimage retrieval"
-        }
-
-        response = requests.post(
-            f"{self.api_url}/v0/l402/purchases/direct",
-            json=data,
-            headers=headers
-        )
-
+    def _process_payment(self, response) -> str:
         if response.status_code != 200:
             raise Exception(f"Failed to pay invoice: {response.text}")
 
@@ -70,4 +75,132 @@ class HubService(CredentialsService, PreimageProvider):
         return {
             "Authorization": f"Token {self.api_key}",
             "Content-Type": "application/json"
-        }
\ No newline at end of file
+        }
+
+class HubService(_HubServiceBase, CredentialsService, PreimageProvider):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # A session keeps the connections to the hub alive between calls.
+        self._session = requests.Session()
+
+    def store(self, credentials: L402Credentials):
+        # The purchase itself is recorded by the hub, only the local cache
+        # needs to learn about it, including the misses it now covers.
+        _cache_stored(self.cache, credentials)
+
+    def get(self, location: str, ) -> Optional[L402Credentials]:
+        if self.ignore_existing_credentials:
+            return None
+
+        credentials = self.cache.get(location)
+        if credentials is not MISS:
+            return credentials
+
+        response = self._session.get(self._purchase_url(location), headers=self._get_headers())
+        return self._process_purchase(location, response)
+
+    def get_many(self, locations: Iterable[str]) -> Dict[str, Optional[L402Credentials]]:
+        """Look up the credentials of many locations, see `AsyncHubService.get_many`."""
+        return {location: self.get(location) for location in dict.fromkeys(locations)}
+
+    def invalidate(self, location: str):
+        # The hub keeps the purchase history, only the local copy is dropped.
+        self.cache.discard(location)
+
+    def get_preimage(self, invoice: str) -> str:
+        response = self._session.post(
+            self._payment_url(),
+            json=self._payment_data(invoice),
+            headers=self._get_headers()
+        )
+        return self._process_payment(response)
+
+class AsyncHubService(_HubServiceBase, CredentialsService, AsyncPreimageProvider):
+    """
+    Asynchronous hub service for the async clients. Credential lookups and
+    payments go through a long-lived pooled `httpx.AsyncClient`.
+    """
+
+    def __init__(self, *args, limits: httpx.Limits = None, timeout: float = 30.0,
+                 max_concurrency: int = 10, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._limits = limits or httpx.Limits()
+        self._timeout = timeout
+        self._max_concurrency = max_concurrency
+        self._http_client: Optional[httpx.AsyncClient] = None
+
+        # Lookups in flight by location, concurrent misses share the request.
+        self._lookups: Dict[str, asyncio.Future] = {}
+
+    async def __aenter__(self) -> "AsyncHubService":
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def aclose(self):
+        """Closes the pooled connections."""
+        if self._http_client is not None:
+            http_client, self._http_client = self._http_client, None
+            await http_client.aclose()
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(
+                headers=self._get_headers(), limits=self._limits, timeout=self._timeout,
+            )
+        return self._http_client
+
+    async def store(self, credentials: L402Credentials):
+        # The purchase itself is recorded by the hub, only the local cache
+        # needs to learn about it, including the misses it now covers.
+        _cache_stored(self.cache, credentials)
+
+    async def get(self, location: str) -> Optional[L402Credentials]:
+        if self.ignore_existing_credentials:
+            return None
+
+        credentials = self.cache.get(location)
+        if credentials is not MISS:
+            return credentials
+
+        lookup = self._lookups.get(location)
+        if lookup is None:
+            lookup = asyncio.ensure_future(self._fetch(location))
+            self._lookups[location] = lookup
+            lookup.add_done_callback(lambda _: self._lookups.pop(location, None))
+
+        return await asyncio.shield(lookup)
+
+    async def _fetch(self, location: str) -> Optional[L402Credentials]:
+        response = await self._get_http_client().get(self._purchase_url(location))
+        return self._process_purchase(location, response)
+
+    async def get_many(self, locations: Iterable[str]) -> Dict[str, Optional[L402Credentials]]:
+        """
+        Look up the credentials of many locations in one call.
+
+        Cached locations are answered locally and the rest are requested
+        concurrently, at most `max_concurrency` at a time, over the pooled
+        connections.
+        """
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        async def get(location: str) -> Optional[L402Credentials]:
+            credentials = self.cache.get(location)
+            if credentials is not MISS:
+                return credentials
+            async with semaphore:
+                return await self.get(location)
+
+        locations = list(dict.fromkeys(locations))
+        results = await asyncio.gather(*[get(location) for location in locations])
+        return dict(zip(locations, results))
+
+    async def invalidate(self, location: str):
+        # The hub keeps the purchase history, only the local copy is dropped.
+        self.cache.discard(location)
+
+    async def get_preimage(self, invoice: str) -> str:
+        response = await self._get_http_client().post(self._payment_url(), json=self._payment_data(invoice))
+        return self._process_payment(response)
@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+
+import httpx
+
+def origin_of(url: httpx.URL) -> str:
+    """Returns the scheme, host and port of the URL."""
+    port = f":{url.port}" if url.port else ""
+    return f"{url.scheme}://{url.host}{port}"
+
+class OriginCache:
+    """
+    Remembers, per origin, whether it uses L402.
+
+    An origin is "free" after it answered without a 402 and there were no
+    credentials for the request, and "paid" after a 402 or a request that
+    carried credentials. Credential lookups can be skipped for free origins.
+    Both states expire after `ttl` seconds, and at most `max_size` origins
+    are remembered, the least recently used are forgotten first. Forgotten
+    origins are looked up again, so the bounds never affect correctness.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._origins = OrderedDict()
+
+    def __len__(self):
+        return len(self._origins)
+
+    def is_free(self, origin: str) -> bool:
+        """True if the origin is known not to use L402."""
+        entry = self._origins.get(origin)
+        if entry is None:
+            return False
+
+        uses_l402, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._origins[origin]
+            return False
+
+        return not uses_l402
+
+    def mark_free(self, origin: str):
+        """Records a response without a 402, unless the origin uses L402."""
+        entry = self._origins.get(origin)
+        if entry is not None and entry[0] and entry[1] > time.monotonic():
+            return
+        self._set(origin, False)
+
+    def mark_paid(self, origin: str):
+        """Records a 402 or a request sent with credentials."""
+        self._set(origin, True)
+
+    def _set(self, origin: str, uses_l402: bool):
+        if self.ttl <= 0:
+            return
+
+        self._origins[origin] = (uses_l402, time.monotonic() + self.ttl)
+        self._origins.move_to_end(origin)
+        if len(self._origins) > self.max_size:
+            self._origins.popitem(last=False)
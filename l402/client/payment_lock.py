@@ -0,0 +1,89 @@
+import os
+import time
+import asyncio
+import hashlib
+import tempfile
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional
+
+# fcntl is only available on POSIX systems, import it like this so that the
+# rest of the package keeps working elsewhere.
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+class PaymentLockTimeout(Exception):
+    """Exception raised when the payment lock could not be acquired in time."""
+    pass
+
+class FilePaymentLock:
+    """
+    Cross-process payment lock based on `fcntl.flock`.
+
+    Every location maps to a lock file in a directory shared by the processes
+    of a host. The process that takes the lock pays the challenge, the others
+    wait for it and then find its credentials in the shared credentials
+    service, e.g. a `SqliteCredentialsService` or `SqliteAsyncService` on the
+    same database file. The lock is also honoured by threads of the same
+    process, since every acquisition opens its own file description.
+    """
+
+    def __init__(self, directory: str = None, timeout: Optional[float] = None, poll_interval: float = 0.05):
+        """
+        Args:
+            directory (str): Where the lock files live, a per-host temporary
+                directory by default.
+            timeout (float): Seconds to wait for the lock, forever if not set.
+            poll_interval (float): Seconds between attempts while waiting.
+        """
+        if fcntl is None:
+            raise RuntimeError("FilePaymentLock requires fcntl, which is not available on this platform")
+
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "l402-payment-locks")
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, location: str) -> str:
+        name = hashlib.sha256(location.encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f"{name}.lock")
+
+    def _try_lock(self, fd: int) -> bool:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _timed_out(self, started: float) -> bool:
+        return self.timeout is not None and time.monotonic() - started >= self.timeout
+
+    @contextmanager
+    def acquire(self, location: str):
+        """Holds the payment lock of the location, blocking while waiting."""
+        fd = os.open(self._path(location), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            started = time.monotonic()
+            while not self._try_lock(fd):
+                if self._timed_out(started):
+                    raise PaymentLockTimeout(f"Timed out waiting for the payment lock of {location}")
+                time.sleep(self.poll_interval)
+            yield
+        finally:
+            # Closing the descriptor releases the lock.
+            os.close(fd)
+
+    @asynccontextmanager
+    async def acquire_async(self, location: str):
+        """Holds the payment lock of the location without blocking the event loop."""
+        fd = os.open(self._path(location), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            started = time.monotonic()
+            while not self._try_lock(fd):
+                if self._timed_out(started):
+                    raise PaymentLockTimeout(f"Timed out waiting for the payment lock of {location}")
+                await asyncio.sleep(self.poll_interval)
+            yield
+        finally:
+            os.close(fd)
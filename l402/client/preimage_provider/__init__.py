@@ -1,2 +1,5 @@
-from .alby_api import AlbyAPI
-from .preimage_provider import PreimageProvider
\ No newline at end of file
+from .alby_api import AlbyAPI, AsyncAlbyAPI
+from .local_provider import LocalPreimageProvider
+from .preimage_provider import (
+    PreimageProvider, AsyncPreimageProvider, ThreadedPreimageProvider, as_async_preimage_provider,
+)
@@ -1,31 +1,15 @@
 import httpx
 import json
-from typing import Tuple, Dict
-from .preimage_provider import PreimageProvider
+from typing import Tuple, Dict, Optional
+from .preimage_provider import PreimageProvider, AsyncPreimageProvider
+
+class _AlbyAPIBase:
+    """Request building and response parsing shared by the Alby providers."""
 
-class AlbyAPI(PreimageProvider):
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.alby_url = "https://api.getalby.com"
 
-    def get_preimage(self, invoice: str) -> str:
-        """
-        Retrieves the preimage for the given invoice.
-
-        Args:
-            invoice (str): The invoice for which to retrieve the preimage.
-
-        Returns:
-            str: The preimage associated with the invoice.
-        
-        Raises:
-            Exception: If unable to obtain the preimage.
-        """
-        url, headers, data = self._prepare_request(invoice)
-        with httpx.Client(timeout=30.0) as client:
-            response = client.post(url, headers=headers, content=data)
-            return self._process_response(response)
-
     def _prepare_request(self, invoice: str) -> Tuple[str, str, str]:
         """
         Prepares the request to the Alby API to retrieve the preimage for the given invoice.
@@ -72,4 +56,70 @@ class AlbyAPI(PreimageProvider):
         if not preimage:
             raise Exception(f"Payment preimage not found in response: {payment_response}")
 
-        return preimage
\ No newline at end of file
+        return preimage
+
+class AlbyAPI(_AlbyAPIBase, PreimageProvider):
+    def get_preimage(self, invoice: str) -> str:
+        """
+        Retrieves the preimage for the given invoice.
+
+        Args:
+            invoice (str): The invoice for which to retrieve the preimage.
+
+        Returns:
+            str: The preimage associated with the invoice.
+        
+        Raises:
+            Exception: If unable to obtain the preimage.
+        """
+        url, headers, data = self._prepare_request(invoice)
+        with httpx.Client(timeout=30.0) as client:
+            response = client.post(url, headers=headers, content=data)
+            return self._process_response(response)
+
+class AsyncAlbyAPI(_AlbyAPIBase, AsyncPreimageProvider):
+    """
+    Asynchronous Alby preimage provider. Payments go through a long-lived
+    pooled `httpx.AsyncClient`, so they do not block the event loop and reuse
+    the connection to the Alby API.
+    """
+
+    def __init__(self, api_key: str, limits: httpx.Limits = None, timeout: float = 30.0):
+        super().__init__(api_key)
+        self._limits = limits or httpx.Limits()
+        self._timeout = timeout
+        self._http_client: Optional[httpx.AsyncClient] = None
+
+    async def __aenter__(self) -> "AsyncAlbyAPI":
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def aclose(self):
+        """Closes the pooled connections."""
+        if self._http_client is not None:
+            http_client, self._http_client = self._http_client, None
+            await http_client.aclose()
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(limits=self._limits, timeout=self._timeout)
+        return self._http_client
+
+    async def get_preimage(self, invoice: str) -> str:
+        """
+        Retrieves the preimage for the given invoice.
+
+        Args:
+            invoice (str): The invoice for which to retrieve the preimage.
+
+        Returns:
+            str: The preimage associated with the invoice.
+        
+        Raises:
+            Exception: If unable to obtain the preimage.
+        """
+        url, headers, data = self._prepare_request(invoice)
+        response = await self._get_http_client().post(url, headers=headers, content=data)
+        return self._process_response(response)
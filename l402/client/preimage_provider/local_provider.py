@@ -0,0 +1,43 @@
+import time
+
+from .preimage_provider import PreimageProvider
+
+class LocalPreimageProvider(PreimageProvider):
+    """
+    PreimageProvider that "pays" invoices created by a `LocalInvoiceProvider`.
+
+    It is meant for development, benchmarks and tests: no Lightning payment is
+    made, the preimage is read straight from the invoice provider's store.
+    """
+
+    def __init__(self, invoice_provider, latency: float = 0.0):
+        """
+        Args:
+            invoice_provider: The `LocalInvoiceProvider` that created the invoices.
+            latency (float): Seconds to wait before returning each preimage, to
+                simulate the duration of a real payment.
+        """
+        self.invoice_provider = invoice_provider
+        self.latency = latency
+
+    def get_preimage(self, invoice: str) -> str:
+        """
+        Retrieves the preimage for the given invoice.
+
+        Args:
+            invoice (str): The invoice for which to retrieve the preimage.
+
+        Returns:
+            str: The preimage associated with the invoice.
+
+        Raises:
+            Exception: If the invoice was not created by the local invoice provider.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+
+        preimage = self.invoice_provider.lookup_preimage(invoice)
+        if not preimage:
+            raise Exception(f"Unknown invoice: {invoice}")
+
+        return preimage
@@ -1,4 +1,6 @@
+import asyncio
 from abc import ABC, abstractmethod
+from concurrent.futures import Executor
 
 class PreimageProvider(ABC):
     """
@@ -23,4 +25,58 @@ class PreimageProvider(ABC):
         Raises:
             NotImplementedError: This method must be implemented by any concrete class that inherits from this ABC.
         """
-        pass
\ No newline at end of file
+        pass
+
+class AsyncPreimageProvider(ABC):
+    """
+    Abstract Base Class (ABC) for an asynchronous Preimage Provider.
+
+    It is the interface expected by the async clients, paying an invoice must
+    not block the event loop. Synchronous providers can be adapted with
+    `ThreadedPreimageProvider`.
+    """
+
+    @abstractmethod
+    async def get_preimage(self, invoice: str) -> str:
+        """
+        Abstract method to retrieve the preimage for a given invoice.
+
+        Args:
+            invoice (str): The unique identifier of the invoice for which the preimage is to be retrieved.
+
+        Returns:
+            str: The preimage associated with the given invoice.
+
+        Raises:
+            NotImplementedError: This method must be implemented by any concrete class that inherits from this ABC.
+        """
+        pass
+
+class ThreadedPreimageProvider(AsyncPreimageProvider):
+    """
+    Adapts a synchronous PreimageProvider to the async interface by running
+    its `get_preimage` calls in a thread pool.
+    """
+
+    def __init__(self, provider: PreimageProvider, executor: Executor = None):
+        """
+        Args:
+            provider (PreimageProvider): The synchronous provider to adapt.
+            executor (Executor): The executor for the calls, the event loop's
+                default executor if not set.
+        """
+        self.provider = provider
+        self.executor = executor
+
+    async def get_preimage(self, invoice: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.provider.get_preimage, invoice)
+
+def as_async_preimage_provider(provider):
+    """
+    Returns the provider itself if its `get_preimage` is a coroutine function,
+    otherwise wraps it in a `ThreadedPreimageProvider`.
+    """
+    if provider is None or asyncio.iscoroutinefunction(provider.get_preimage):
+        return provider
+    return ThreadedPreimageProvider(provider)
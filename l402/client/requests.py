@@ -1,14 +1,60 @@
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
 from .exceptions import RequestException
 from .preimage_provider import PreimageProvider
-from .credentials import CredentialsService, parse_http_402_response, L402Credentials
+from .client import DEFAULT_PREFETCH_CONCURRENCY, _has_body, _same_credentials
+from .payment_lock import FilePaymentLock
+from .credentials import CredentialsService, CredentialsPolicy, parse_http_402_response, L402Credentials
+from .credentials.credentials_service import _invalidate_sync
 
 class SyncClient:
     def __init__(self, preimage_provider: PreimageProvider = None, 
-                 credentials_service: CredentialsService = None):
+                 credentials_service: CredentialsService = None,
+                 pool_connections: int = DEFAULT_POOLSIZE, pool_maxsize: int = DEFAULT_POOLSIZE,
+                 policy: CredentialsPolicy = None, payment_lock: FilePaymentLock = None,
+                 preflight: Optional[str] = None):
+        """
+        Args:
+            preimage_provider (PreimageProvider): Pays the invoices of the 402 challenges.
+            credentials_service (CredentialsService): Stores and retrieves the L402 credentials.
+            pool_connections (int): Number of hosts whose connection pools are kept.
+            pool_maxsize (int): Maximum number of connections kept per host, raise it
+                when the client is shared by many threads.
+            policy (CredentialsPolicy): Decides which URLs reuse the credentials
+                paid for a URL, by default only the URL itself.
+            payment_lock (FilePaymentLock): Elects a single payer per location
+                among the threads and processes sharing the credentials service.
+            preflight (str): HTTP method of a body-less probe sent before
+                requests with a body when there are no credentials yet, see
+                `Client`. Disabled by default.
+        """
         self.preimage_provider = preimage_provider
         self.credentials_service = credentials_service
-        
+        self.policy = policy or CredentialsPolicy()
+        self.payment_lock = payment_lock
+        self.preflight = preflight
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self._session = None
+
+    def _get_session(self) -> requests.Session:
+        """Returns the long-lived session, it is created on first use."""
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session = session
+        return self._session
+
+    def close(self):
+        """Closes the pooled connections."""
+        if self._session is not None:
+            session, self._session = self._session, None
+            session.close()
+
     def _add_authorization_header(self, kwargs, credentials):
         """Adds the L402 Authorization header to the request."""
         headers = kwargs.setdefault('headers', {})
@@ -16,29 +62,193 @@ class SyncClient:
 
     def _handle_402_payment_required(self, url: str, response: requests.Response) -> L402Credentials:
         """Handles a 402 Payment Required response."""
+        creds = self._buy(url, response)
+        self.credentials_service.store(creds)
+        return creds
+
+    def _buy(self, url: str, response: requests.Response) -> L402Credentials:
+        """Pays the invoice of the challenge, the credentials are not stored."""
         creds = parse_http_402_response(response)
-        creds.set_location(url)
+        creds.set_location(self.policy.scope(url))
         preimage = self.preimage_provider.get_preimage(creds.invoice)
         if not preimage:
             raise Exception("Payment failed.")
 
         creds.preimage = preimage
-        self.credentials_service.store(creds)
         return creds
 
+    def _pay_once(self, url: str, response: requests.Response,
+                  used_creds: Optional[L402Credentials]) -> L402Credentials:
+        """
+        Pays the 402 challenge. With a payment lock, credentials stored by
+        another payer while waiting for the lock are used instead, unless they
+        are the ones the server just rejected.
+        """
+        if self.payment_lock is None:
+            return self._pay(url, response, used_creds)
+
+        with self.payment_lock.acquire(self.policy.scope(url)):
+            stored = self.credentials_service.get(url)
+            if stored is not None and not _same_credentials(stored, used_creds):
+                return stored
+            return self._pay(url, response, used_creds)
+
+    def _pay(self, url: str, response: requests.Response,
+             used_creds: Optional[L402Credentials]) -> L402Credentials:
+        if used_creds:
+            _invalidate_sync(self.credentials_service, url)
+        return self._handle_402_payment_required(url, response)
+
     def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Sends the request, paying the 402 challenge if needed. With
+        `stream=True` the body of the returned response is not read, consume
+        it with `iter_content` to keep large downloads out of memory.
+        """
         creds = self.credentials_service.get(url)
+        if creds is None and self.preflight and _has_body(kwargs):
+            creds = self._preflight_challenge(url, kwargs)
         if creds:
             self._add_authorization_header(kwargs, creds)
 
-        with requests.Session() as session:
-            response = session.request(method, url, **kwargs)
-            if response.status_code != 402:
-                return response
+        session = self._get_session()
+        response = session.request(method, url, **kwargs)
+        if response.status_code != 402:
+            return response
+
+        # With stream=True the body of the 402 has not been read, drain it so
+        # the connection goes back to the pool.
+        _release(response)
+        new_creds = self._pay_once(url, response, creds)
+        self._add_authorization_header(kwargs, new_creds)
+        return session.request(method, url, **kwargs)
+
+    def _preflight_challenge(self, url: str, kwargs) -> Optional[L402Credentials]:
+        """Pays the challenge of a body-less probe, None if it needs no payment."""
+        probe_kwargs = {key: kwargs[key] for key in ("headers", "params", "cookies") if key in kwargs}
+        response = self._probe(self.preflight, url, **probe_kwargs)
+        if response.status_code != 402:
+            return None
+        return self._pay_once(url, response, None)
+
+    def _probe(self, method: str, url: str, **kwargs) -> requests.Response:
+        # The body is not needed, the challenge is in the headers.
+        response = self._get_session().request(method, url, stream=True, **kwargs)
+        response.close()
+        return response
+
+    def prefetch(self, urls: Iterable[str], concurrency: int = DEFAULT_PREFETCH_CONCURRENCY,
+                 method: str = "GET", **kwargs) -> Dict[str, Optional[L402Credentials]]:
+        """
+        Obtains the credentials for the given URLs ahead of time, using a pool
+        of `concurrency` threads. See `Client.prefetch`.
+
+        Only the probes and the payments run on the pool, the credentials
+        service is used from the calling thread, e.g. the connection of
+        `SqliteCredentialsService` belongs to the thread that created it.
+        """
+        scopes: Dict[str, str] = {}
+        for url in urls:
+            scopes.setdefault(url, self.policy.scope(url))
+
+        representatives: Dict[str, str] = {}
+        for url, scope in scopes.items():
+            representatives.setdefault(scope, url)
+
+        by_scope: Dict[str, Optional[L402Credentials]] = {}
+        missing = []
+        for scope, url in representatives.items():
+            by_scope[scope] = self.credentials_service.get(url)
+            if not by_scope[scope]:
+                missing.append((scope, url))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = executor.map(lambda item: self._prefetch(method, item[1], **kwargs), missing)
+            for (scope, url), (response, creds) in zip(missing, results):
+                if creds is not None:
+                    self.credentials_service.store(creds)
+                elif response.status_code == 402:
+                    creds = self._pay_once(url, response, None)
+                by_scope[scope] = creds
+
+        return {url: by_scope[scope] for url, scope in scopes.items()}
 
-            new_creds = self._handle_402_payment_required(url, response)
-            self._add_authorization_header(kwargs, new_creds)
-            return session.request(method, url, **kwargs)
+    def _prefetch(self, method: str, url: str, **kwargs):
+        """
+        Probes the URL and pays its challenge, if any, on a pool thread.
+        With a payment lock the payment is left to the calling thread,
+        electing the payer needs the credentials service.
+        """
+        response = self._probe(method, url, **kwargs)
+        if response.status_code != 402 or self.payment_lock is not None:
+            return response, None
+        return response, self._buy(url, response)
+
+def _release(response: requests.Response):
+    response.content
+    response.close()
+
+class L402Adapter(HTTPAdapter):
+    """
+    L402-aware `requests` transport adapter.
+
+    Mount it on any `requests.Session` to handle 402 Payment Required
+    responses while keeping the session's urllib3 connection pools:
+
+        session.mount("https://", L402Adapter(preimage_provider, credentials_service))
+    """
+
+    def __init__(self, preimage_provider: PreimageProvider = None,
+                 credentials_service: CredentialsService = None,
+                 policy: CredentialsPolicy = None, payment_lock: FilePaymentLock = None, **kwargs):
+        """
+        Args:
+            preimage_provider (PreimageProvider): Pays the invoices of the 402 challenges.
+            credentials_service (CredentialsService): Stores and retrieves the L402 credentials.
+            policy (CredentialsPolicy): Decides which URLs reuse the credentials paid for a URL.
+            payment_lock (FilePaymentLock): Elects a single payer per location across processes.
+            **kwargs: Passed to `HTTPAdapter`, e.g. `pool_connections` and `pool_maxsize`.
+        """
+        super().__init__(**kwargs)
+        self.client = SyncClient(preimage_provider, credentials_service, policy=policy, payment_lock=payment_lock)
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        url = request.url
+        creds = self.client.credentials_service.get(url)
+        if creds:
+            # The headers are added to a copy, the caller's request is left as is.
+            request = request.copy()
+            request.headers['Authorization'] = creds.authentication_header()
+
+        response = super().send(request, **kwargs)
+        if response.status_code != 402:
+            return response
+
+        # Drain the challenge so its connection goes back to the pool while
+        # paying, only the headers are needed.
+        _release(response)
+        new_creds = self.client._pay_once(url, response, creds)
+
+        retry = request.copy()
+        retry.headers['Authorization'] = new_creds.authentication_header()
+        new_response = super().send(retry, **kwargs)
+        new_response.history.insert(0, response)
+        return new_response
+
+class L402Session(requests.Session):
+    """A `requests.Session` with an `L402Adapter` mounted for http and https."""
+
+    def __init__(self, preimage_provider: PreimageProvider = None,
+                 credentials_service: CredentialsService = None,
+                 pool_connections: int = DEFAULT_POOLSIZE, pool_maxsize: int = DEFAULT_POOLSIZE,
+                 policy: CredentialsPolicy = None, payment_lock: FilePaymentLock = None):
+        super().__init__()
+        adapter = L402Adapter(
+            preimage_provider, credentials_service, policy, payment_lock,
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
 
 class Session:
     _instance = None
@@ -55,9 +265,17 @@ class Session:
         """Check if the request client is configured."""
         return self._configured
 
-    def configure(self, preimage_provider: PreimageProvider = None, credentials_service: CredentialsService = None) -> None:
+    def configure(self, preimage_provider: PreimageProvider = None, credentials_service: CredentialsService = None,
+                  pool_connections: int = DEFAULT_POOLSIZE, pool_maxsize: int = DEFAULT_POOLSIZE,
+                  policy: CredentialsPolicy = None, payment_lock: FilePaymentLock = None,
+                  preflight: Optional[str] = None) -> None:
         """Configure the request client with given providers and services."""
-        self._client = SyncClient(preimage_provider, credentials_service)
+        if self._client is not None:
+            self._client.close()
+        self._client = SyncClient(
+            preimage_provider, credentials_service, pool_connections, pool_maxsize, policy, payment_lock,
+            preflight,
+        )
         self._configured = True
 
     def request(self, method: str, url: str, **kwargs) -> requests.Response:
@@ -66,6 +284,12 @@ class Session:
             raise RequestException("No request client configured.")
         return self._client.request(method, url, **kwargs)
 
+    def prefetch(self, urls: Iterable[str], **kwargs) -> Dict[str, Optional[L402Credentials]]:
+        """Obtain the credentials for the given URLs ahead of time."""
+        if not self.is_configured:
+            raise RequestException("No request client configured.")
+        return self._client.prefetch(urls, **kwargs)
+
     def get(self, url: str, **kwargs) -> requests.Response:
         """Perform a GET request with optional parameters."""
         return self.request('GET', url, **kwargs)
@@ -82,4 +306,16 @@ class Session:
         """Perform a DELETE request with optional parameters."""
         return self.request('DELETE', url, **kwargs)
 
+    def patch(self, url: str, **kwargs) -> requests.Response:
+        """Perform a PATCH request with optional parameters."""
+        return self.request('PATCH', url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        """Perform a HEAD request with optional parameters."""
+        return self.request('HEAD', url, **kwargs)
+
+    def options(self, url: str, **kwargs) -> requests.Response:
+        """Perform an OPTIONS request with optional parameters."""
+        return self.request('OPTIONS', url, **kwargs)
+
 
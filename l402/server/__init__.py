@@ -1,5 +1,13 @@
 from .authenticator import Authenticator
 from .invoice_provider import InvoiceProvider
 from .macaroons import MacaroonService
-from .exceptions import InvalidOrMissingL402Header, InvalidMacaroon
-from .middlewares import Flask_l402_decorator, FastAPIL402Middleware, FastHTML_l402_decorator
\ No newline at end of file
+from .exceptions import (
+    InvalidOrMissingL402Header, InvalidMacaroon, ExpiredMacaroon, ServiceNotAllowed, UsageLimitExceeded,
+    AdmissionRejected, TooManyChallenges, ChallengesOverloaded, InvalidSessionToken,
+)
+from .admission import AdmissionController
+from .usage_meter import UsageMeter
+from .session_tokens import SessionTokens
+from .routes import RouteTable
+from .middlewares import Flask_l402_decorator, FastAPIL402Middleware, FastAPIL402Guard, FastHTML_l402_decorator
+from .downloads import PaidDownloads
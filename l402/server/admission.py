@@ -0,0 +1,176 @@
+import math
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from .exceptions import TooManyChallenges, ChallengesOverloaded
+
+
+class AdmissionController:
+    """
+    AdmissionController limits the challenges that are issued at once.
+
+    Every challenge creates an invoice with the provider and writes a root
+    key, so floods of unauthenticated requests are shed here, before that
+    work starts, and paid requests keep their latency:
+
+    - Each client has a token bucket of `burst` challenges refilled at `rate`
+      per second. Clients over it get a `TooManyChallenges` (429).
+    - At most `max_concurrency` challenges are issued at once, up to
+      `max_queue` more wait for `queue_timeout` seconds. Past that requests
+      get a `ChallengesOverloaded` (503).
+
+    Both exceptions carry the `retry_after` seconds for the Retry-After
+    header. It can be shared by requests running on different event loops and
+    threads, e.g. the ones of the Flask decorator.
+    """
+
+    def __init__(self, max_concurrency: int = 10, max_queue: int = 100, queue_timeout: float = 1.0,
+                 rate: Optional[float] = None, burst: int = 10, max_clients: int = 10_000,
+                 retry_after: int = 1):
+        """
+        Args:
+            max_concurrency (int): Challenges issued at once.
+            max_queue (int): Challenges waiting for a slot, beyond them
+                requests are rejected right away.
+            queue_timeout (float): Seconds a challenge waits for a slot.
+            rate (float): Challenges per second and client, no per-client
+                limit if not set.
+            burst (int): Challenges a client can get at once.
+            max_clients (int): Token buckets kept in memory, the least
+                recently used clients are forgotten first.
+            retry_after (int): Retry-After seconds when overloaded.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = deque()
+        self._buckets = OrderedDict()
+        self._counters = {"admitted": 0, "rate_limited": 0, "overloaded": 0}
+
+    def metrics(self) -> Dict[str, int]:
+        """Return the admission counters and the current load."""
+        with self._lock:
+            return dict(self._counters, active=self._active, queued=len(self._waiters))
+
+    @asynccontextmanager
+    async def admit(self, client_id: Optional[str] = None):
+        """
+        Hold a challenge slot for the client.
+
+        Raises:
+            TooManyChallenges: If the client is over its rate.
+            ChallengesOverloaded: If there is no slot available in time.
+        """
+        await self._acquire(client_id)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, client_id: Optional[str]):
+        # Only challenges that are issued cost the client a token, a request
+        # shed as overloaded gets it back.
+        metered = bool(self.rate) and client_id is not None
+        with self._lock:
+            if metered:
+                wait = self._take_token(client_id)
+                if wait:
+                    self._counters["rate_limited"] += 1
+                    raise TooManyChallenges("Too many challenges requested.", math.ceil(wait))
+
+            if self._active < self.max_concurrency:
+                self._active += 1
+                self._counters["admitted"] += 1
+                return
+
+            if len(self._waiters) >= self.max_queue:
+                self._counters["overloaded"] += 1
+                if metered:
+                    self._refund_token(client_id)
+                raise ChallengesOverloaded("Too many challenges pending.", self.retry_after)
+
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            self._waiters.append((loop, waiter))
+
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                try:
+                    self._waiters.remove((loop, waiter))
+                except ValueError:
+                    # The slot was handed over meanwhile. If _grant has not
+                    # run yet, it finds the waiter cancelled and gives the
+                    # slot to the next one.
+                    pass
+                if isinstance(e, asyncio.TimeoutError):
+                    self._counters["overloaded"] += 1
+                if metered:
+                    self._refund_token(client_id)
+            if waiter.done() and not waiter.cancelled():
+                # _grant already gave the slot to this waiter, e.g. when it
+                # is cancelled right after on Python 3.12+, pass it on.
+                self._release()
+            if isinstance(e, asyncio.TimeoutError):
+                raise ChallengesOverloaded("Timed out waiting for a challenge slot.", self.retry_after)
+            raise
+
+        with self._lock:
+            self._counters["admitted"] += 1
+
+    def _release(self):
+        """Hand the slot over to the oldest waiter or free it."""
+        with self._lock:
+            if not self._waiters:
+                self._active -= 1
+                return
+            loop, waiter = self._waiters.popleft()
+
+        try:
+            loop.call_soon_threadsafe(self._grant, waiter)
+        except RuntimeError:
+            # The loop of the waiter is closed.
+            self._release()
+
+    def _grant(self, waiter: asyncio.Future):
+        if waiter.done():
+            self._release()
+        else:
+            waiter.set_result(None)
+
+    def _take_token(self, client_id: str) -> float:
+        """Take a token from the client bucket, or return the seconds until there is one."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(client_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+
+        self._buckets[client_id] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+
+        return wait
+
+    def _refund_token(self, client_id: str):
+        """Give back the token taken for a challenge that was not issued."""
+        bucket = self._buckets.get(client_id)
+        if bucket is not None:
+            tokens, updated = bucket
+            self._buckets[client_id] = (min(self.burst, tokens + 1), updated)
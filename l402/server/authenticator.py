@@ -1,15 +1,24 @@
 import os
 import re
+import time
 import hashlib
 import struct
-from typing import Tuple
+from datetime import datetime
+from typing import Mapping, Optional, Tuple
 
 from binascii import hexlify, unhexlify
 from pymacaroons import Macaroon, Verifier, MACAROON_V2
 
 from .invoice_provider import InvoiceProvider
 from .macaroons import MacaroonService
-from .exceptions import InvalidOrMissingL402Header, InvalidMacaroon
+from .exceptions import InvalidOrMissingL402Header, InvalidMacaroon, ExpiredMacaroon, ServiceNotAllowed
+from .caveats import (
+    MAX_CALLS, VALID_UNTIL, SERVICES, Caveats,
+    format_caveat, format_services, is_known_caveat, parse_caveats, parse_services,
+)
+from .usage_meter import UsageMeter
+from .admission import AdmissionController
+from .session_tokens import SessionTokens
     
 # Parse the L402 header pattern: "L402 <macaroon>:<preimage>"
 L402_HEADER_PATTERN = re.compile(r'^L402\s+(.*?):(.*?)$')
@@ -22,13 +31,67 @@ class Authenticator:
     It can be used to generate new challenges for requests that do not include an L402 header,
     and also validate the L402 headers in the incoming requests.
     """
-    def __init__(self, location: str, invoice_provider: InvoiceProvider, macaroon_service: MacaroonService):
+    def __init__(self, location: str, invoice_provider: InvoiceProvider, macaroon_service: MacaroonService,
+                 usage_meter: UsageMeter = None, gc_interval: float = 3600.0,
+                 admission: AdmissionController = None, session_tokens: SessionTokens = None):
+        """
+        Args:
+            location (str): The location of the minted macaroons.
+            invoice_provider (InvoiceProvider): Creates the invoices of the challenges.
+            macaroon_service (MacaroonService): Stores the root keys of the macaroons.
+            usage_meter (UsageMeter): Counts the calls of usage-metered macaroons.
+            gc_interval (float): Minimum seconds between the deletions of
+                expired root keys, triggered by `new_challenge`.
+            admission (AdmissionController): Limits the challenges issued at
+                once and per client, no limit if not set.
+            session_tokens (SessionTokens): Issues the session tokens that
+                stand in for validated L402 headers, none if not set.
+        """
         self.location = location
         self.invoice_provider = invoice_provider
         self.macaroon_service = macaroon_service
+        self.usage_meter = usage_meter or UsageMeter(macaroon_service)
+        self.gc_interval = gc_interval
+        self._next_gc = time.monotonic() + gc_interval
+        self.admission = admission
+        self.session_tokens = session_tokens
 
-    async def new_challenge(self, amount: int, currency: str, description: str) -> Tuple[str, str]:
-        """Generate a new L402 challenge with a new macaroon and invoice."""
+    async def new_challenge(self, amount: int, currency: str, description: str,
+                            max_calls: Optional[int] = None, expires_in: Optional[int] = None,
+                            services: Optional[Mapping[str, int]] = None,
+                            client_id: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Generate a new L402 challenge with a new macaroon and invoice.
+
+        With `max_calls`, the macaroon is usage-metered: the payment buys that
+        many calls, counted by the `UsageMeter`, instead of unlimited use. The
+        macaroon service of the meter must support usage metering, otherwise
+        a RuntimeError is raised before charging anyone.
+
+        With `expires_in`, the macaroon is valid for that many seconds. Expired
+        macaroons are rejected before any storage lookup and their root keys
+        are deleted from the macaroon service.
+
+        With `services`, a mapping of service names to tiers, one payment
+        unlocks all the routes of those services and only them.
+
+        With an admission controller, `client_id` identifies the requester
+        for its rate limit and `AdmissionRejected` is raised when the
+        challenge is shed.
+        """
+        if max_calls is not None and not self.usage_meter.macaroon_service.supports_usage_metering():
+            # The paid calls could never be counted, so every one would fail.
+            raise RuntimeError(
+                f"{type(self.usage_meter.macaroon_service).__name__} does not support usage metering."
+            )
+
+        if self.admission is None:
+            return await self._new_challenge(amount, currency, description, max_calls, expires_in, services)
+
+        async with self.admission.admit(client_id):
+            return await self._new_challenge(amount, currency, description, max_calls, expires_in, services)
+
+    async def _new_challenge(self, amount, currency, description, max_calls, expires_in, services):
         # Create a new invoice
         payment_request, payment_hash  = await self.invoice_provider.create_invoice(
             amount, currency, f"L402 Challenge: {description}",
@@ -48,21 +111,108 @@ class Authenticator:
             key=root_key,
         )
 
-        # TODO(positiveblue): Add support for custom caveats.
+        if max_calls is not None:
+            mac.add_first_party_caveat(format_caveat(MAX_CALLS, max_calls))
+
+        if services:
+            mac.add_first_party_caveat(format_caveat(SERVICES, format_services(services)))
+
+        expires_at = None
+        if expires_in is not None:
+            valid_until = int(time.time()) + expires_in
+            mac.add_first_party_caveat(format_caveat(VALID_UNTIL, valid_until))
+            expires_at = datetime.fromtimestamp(valid_until)
 
         encoded_macaroon = mac.serialize()
-        await self.macaroon_service.insert_root_key(token_id, root_key, encoded_macaroon)
+        if expires_at is None:
+            await self.macaroon_service.insert_root_key(token_id, root_key, encoded_macaroon)
+        else:
+            await self.macaroon_service.insert_root_key(token_id, root_key, encoded_macaroon, expires_at=expires_at)
+
+        await self._collect_expired_root_keys()
 
         return encoded_macaroon, payment_request
 
-    async def validate_l402_header(self, header: str):
-        """Validate the L402 header and its contents."""
+    async def _collect_expired_root_keys(self):
+        """Delete the expired root keys, at most once every gc_interval seconds."""
+        now = time.monotonic()
+        if now < self._next_gc:
+            return
+
+        self._next_gc = now + self.gc_interval
+        await self.macaroon_service.delete_expired_root_keys()
+
+    async def validate_l402_header(self, header: str, service: Optional[str] = None, tier: int = 0):
+        """
+        Validate the L402 header and its contents.
+
+        `service` and `tier` describe the requested route. Macaroons with a
+        services caveat are only valid for the services it lists, with at
+        least the given tier.
+        """
+        await self._validate_l402_header(header, service, tier)
+
+    async def validate_l402_caveats(self, header: str, service: Optional[str] = None, tier: int = 0) -> Caveats:
+        """
+        Validate the L402 header like `validate_l402_header` and return the
+        caveats its macaroon is bound by.
+        """
+        _, caveats = await self._validate_l402_header(header, service, tier)
+        return self._bound_caveats(caveats)
+
+    async def new_session_token(self, header: str, service: Optional[str] = None, tier: int = 0) -> str:
+        """
+        Validate the L402 header like `validate_l402_header` and return a
+        session token carrying its token id and caveats, for the following
+        requests to present instead.
+        """
+        if self.session_tokens is None:
+            raise RuntimeError("The authenticator has no session tokens configured.")
+
+        token_id, caveats = await self._validate_l402_header(header, service, tier)
+        caveats = self._bound_caveats(caveats)
+
+        return self.session_tokens.issue(
+            token_id,
+            valid_until=caveats.valid_until,
+            max_calls=caveats.max_calls,
+            services=caveats.services,
+        )
+
+    async def validate_session_token(self, token: str, service: Optional[str] = None, tier: int = 0):
+        """
+        Validate a session token issued by `new_session_token`, with a single
+        HMAC and, for usage-metered macaroons, the usage meter.
+        """
+        if self.session_tokens is None:
+            raise RuntimeError("The authenticator has no session tokens configured.")
+
+        session = self.session_tokens.verify(token)
+
+        if session.services is not None:
+            if service is None:
+                raise ServiceNotAllowed("Session is restricted to its services.")
+            if session.services.get(service, -1) < tier:
+                raise ServiceNotAllowed(f"Session does not unlock service {service} at tier {tier}.")
+
+        if session.max_calls is not None:
+            await self.usage_meter.consume(session.token_id, session.max_calls)
+
+    async def _validate_l402_header(self, header: str, service: Optional[str], tier: int):
+        """Validate the L402 header, return the token id and caveats of its macaroon."""
         encoded_macaroon, preimage = self._parse_l402_header(header)
         mac, payment_hash, token_id = self._decode_macaroon(encoded_macaroon)
 
+        # Expired or out of scope macaroons are rejected before any I/O.
+        caveats = parse_caveats(mac)
+        self._validate_expiry(caveats)
+        self._validate_services(caveats, service, tier)
+
         self._validate_preimage(preimage, payment_hash)
         await self._validate_macaroon(mac, token_id)
-        await self._validate_caveats(mac)
+        await self._validate_caveats(caveats, token_id)
+
+        return token_id, caveats
 
     def _encode_identifier(self, version, payment_hash, token_id):
         """Encode the L402 identifier."""
@@ -115,12 +265,63 @@ class Authenticator:
         root_key = await self.macaroon_service.get_root_key(token_id)
         
         verifier = Verifier()
+        # The caveats are enforced by _validate_caveats, here they only need
+        # to be known. Unknown caveats make the verification fail.
+        verifier.satisfy_general(is_known_caveat)
         try:
             verifier.verify(mac, root_key)
         except Exception:
             raise InvalidMacaroon("Macaroon verification failed.")
     
-    async def _validate_caveats(self, mac):
-        """Validate the macaroon caveats."""
-        # TODO(positiveblue): Implement custom caveats validation
-        pass
\ No newline at end of file
+    def _validate_expiry(self, caveats):
+        """Validate the valid_until caveats, the earliest one applies."""
+        valid_until = self._min_caveat(caveats, VALID_UNTIL)
+        if valid_until is not None and time.time() > valid_until:
+            raise ExpiredMacaroon("Macaroon expired.")
+
+    def _validate_services(self, caveats, service: Optional[str], tier: int):
+        """Validate the services caveats, every one of them must allow the service."""
+        if SERVICES not in caveats:
+            return
+
+        if service is None:
+            raise ServiceNotAllowed("Macaroon is restricted to its services.")
+
+        for value in caveats[SERVICES]:
+            try:
+                services = parse_services(value)
+            except ValueError:
+                raise InvalidMacaroon("Invalid services caveat.")
+
+            if services.get(service, -1) < tier:
+                raise ServiceNotAllowed(f"Macaroon does not unlock service {service} at tier {tier}.")
+
+    async def _validate_caveats(self, caveats, token_id):
+        """Validate the macaroon caveats, once the macaroon is verified."""
+        max_calls = self._min_caveat(caveats, MAX_CALLS)
+        if max_calls is not None:
+            await self.usage_meter.consume(token_id, max_calls)
+
+    def _bound_caveats(self, caveats) -> Caveats:
+        """Return the caveats all the values of each parsed caveat of a macaroon allow."""
+        services = None
+        if SERVICES in caveats:
+            # Every services caveat must allow a service, keep the
+            # services and the tiers all of them allow.
+            allowed = [parse_services(value) for value in caveats[SERVICES]]
+            services = {
+                name: min(s[name] for s in allowed)
+                for name in allowed[0] if all(name in s for s in allowed)
+            }
+
+        return Caveats(self._min_caveat(caveats, VALID_UNTIL), self._min_caveat(caveats, MAX_CALLS), services)
+
+    def _min_caveat(self, caveats, name: str) -> Optional[int]:
+        """Return the lowest value of an integer caveat, None if the macaroon has none."""
+        if name not in caveats:
+            return None
+
+        try:
+            return min(int(value) for value in caveats[name])
+        except ValueError:
+            raise InvalidMacaroon(f"Invalid {name} caveat.")
\ No newline at end of file
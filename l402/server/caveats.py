@@ -0,0 +1,77 @@
+from functools import lru_cache
+from typing import Dict, List, Mapping, NamedTuple, Optional
+
+from pymacaroons import Macaroon
+
+# First-party caveats are "<name>=<value>" conditions added to the macaroon
+# by `Authenticator.new_challenge`.
+MAX_CALLS = "max_calls"
+# Unix timestamp, in seconds, after which the macaroon is no longer valid.
+VALID_UNTIL = "valid_until"
+# Comma-separated "<service>:<tier>" pairs the macaroon unlocks.
+SERVICES = "services"
+
+KNOWN_CAVEATS = frozenset([MAX_CALLS, VALID_UNTIL, SERVICES])
+
+
+class Caveats(NamedTuple):
+    """The caveats a macaroon is bound by, each None if it has none."""
+    valid_until: Optional[int]
+    max_calls: Optional[int]
+    services: Optional[Mapping[str, int]]
+
+
+def format_caveat(name: str, value) -> str:
+    """Return the caveat condition for the given name and value."""
+    return f"{name}={value}"
+
+
+def caveat_name(condition: str) -> str:
+    """Return the name of a caveat condition."""
+    return condition.split("=", 1)[0].strip()
+
+
+def is_known_caveat(condition) -> bool:
+    """Whether the caveat is one this package knows how to enforce."""
+    if isinstance(condition, bytes):
+        condition = condition.decode()
+    return "=" in condition and caveat_name(condition) in KNOWN_CAVEATS
+
+
+def parse_caveats(mac: Macaroon) -> Dict[str, List[str]]:
+    """
+    Return the values of the first-party caveats of a macaroon by name.
+
+    Anyone holding a macaroon can add caveats to it, so a caveat may appear
+    more than once and all its values must hold, e.g. the lowest `max_calls`.
+    """
+    caveats = {}
+    for caveat in mac.first_party_caveats():
+        condition = caveat.caveat_id
+        if isinstance(condition, bytes):
+            condition = condition.decode()
+        if "=" in condition:
+            name, value = condition.split("=", 1)
+            caveats.setdefault(name.strip(), []).append(value.strip())
+    return caveats
+
+
+def format_services(services: Mapping[str, int]) -> str:
+    """Return the value of a services caveat, e.g. "search:0,export:1"."""
+    return ",".join(f"{name}:{tier}" for name, tier in services.items())
+
+
+@lru_cache(maxsize=1024)
+def parse_services(value: str) -> Mapping[str, int]:
+    """
+    Return the tier of each service of a services caveat. The result is
+    cached, macaroons minted for the same bundle share the same caveat.
+
+    Raises:
+        ValueError: If the caveat is malformed.
+    """
+    services = {}
+    for service in value.split(","):
+        name, tier = service.split(":")
+        services[name.strip()] = int(tier)
+    return services
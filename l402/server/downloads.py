@@ -0,0 +1,196 @@
+import os
+import re
+import time
+import hashlib
+from collections import OrderedDict
+from email.utils import formatdate
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from anyio import open_file
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+from .authenticator import Authenticator
+from .exceptions import AdmissionRejected
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+
+
+class PaidDownloads:
+    """
+    Serves files behind an L402 paywall with HTTP Range support.
+
+    Resumed and parallel downloads send many Range requests with the same
+    credentials. Once a download of the file is validated, its Range requests
+    skip validation for `session_ttl` seconds, or until the macaroon expires
+    if that is sooner. Requests for the whole file always start a new
+    download and are validated every time. Usage-metered macaroons are never
+    cached, every request they are used for is charged, Range ones included,
+    as a range can cover the whole file.
+
+    Whole files are sent with Starlette's `FileResponse`, which uses the
+    server's zero-copy `pathsend` extension when it is available. Byte ranges
+    are streamed from the file in chunks.
+    """
+
+    def __init__(self, authenticator: Authenticator, session_ttl: float = 300.0, max_sessions: int = 10_000):
+        """
+        Args:
+            authenticator (Authenticator): Mints and validates the macaroons.
+            session_ttl (float): Seconds a validated header is trusted for a file.
+            max_sessions (int): Maximum number of download sessions kept in
+                memory, the least recently used ones are forgotten first.
+        """
+        self.authenticator = authenticator
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+
+    async def serve(self, req: Request, path: str, pricing: Tuple, filename: str = None,
+                    media_type: str = None, service: str = None, tier: int = 0) -> Response:
+        """
+        Return the file if the request is paid for, a 402 challenge otherwise.
+
+        Args:
+            req (Request): The download request.
+            path (str): The file to serve.
+            pricing (Tuple): The `new_challenge` arguments of the file, i.e.
+                (amount, currency, description), optionally followed by
+                max_calls and expires_in.
+            filename (str): The filename of the Content-Disposition header.
+            media_type (str): The media type of the file.
+            service (str): The service of the file, see `Authenticator.new_challenge`.
+            tier (int): The tier of the service required.
+        """
+        header = req.headers.get("Authorization")
+        continuation = req.headers.get("range") is not None
+        if header and await self._is_paid(header, path, service, tier, continuation):
+            return file_response(req, path, filename, media_type)
+
+        services = {"services": {service: tier}} if service is not None else {}
+        try:
+            macaroon, payment_request = await self.authenticator.new_challenge(
+                *pricing, **services, client_id=req.client.host if req.client else None,
+            )
+        except AdmissionRejected as e:
+            return Response(str(e), status_code=e.status_code, headers={"Retry-After": str(e.retry_after)})
+
+        resp = Response("Payment Required", status_code=402)
+        resp.headers["WWW-Authenticate"] = f'L402 macaroon="{macaroon}", invoice="{payment_request}"'
+        return resp
+
+    async def _is_paid(self, header: str, path: str, service: Optional[str], tier: int,
+                       continuation: bool) -> bool:
+        key = hashlib.sha256(f"{header}\n{path}".encode()).digest()
+        now = time.monotonic()
+
+        expires_at = self._sessions.get(key)
+        if expires_at is not None:
+            if continuation and expires_at > now:
+                self._sessions.move_to_end(key)
+                return True
+            del self._sessions[key]
+
+        try:
+            caveats = await self.authenticator.validate_l402_caveats(header, service, tier)
+        except Exception:
+            return False
+
+        if caveats.max_calls is not None:
+            return True
+
+        expires_at = now + self.session_ttl
+        if caveats.valid_until is not None:
+            expires_at = min(expires_at, now + caveats.valid_until - time.time())
+        self._sessions[key] = expires_at
+        if len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return True
+
+
+def file_response(req: Request, path: str, filename: str = None, media_type: str = None) -> Response:
+    """
+    Return the file, or the byte range of it asked by a single-range Range
+    header. If-Range mismatching requests get the whole file.
+    """
+    stat_result = os.stat(path)
+    size = stat_result.st_size
+    headers = {
+        "accept-ranges": "bytes",
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "etag": _etag(stat_result),
+    }
+
+    byte_range = req.headers.get("range")
+    if_range = req.headers.get("if-range")
+    if byte_range is None or (if_range is not None and if_range not in (headers["etag"], headers["last-modified"])):
+        return FileResponse(path, headers=headers, media_type=media_type, filename=filename, stat_result=stat_result)
+
+    match = RANGE_PATTERN.match(byte_range.strip())
+    if match is None:
+        # Multiple or malformed ranges. Recent Starlette versions answer them
+        # with a multipart response, older ones with the whole file, which
+        # is a valid answer too.
+        return FileResponse(path, headers=headers, media_type=media_type, filename=filename, stat_result=stat_result)
+
+    start, end = _parse_range(match.group(1), match.group(2), size)
+    if start is None:
+        return Response(status_code=416, headers={"content-range": f"bytes */{size}", **headers})
+
+    headers["content-range"] = f"bytes {start}-{end}/{size}"
+    headers["content-length"] = str(end - start + 1)
+    if filename is not None:
+        headers["content-disposition"] = _content_disposition(filename)
+
+    return StreamingResponse(
+        _read_range(path, start, end),
+        status_code=206,
+        headers=headers,
+        media_type=media_type or "application/octet-stream",
+    )
+
+
+def _etag(stat_result: os.stat_result) -> str:
+    """The ETag of Starlette's FileResponse, so If-Range works across both."""
+    etag_base = str(stat_result.st_mtime) + "-" + str(stat_result.st_size)
+    return f'"{hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"'
+
+
+def _content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def _parse_range(start: str, end: str, size: int):
+    """Return the inclusive byte range, (None, None) if it is not satisfiable."""
+    if not start and not end:
+        return None, None
+
+    if not start:
+        # Suffix range, the last `end` bytes.
+        length = int(end)
+        if length == 0 or size == 0:
+            return None, None
+        return max(size - length, 0), size - 1
+
+    first = int(start)
+    last = int(end) if end else size - 1
+    if first >= size or last < first:
+        return None, None
+    return first, min(last, size - 1)
+
+
+async def _read_range(path: str, start: int, end: int):
+    async with await open_file(path, "rb") as f:
+        await f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
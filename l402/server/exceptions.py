@@ -4,4 +4,36 @@ class InvalidOrMissingL402Header(Exception):
 
 class InvalidMacaroon(Exception):
     """Exception raised for errors when validating macaroons."""
-    pass
\ No newline at end of file
+    pass
+
+class ExpiredMacaroon(InvalidMacaroon):
+    """Exception raised when the macaroon is past its valid_until caveat."""
+    pass
+
+class ServiceNotAllowed(InvalidMacaroon):
+    """Exception raised when the macaroon does not unlock the requested service."""
+    pass
+
+class UsageLimitExceeded(Exception):
+    """Exception raised when a usage-metered macaroon has no calls left."""
+    pass
+
+class AdmissionRejected(Exception):
+    """Exception raised when a challenge is not issued to shed load."""
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TooManyChallenges(AdmissionRejected):
+    """Exception raised when a client requests challenges over its rate."""
+    status_code = 429
+
+class ChallengesOverloaded(AdmissionRejected):
+    """Exception raised when too many challenges are being issued."""
+    status_code = 503
+
+class InvalidSessionToken(Exception):
+    """Exception raised for malformed, forged or expired session tokens."""
+    pass
@@ -1,3 +1,4 @@
 from .invoice_provider import InvoiceProvider
 from .alby_api import AlbyAPI
-from .fewsats_provider import FewsatsInvoiceProvider
\ No newline at end of file
+from .fewsats_provider import FewsatsInvoiceProvider
+from .local_provider import LocalInvoiceProvider
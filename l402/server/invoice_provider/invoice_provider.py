@@ -1,6 +1,10 @@
-from typing import Tuple
+import asyncio
+from typing import Iterable, List, Tuple
 from abc import ABC, abstractmethod
 
+# Default number of concurrent `create_invoice` calls made by `create_invoices`.
+DEFAULT_BATCH_CONCURRENCY = 10
+
 class InvoiceProvider(ABC):
     """Abstract Base Class (ABC) for an Invoice Provider.
 
@@ -24,3 +28,38 @@ class InvoiceProvider(ABC):
             NotImplementedError: This method must be implemented by any concrete class that inherits from this ABC.
         """
         pass
+
+    async def create_invoices(
+        self,
+        requests: Iterable[Tuple[int, str, str]],
+        max_concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+    ) -> List[Tuple[str, str]]:
+        """Create several invoices at once.
+
+        The default implementation calls `create_invoice` concurrently, with at
+        most `max_concurrency` calls in flight. Providers whose API supports
+        bulk creation should override it with a native implementation.
+
+        Args:
+            requests (Iterable[Tuple[int, str, str]]): The (amount, currency, description) of each invoice.
+            max_concurrency (int): The maximum number of concurrent `create_invoice` calls.
+
+        Returns:
+            List[Tuple[str, str]]: The payment_request and payment_hash of each invoice, in the same order as the requests.
+
+        Raises:
+            Exception: The first error raised by `create_invoice`, the remaining calls are cancelled.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def create(amount: int, currency: str, description: str) -> Tuple[str, str]:
+            async with semaphore:
+                return await self.create_invoice(amount, currency, description)
+
+        tasks = [asyncio.ensure_future(create(*request)) for request in requests]
+        try:
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
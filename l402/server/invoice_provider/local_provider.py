@@ -0,0 +1,170 @@
+import os
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+from .invoice_provider import InvoiceProvider, DEFAULT_BATCH_CONCURRENCY
+
+# Bech32 alphabet and BOLT11 tagged field types.
+# See https://github.com/lightning/bolts/blob/master/11-payment-encoding.md
+BECH32_CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+BECH32_GENERATOR = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+
+TAG_PAYMENT_HASH = 1
+TAG_DESCRIPTION = 13
+TAG_EXPIRY = 6
+
+SATS_CURRENCIES = ("sat", "sats")
+
+# Tagged field lengths are two 5-bit words, 1023 words hold 639 bytes.
+MAX_FIELD_WORDS = 1023
+MAX_DESCRIPTION_BYTES = MAX_FIELD_WORDS * 5 // 8
+
+
+def _bech32_polymod(values):
+    chk = 1
+    for value in values:
+        top = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            chk ^= BECH32_GENERATOR[i] if ((top >> i) & 1) else 0
+    return chk
+
+
+def _bech32_hrp_expand(hrp: str):
+    return [ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp]
+
+
+def _bech32_encode(hrp: str, data) -> str:
+    """Encode 5-bit words into a bech32 string with its checksum."""
+    polymod = _bech32_polymod(_bech32_hrp_expand(hrp) + data + [0] * 6) ^ 1
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + "1" + "".join(BECH32_CHARSET[d] for d in data + checksum)
+
+
+def _to_words(data: bytes):
+    """Convert bytes into 5-bit words, padding the last word with zeros."""
+    acc, bits, words = 0, 0, []
+    for byte in data:
+        acc = (acc << 8) | byte
+        bits += 8
+        while bits >= 5:
+            bits -= 5
+            words.append((acc >> bits) & 31)
+    if bits:
+        words.append((acc << (5 - bits)) & 31)
+    return words
+
+
+def _int_to_words(value: int, length: Optional[int] = None):
+    """Big-endian 5-bit words for an integer, minimal length unless given."""
+    words = []
+    while value:
+        words.append(value & 31)
+        value >>= 5
+    words = list(reversed(words)) or [0]
+    if length is not None:
+        words = [0] * (length - len(words)) + words
+    return words
+
+
+def _tagged_field(tag: int, words):
+    if len(words) > MAX_FIELD_WORDS:
+        raise ValueError(f"Tagged field {tag} is too long: {len(words)} words.")
+    return [tag] + _int_to_words(len(words), 2) + words
+
+
+def encode_bolt11(hrp: str, payment_hash: bytes, description: str, expiry: int,
+                  timestamp: Optional[int] = None) -> str:
+    """
+    Encode a BOLT11-style payment request.
+
+    The signature is random bytes, so the invoice is syntactically valid but
+    it cannot be paid on a real Lightning node. Descriptions longer than the
+    639 bytes a field holds are truncated.
+    """
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    # Cut on a character boundary, the description stays valid UTF-8.
+    description = description.encode()[:MAX_DESCRIPTION_BYTES].decode(errors="ignore")
+
+    data = _int_to_words(timestamp, 7)
+    data += _tagged_field(TAG_PAYMENT_HASH, _to_words(payment_hash))
+    data += _tagged_field(TAG_DESCRIPTION, _to_words(description.encode()))
+    data += _tagged_field(TAG_EXPIRY, _int_to_words(expiry))
+    data += _to_words(os.urandom(65))
+
+    return _bech32_encode(hrp, data)
+
+
+class LocalInvoiceProvider(InvoiceProvider):
+    """
+    In-process InvoiceProvider for development, benchmarks and tests.
+
+    Invoices are generated locally with a random preimage and the matching
+    payment hash. The preimages are kept in memory so that a
+    `LocalPreimageProvider` can "pay" them without any network access.
+    """
+
+    def __init__(self, network: str = "bcrt", expiry: int = 3600, max_invoices: int = 100_000):
+        """Initialize the LocalInvoiceProvider.
+
+        Args:
+            network (str): The BOLT11 network prefix. Defaults to regtest ("bcrt").
+            expiry (int): The invoice expiry in seconds.
+            max_invoices (int): The maximum number of unpaid preimages kept in
+                memory, the oldest ones are dropped first.
+        """
+        self.network = network
+        self.expiry = expiry
+        self.max_invoices = max_invoices
+        self.preimages = OrderedDict()
+
+    def _hrp(self, amount: int, currency: str) -> str:
+        hrp = f"ln{self.network}"
+        # Only amounts in sats can be encoded in the invoice, other currencies
+        # produce amountless invoices.
+        if currency.lower() in SATS_CURRENCIES and amount > 0:
+            # 1 sat == 10 nano-bitcoin.
+            hrp += f"{amount * 10}n"
+        return hrp
+
+    def new_invoice(self, amount: int, currency: str, description: str) -> Tuple[str, str]:
+        """Create a new invoice and remember its preimage."""
+        preimage = os.urandom(32)
+        payment_hash = hashlib.sha256(preimage).digest()
+
+        payment_request = encode_bolt11(
+            self._hrp(amount, currency), payment_hash, description, self.expiry,
+        )
+
+        self.preimages[payment_request] = preimage.hex()
+        if len(self.preimages) > self.max_invoices:
+            self.preimages.popitem(last=False)
+
+        return payment_request, payment_hash.hex()
+
+    def lookup_preimage(self, payment_request: str) -> Optional[str]:
+        """Return the preimage of an invoice created by this provider."""
+        return self.preimages.get(payment_request)
+
+    async def create_invoice(self, amount: int, currency: str, description: str) -> Tuple[str, str]:
+        """Create a new local invoice.
+
+        Args:
+            amount (int): The amount of the invoice.
+            currency (str): The currency of the invoice.
+            description (str): A brief description of the purpose of the invoice.
+
+        Returns:
+            Tuple[str, str]: A tuple containing the payment_request and payment_hash of the invoice.
+        """
+        return self.new_invoice(amount, currency, description)
+
+    async def create_invoices(
+        self,
+        requests: Iterable[Tuple[int, str, str]],
+        max_concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+    ) -> List[Tuple[str, str]]:
+        """Create several local invoices at once, `max_concurrency` is ignored."""
+        return [self.new_invoice(*request) for request in requests]
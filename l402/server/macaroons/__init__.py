@@ -1,5 +1,6 @@
 from .macaroon_service import MacaroonService
 from .sqlite_macaroon_service import SqliteMacaroonService
+from .shared_memory_macaroon_service import SharedMemoryMacaroonService
 
 # import like this to avoid adding the psycopg2 dependency to the package
 def PostgreSQLMacaroonService(*args, **kwargs):
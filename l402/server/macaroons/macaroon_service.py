@@ -1,4 +1,6 @@
 from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Optional, Tuple
 
 class MacaroonService(ABC):
     """
@@ -9,6 +11,9 @@ class MacaroonService(ABC):
     async def insert_root_key(self, token_id: bytes, root_key: bytes, macaroon: str):
         """
         Insert a new root key in the macaroon service.
+
+        Services that support expiring macaroons also accept an `expires_at`
+        keyword argument, the datetime after which the root key can be deleted.
         """
         pass
 
@@ -17,4 +22,40 @@ class MacaroonService(ABC):
         """
         Get the root key for the given token id.
         """
-        pass
\ No newline at end of file
+        pass
+
+    async def get_root_key_with_expiry(self, token_id: bytes) -> Tuple[Optional[bytes], Optional[datetime]]:
+        """
+        Get the root key for the given token id and the datetime it expires
+        at, None if it does not. Services that do not track expiry return
+        the root key only.
+        """
+        return await self.get_root_key(token_id), None
+
+    def supports_usage_metering(self) -> bool:
+        """
+        Whether the service records the usage of the tokens, i.e. implements
+        `get_usage` and `record_usage`.
+        """
+        cls = type(self)
+        return cls.get_usage is not MacaroonService.get_usage and cls.record_usage is not MacaroonService.record_usage
+
+    async def get_usage(self, token_id: bytes) -> int:
+        """
+        Get the number of calls recorded for the given token id, used by
+        usage-metered macaroons.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support usage metering")
+
+    async def record_usage(self, usage: Dict[bytes, int]):
+        """
+        Add the given number of calls to the usage of each token id.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support usage metering")
+
+    async def delete_expired_root_keys(self) -> int:
+        """
+        Delete the root keys whose macaroons have expired and return how many
+        were deleted. Services that do not track expiry keep all the keys.
+        """
+        return 0
@@ -1,5 +1,6 @@
 import psycopg2
 from datetime import datetime
+from typing import Dict, Optional, Tuple
 from l402.server.macaroons import MacaroonService
 
 class PostgreSQLMacaroonService(MacaroonService):
@@ -14,23 +15,34 @@ class PostgreSQLMacaroonService(MacaroonService):
                 token_id BYTEA UNIQUE NOT NULL,
                 root_key BYTEA NOT NULL,
                 macaroon TEXT,
-                created_at TIMESTAMP NOT NULL
+                created_at TIMESTAMP NOT NULL,
+                expires_at TIMESTAMP
             );
             
             CREATE INDEX IF NOT EXISTS macaroons_token_id_idx ON macaroons (token_id);
+
+            ALTER TABLE macaroons ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP;
+            CREATE INDEX IF NOT EXISTS macaroons_expires_at_idx ON macaroons (expires_at);
+
+            CREATE TABLE IF NOT EXISTS macaroon_usage (
+                token_id BYTEA PRIMARY KEY,
+                calls BIGINT NOT NULL,
+                updated_at TIMESTAMP NOT NULL
+            );
         """
         with self.conn.cursor() as cur:
             cur.execute(create_table_sql)
         self.conn.commit()
 
-    async def insert_root_key(self, token_id: bytes, root_key: bytes, macaroon: str):
+    async def insert_root_key(self, token_id: bytes, root_key: bytes, macaroon: str,
+                              expires_at: Optional[datetime] = None):
         insert_sql = """
-            INSERT INTO macaroons (token_id, root_key, macaroon, created_at)
-            VALUES (%s, %s, %s, %s);
+            INSERT INTO macaroons (token_id, root_key, macaroon, created_at, expires_at)
+            VALUES (%s, %s, %s, %s, %s);
         """
         created_at = datetime.now()
         with self.conn.cursor() as cur:
-            cur.execute(insert_sql, (token_id, root_key, macaroon, created_at))
+            cur.execute(insert_sql, (token_id, root_key, macaroon, created_at, expires_at))
         self.conn.commit()
 
     async def get_root_key(self, token_id: bytes) -> bytes:
@@ -44,5 +56,52 @@ class PostgreSQLMacaroonService(MacaroonService):
             row = cur.fetchone()
         return row[0] if row else None
 
+    async def get_root_key_with_expiry(self, token_id: bytes) -> Tuple[Optional[bytes], Optional[datetime]]:
+        query_sql = """
+            SELECT root_key, expires_at
+            FROM macaroons
+            WHERE token_id = %s
+        """
+        with self.conn.cursor() as cur:
+            cur.execute(query_sql, (token_id,))
+            row = cur.fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    async def delete_expired_root_keys(self) -> int:
+        now = datetime.now()
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                DELETE FROM macaroon_usage
+                WHERE token_id IN (SELECT token_id FROM macaroons WHERE expires_at < %s)
+            """, (now,))
+            cur.execute("DELETE FROM macaroons WHERE expires_at < %s", (now,))
+            deleted = cur.rowcount
+        self.conn.commit()
+        return deleted
+
+    async def get_usage(self, token_id: bytes) -> int:
+        query_sql = """
+            SELECT calls
+            FROM macaroon_usage
+            WHERE token_id = %s
+        """
+        with self.conn.cursor() as cur:
+            cur.execute(query_sql, (token_id,))
+            row = cur.fetchone()
+        return row[0] if row else 0
+
+    async def record_usage(self, usage: Dict[bytes, int]):
+        upsert_sql = """
+            INSERT INTO macaroon_usage (token_id, calls, updated_at)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (token_id) DO UPDATE SET
+                calls = macaroon_usage.calls + EXCLUDED.calls,
+                updated_at = EXCLUDED.updated_at;
+        """
+        updated_at = datetime.now()
+        with self.conn.cursor() as cur:
+            cur.executemany(upsert_sql, [(token_id, calls, updated_at) for token_id, calls in usage.items()])
+        self.conn.commit()
+
     def __del__(self):
         self.conn.close()
\ No newline at end of file
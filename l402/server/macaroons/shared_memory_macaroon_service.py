@@ -0,0 +1,214 @@
+import os
+import mmap
+import stat
+import struct
+import tempfile
+import zlib
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+# fcntl is only available on POSIX systems, import it like this so that the
+# rest of the package keeps working elsewhere.
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from .macaroon_service import MacaroonService
+
+MAGIC = b"L402RKC1"
+
+# magic, number of slots.
+HEADER = struct.Struct("<8sQ")
+
+# seq, token_id, root_key, expires_at (unix seconds, 0 if it does not
+# expire), crc32 of the previous fields but seq.
+SLOT = struct.Struct("<I32s32sqI")
+SEQ = struct.Struct("<I")
+
+TOKEN_ID_SIZE = 32
+
+
+class SharedMemoryMacaroonService(MacaroonService):
+    """
+    MacaroonService wrapper that caches root keys in a memory-mapped file
+    shared by all the worker processes of a host.
+
+    The cache is a fixed-size, direct-mapped hash table: each token id maps to
+    one slot and a new entry replaces whatever was there. Reads take no lock,
+    every slot has a sequence number, odd while it is being written, and a
+    checksum, so torn or concurrent reads are detected and treated as misses.
+    Writers lock the byte range of their slot with `fcntl.lockf`.
+
+    Root keys are secrets. By default the file lives in a directory private
+    to the server user, under $XDG_RUNTIME_DIR or the temporary directory.
+    The file is created with mode 0600, and an existing one is only used if
+    the user owns it and nobody else can access it.
+    """
+
+    def __init__(self, service: MacaroonService, path: str = None, slots: int = 65536):
+        """
+        Args:
+            service (MacaroonService): The macaroon service that owns the root keys.
+            path (str): The file shared by the workers, in a directory only
+                the server user can write to. A private directory is used
+                if not set.
+            slots (int): The number of entries of the table, it is fixed once
+                the file is created.
+        """
+        if fcntl is None:
+            raise RuntimeError("SharedMemoryMacaroonService requires fcntl, which is not available on this platform")
+
+        self.service = service
+        self.path = path or os.path.join(_private_dir(), "root-keys.cache")
+        self.slots = slots
+
+        self._fd = _open_private(self.path)
+        try:
+            self._init_file()
+            self._mmap = mmap.mmap(self._fd, HEADER.size + slots * SLOT.size)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    def _init_file(self):
+        """Sizes a new file or checks that an existing one matches `slots`."""
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, HEADER.size, 0)
+        try:
+            header = os.pread(self._fd, HEADER.size, 0)
+            if len(header) < HEADER.size:
+                os.ftruncate(self._fd, HEADER.size + self.slots * SLOT.size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, self.slots), 0)
+                return
+
+            magic, slots = HEADER.unpack(header)
+            if magic != MAGIC or slots != self.slots:
+                raise ValueError(f"{self.path} is not a root key cache with {self.slots} slots")
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, HEADER.size, 0)
+
+    def _offset(self, token_id: bytes) -> int:
+        slot = int.from_bytes(token_id[:8], "little") % self.slots
+        return HEADER.size + slot * SLOT.size
+
+    def lookup(self, token_id: bytes) -> Optional[bytes]:
+        """Return the cached root key of the token, None on a miss."""
+        entry = self._read(token_id)
+        return entry[0] if entry else None
+
+    def _read(self, token_id: bytes) -> Optional[Tuple[bytes, int]]:
+        """Return the cached root key of the token and when it expires, None on a miss."""
+        offset = self._offset(token_id)
+
+        seq, cached_token_id, root_key, expires_at, checksum = SLOT.unpack_from(self._mmap, offset)
+        if seq % 2 or cached_token_id != token_id:
+            return None
+        if SEQ.unpack_from(self._mmap, offset)[0] != seq:
+            return None
+        if zlib.crc32(cached_token_id + root_key + expires_at.to_bytes(8, "little", signed=True)) != checksum:
+            return None
+        if expires_at and expires_at < datetime.now().timestamp():
+            return None
+
+        return root_key, expires_at
+
+    def put(self, token_id: bytes, root_key: bytes, expires_at: Optional[datetime] = None):
+        """Cache the root key of the token, replacing the entry in its slot."""
+        offset = self._offset(token_id)
+        expires = int(expires_at.timestamp()) if expires_at else 0
+        checksum = zlib.crc32(token_id + root_key + expires.to_bytes(8, "little", signed=True))
+
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT.size, offset)
+        try:
+            seq = SEQ.unpack_from(self._mmap, offset)[0]
+            SEQ.pack_into(self._mmap, offset, (seq + 1) & 0xFFFFFFFF)
+            SLOT.pack_into(self._mmap, offset, (seq + 1) & 0xFFFFFFFF, token_id, root_key, expires, checksum)
+            SEQ.pack_into(self._mmap, offset, (seq + 2) & 0xFFFFFFFF)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT.size, offset)
+
+    def _cacheable(self, token_id, root_key=b"\0" * 32) -> bool:
+        return (
+            isinstance(token_id, bytes) and len(token_id) == TOKEN_ID_SIZE
+            and isinstance(root_key, bytes) and len(root_key) == 32
+        )
+
+    async def insert_root_key(self, token_id: bytes, root_key: bytes, macaroon: str,
+                              expires_at: Optional[datetime] = None):
+        if expires_at is None:
+            await self.service.insert_root_key(token_id, root_key, macaroon)
+        else:
+            await self.service.insert_root_key(token_id, root_key, macaroon, expires_at=expires_at)
+
+        if self._cacheable(token_id, root_key):
+            self.put(token_id, root_key, expires_at)
+
+    async def get_root_key(self, token_id: bytes) -> bytes:
+        root_key, _ = await self.get_root_key_with_expiry(token_id)
+        return root_key
+
+    async def get_root_key_with_expiry(self, token_id: bytes) -> Tuple[Optional[bytes], Optional[datetime]]:
+        if not self._cacheable(token_id):
+            return await self.service.get_root_key_with_expiry(token_id)
+
+        entry = self._read(token_id)
+        if entry is not None:
+            root_key, expires_at = entry
+            return root_key, datetime.fromtimestamp(expires_at) if expires_at else None
+
+        # The expiry is cached with the key, so it is not served past it.
+        root_key, expires_at = await self.service.get_root_key_with_expiry(token_id)
+        if self._cacheable(token_id, root_key):
+            self.put(token_id, root_key, expires_at)
+        return root_key, expires_at
+
+    async def delete_expired_root_keys(self) -> int:
+        # Expired entries are already skipped by lookup().
+        return await self.service.delete_expired_root_keys()
+
+    def supports_usage_metering(self) -> bool:
+        return self.service.supports_usage_metering()
+
+    async def get_usage(self, token_id: bytes) -> int:
+        return await self.service.get_usage(token_id)
+
+    async def record_usage(self, usage: Dict[bytes, int]):
+        await self.service.record_usage(usage)
+
+    def close(self):
+        """Unmap the shared file, the cache itself is kept for the other workers."""
+        self._mmap.close()
+        os.close(self._fd)
+
+
+def _private_dir() -> str:
+    """Return a directory only the current user can access, creating it if needed."""
+    base = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    directory = os.path.join(base, f"l402-{os.getuid()}")
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+
+    # Another user may have created it first, in a shared directory such as /tmp.
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise RuntimeError(f"{directory} is not a directory private to the current user")
+    return directory
+
+def _open_private(path: str) -> int:
+    """Open the cache file, creating it with mode 0600, and check nobody else can access it."""
+    flags = os.O_RDWR | getattr(os, "O_NOFOLLOW", 0)
+    try:
+        fd = os.open(path, flags | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        fd = os.open(path, flags)
+
+    try:
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise RuntimeError(f"{path} is not a file private to the current user")
+    except Exception:
+        os.close(fd)
+        raise
+    return fd
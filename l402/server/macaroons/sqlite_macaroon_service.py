@@ -1,6 +1,7 @@
 import os
 import sqlite3
 from datetime import datetime
+from typing import Dict, Optional, Tuple
 
 from .macaroon_service import MacaroonService
 
@@ -39,21 +40,43 @@ class SqliteMacaroonService(MacaroonService):
 
                 -- created_at is the date and time when the credentials were
                 -- created.
-                created_at DATETIME NOT NULL
+                created_at DATETIME NOT NULL,
+
+                -- expires_at is the valid_until caveat of the macaroon, NULL
+                -- if it does not expire.
+                expires_at DATETIME
             );
             
             CREATE INDEX IF NOT EXISTS macaroons_token_id_idx ON macaroons (token_id);
+
+            CREATE TABLE IF NOT EXISTS macaroon_usage (
+                -- token_id is the token of a usage-metered macaroon.
+                token_id BLOB PRIMARY KEY,
+
+                -- calls is the number of calls made with the macaroon.
+                calls INTEGER NOT NULL,
+
+                -- updated_at is the date and time of the last recorded call.
+                updated_at DATETIME NOT NULL
+            );
         """
         cursor = self.conn.cursor()
         cursor.executescript(create_table_sql)
+
+        # Databases created before expiring macaroons lack the column.
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(macaroons)")]
+        if "expires_at" not in columns:
+            cursor.execute("ALTER TABLE macaroons ADD COLUMN expires_at DATETIME")
+        cursor.execute("CREATE INDEX IF NOT EXISTS macaroons_expires_at_idx ON macaroons (expires_at)")
         self.conn.commit()
     
-    async def insert_root_key(self, token_id: bytes, root_key: bytes, macaroon: str):
+    async def insert_root_key(self, token_id: bytes, root_key: bytes, macaroon: str,
+                              expires_at: Optional[datetime] = None):
         insert_sql = """
             INSERT INTO macaroons (
-                token_id, root_key, macaroon, created_at
+                token_id, root_key, macaroon, created_at, expires_at
             ) VALUES (
-                ?, ?, ?, ?
+                ?, ?, ?, ?, ?
             );
         """
 
@@ -62,7 +85,7 @@ class SqliteMacaroonService(MacaroonService):
         cursor = self.conn.cursor()
         cursor.execute(
             (insert_sql), 
-            (token_id, root_key, macaroon, created_at),
+            (token_id, root_key, macaroon, created_at, expires_at),
         )
         self.conn.commit()
     
@@ -83,9 +106,86 @@ class SqliteMacaroonService(MacaroonService):
             return None
 
         return row[0]
+
+    async def get_root_key_with_expiry(self, token_id: bytes) -> Tuple[Optional[bytes], Optional[datetime]]:
+        query_sql = """
+            SELECT root_key, expires_at
+            FROM macaroons
+            WHERE token_id = ?
+        """
+
+        cursor = self.conn.cursor()
+        cursor.execute(query_sql, (token_id,))
+
+        row = cursor.fetchone()
+        if row is None:
+            return None, None
+
+        root_key, expires_at = row
+        return root_key, datetime.fromisoformat(expires_at) if expires_at else None
+
+    async def delete_expired_root_keys(self) -> int:
+        now = datetime.now()
+
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            DELETE FROM macaroon_usage
+            WHERE token_id IN (
+                SELECT token_id FROM macaroons WHERE expires_at < ?
+            )
+        """, (now,))
+        cursor.execute("DELETE FROM macaroons WHERE expires_at < ?", (now,))
+        deleted = cursor.rowcount
+        self.conn.commit()
+
+        return deleted
+
+    async def get_usage(self, token_id: bytes) -> int:
+        query_sql = """
+            SELECT calls
+            FROM macaroon_usage
+            WHERE token_id = ?
+        """
+
+        cursor = self.conn.cursor()
+        cursor.execute(query_sql, (token_id,))
+
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    async def record_usage(self, usage: Dict[bytes, int]):
+        upsert_sql = """
+            INSERT INTO macaroon_usage (
+                token_id, calls, updated_at
+            ) VALUES (
+                ?, ?, ?
+            )
+            ON CONFLICT (token_id) DO UPDATE SET
+                calls = calls + excluded.calls,
+                updated_at = excluded.updated_at;
+        """
+
+        updated_at = datetime.now()
+
+        cursor = self.conn.cursor()
+        cursor.executemany(
+            upsert_sql,
+            [(token_id, calls, updated_at) for token_id, calls in usage.items()],
+        )
+        self.conn.commit()
         
-    def __del__(self):
+    def close(self):
         """
         Close the SQLite connection.
         """
-        self.conn.close()
\ No newline at end of file
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            conn.close()
+
+    def __del__(self):
+        """
+        Close the SQLite connection, unless it was closed already. Collection
+        may happen on another thread, where SQLite refuses to close it.
+        """
+        if getattr(self, "conn", None) is not None:
+            self.close()
\ No newline at end of file
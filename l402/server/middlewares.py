@@ -1,23 +1,69 @@
-from typing import Callable, Tuple, Coroutine, Any
+from typing import Awaitable, Callable, Dict, Iterable, Mapping, NamedTuple, Optional, Tuple, Coroutine, Any, Union
 import asyncio
 
-from fastapi import Request, HTTPException, Response
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from functools import wraps
 from flask import request, make_response, current_app
 
-from l402.server import Authenticator
+from l402.server import Authenticator, AdmissionRejected
+from l402.server.session_tokens import SESSION_HEADER
+from l402.server.routes import MISSING, RouteTable
+
+# Only the handlers of these methods are run before the credentials are validated.
+SPECULATIVE_METHODS = frozenset(["GET", "HEAD"])
 
 class FastAPIL402Middleware(BaseHTTPMiddleware):
     def __init__(
         self, 
         app,
         authenticator: Authenticator, 
-        pricing_func: Callable[[Request], Tuple[str, str, str]],
+        pricing_func: Optional[Callable[[Request], Tuple[str, str, str]]] = None,
+        services: Optional[Dict[str, Union[str, Tuple[str, int]]]] = None,
+        client_id_func: Optional[Callable[[Request], str]] = None,
+        speculative: Optional[Iterable[str]] = None,
+        routes: Optional[Mapping[str, Optional[Tuple]]] = None,
     ):
+        """
+        Args:
+            authenticator (Authenticator): Mints and validates the macaroons.
+            pricing_func: Returns the (amount, currency, description) of a
+                request, optionally followed by max_calls and expires_in.
+            services: Maps route patterns, see `RouteTable`, to a service
+                name or a (service, tier) pair. The macaroons minted for those
+                routes unlock every route of the service, so one payment
+                covers all of them.
+            client_id_func: Identifies the client of a request for the
+                authenticator's admission control, the client address by
+                default. Behind a proxy use e.g. the X-Forwarded-For header.
+            speculative: Route patterns of safe and idempotent routes whose
+                GET and HEAD handlers start while the credentials are
+                validated, so the validation I/O overlaps with the handler
+                work. If the credentials are invalid the response is
+                discarded, the handler may still run to completion.
+            routes: Maps route patterns, see `RouteTable`, to the static
+                pricing of the route or to None for free routes, which skip
+                L402 entirely. The paths matching no route are priced by
+                `pricing_func`, or are free without it. A trailing `*` also
+                matches the parent path, e.g. `"/static/*": None` makes
+                `/static` itself free too.
+
+        If the authenticator has `session_tokens`, responses to requests with
+        a valid L402 header carry a session token in the L402-Session header.
+        Requests presenting it in the same header are authorized with it,
+        skipping the macaroon validation.
+        """
+        if pricing_func is None and routes is None:
+            raise ValueError("Either pricing_func or routes is required.")
+
         super().__init__(app)
         self.authenticator = authenticator
         self.pricing_func = pricing_func
+        self.services = RouteTable({path: _service_and_tier(service) for path, service in (services or {}).items()})
+        self.client_id_func = client_id_func or _client_host
+        self.speculative = RouteTable({path: True for path in speculative or ()})
+        self.routes = RouteTable(routes) if routes is not None else None
 
     async def dispatch(
         self, 
@@ -25,22 +71,202 @@ class FastAPIL402Middleware(BaseHTTPMiddleware):
         call_next: Callable[[Request], Coroutine[Any, Any, Response]],
     ) -> Response:
 
-        header = request.headers.get("Authorization")
-        if header:
-            try:
-                await self.authenticator.validate_l402_header(header)
-                return await call_next(request)
-            except Exception as e:
-                pass
-        
-        amount, currency, description = self.pricing_func(request)
-        macaroon, payment_request = await self.authenticator.new_challenge(amount, currency, description)
-        response = HTTPException(status_code=402, detail="Payment Required")
-        response.headers["WWW-Authenticate"] = f'L402 macaroon="{macaroon}", invoice="{payment_request}"'
-        raise response
-
-
-def Flask_l402_decorator(authenticator, pricing_func):
+        pricing = self.routes.match(request.url.path, MISSING) if self.routes is not None else MISSING
+        if pricing is None or (pricing is MISSING and self.pricing_func is None):
+            # Free route.
+            return await call_next(request)
+
+        service, tier = self.services.match(request.url.path, (None, 0))
+        outcome = await _authorize_or_challenge(
+            self.authenticator, request, service, tier,
+            self.pricing_func if pricing is MISSING else pricing,
+            self.client_id_func,
+            run=lambda validation: self._validate_and_start(request, call_next, validation),
+        )
+
+        if outcome.authorized:
+            # Outside of the validation, so a failing handler is never
+            # called again with the other credentials of the request.
+            response = await outcome.handler
+            if outcome.session_token is not None:
+                response.headers[SESSION_HEADER] = outcome.session_token
+            return response
+
+        # Exceptions raised from a middleware skip FastAPI's exception
+        # handlers, so the challenge is returned as a response.
+        return JSONResponse({"detail": outcome.detail}, status_code=outcome.status_code, headers=outcome.headers)
+
+
+    async def _validate_and_start(self, request: Request, call_next, validation: Awaitable) -> Tuple[Any, Awaitable[Response]]:
+        """
+        Return the result of the validation and the response of the handler
+        to await, the handler runs concurrently with the validation on
+        speculative routes.
+        """
+        if request.method not in SPECULATIVE_METHODS or not self.speculative.match(request.url.path, False):
+            result = await validation
+            return result, call_next(request)
+
+        handler = asyncio.ensure_future(call_next(request))
+        try:
+            result = await validation
+        except BaseException:
+            # The response is never sent, the handler's own messages are
+            # dropped once the challenge is.
+            handler.cancel()
+            handler.add_done_callback(_discard)
+            raise
+
+        return result, handler
+
+
+def _discard(task: asyncio.Future):
+    """Retrieve the outcome of a discarded handler so it is not logged as unhandled."""
+    if not task.cancelled():
+        task.exception()
+
+class FastAPIL402Guard:
+    """
+    FastAPI dependency putting the routes that declare it behind L402, e.g.
+
+        guard = FastAPIL402Guard(authenticator, (1, "USD", "Search"))
+
+        @app.get("/search", dependencies=[Depends(guard)])
+        def search(): ...
+
+    Unlike `FastAPIL402Middleware`, the other routes of the app do not run
+    any L402 logic.
+    """
+
+    def __init__(
+        self,
+        authenticator: Authenticator,
+        pricing: Union[Tuple, Callable[[Request], Tuple]],
+        service: Optional[str] = None,
+        tier: int = 0,
+        client_id_func: Optional[Callable[[Request], str]] = None,
+    ):
+        """
+        Args:
+            authenticator (Authenticator): Mints and validates the macaroons.
+            pricing: The (amount, currency, description) of the routes,
+                optionally followed by max_calls and expires_in, or a function
+                returning it for a request.
+            service (str): The service of the routes, see `Authenticator.new_challenge`.
+            tier (int): The tier of the service required.
+            client_id_func: Identifies the client of a request for the
+                authenticator's admission control, the client address by
+                default.
+        """
+        self.authenticator = authenticator
+        self.pricing = pricing
+        self.service = service
+        self.tier = tier
+        self.client_id_func = client_id_func or _client_host
+
+    async def __call__(self, request: Request, response: Response):
+        outcome = await _authorize_or_challenge(
+            self.authenticator, request, self.service, self.tier, self.pricing, self.client_id_func,
+        )
+
+        if not outcome.authorized:
+            raise HTTPException(outcome.status_code, outcome.detail, headers=outcome.headers)
+        if outcome.session_token is not None:
+            response.headers[SESSION_HEADER] = outcome.session_token
+
+
+class _Outcome(NamedTuple):
+    """Whether a request is authorized or, if not, the response answering it."""
+    authorized: bool
+    # What `run` returned along with the validation, e.g. the handler's
+    # response to await.
+    handler: Any = None
+    # The session token issued for the request, if any.
+    session_token: Optional[str] = None
+    status_code: int = 402
+    detail: str = "Payment Required"
+    headers: Dict[str, str] = {}
+
+async def _validated(validation: Awaitable) -> Tuple[Any, None]:
+    return await validation, None
+
+async def _authorize_or_challenge(
+    authenticator: Authenticator,
+    request: Request,
+    service: Optional[str],
+    tier: int,
+    pricing: Union[Tuple, Callable[[Request], Tuple]],
+    client_id_func: Callable[[Request], Optional[str]],
+    run: Callable[[Awaitable], Awaitable[Tuple[Any, Any]]] = _validated,
+) -> _Outcome:
+    """
+    Authorize the request with its session token or its L402 header, or
+    issue a challenge for it.
+
+    `run` awaits a validation, returning its result and what to do once the
+    request is authorized, e.g. the handler's response to await. Only
+    validation errors are caught, what is returned along is left to the
+    caller. With session tokens, requests with a valid L402 header get a
+    new one.
+    """
+    sessions = authenticator.session_tokens is not None
+
+    session_token = request.headers.get(SESSION_HEADER) if sessions else None
+    if session_token:
+        try:
+            _, handler = await run(authenticator.validate_session_token(session_token, service, tier))
+        except Exception:
+            pass
+        else:
+            return _Outcome(True, handler)
+
+    header = request.headers.get("Authorization")
+    if header:
+        try:
+            if sessions:
+                validation = authenticator.new_session_token(header, service, tier)
+            else:
+                validation = authenticator.validate_l402_header(header, service, tier)
+
+            session_token, handler = await run(validation)
+        except Exception:
+            pass
+        else:
+            return _Outcome(True, handler, session_token)
+
+    # The pricing is (amount, currency, description) and, optionally, the
+    # max_calls of a usage-metered macaroon.
+    if callable(pricing):
+        pricing = pricing(request)
+    try:
+        macaroon, payment_request = await authenticator.new_challenge(
+            *pricing, **_services_caveat(service, tier),
+            client_id=client_id_func(request),
+        )
+    except AdmissionRejected as e:
+        return _Outcome(False, status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    return _Outcome(
+        False, headers={"WWW-Authenticate": f'L402 macaroon="{macaroon}", invoice="{payment_request}"'},
+    )
+
+
+def _service_and_tier(service: Union[str, Tuple[str, int]]) -> Tuple[str, int]:
+    if isinstance(service, str):
+        return service, 0
+    return service
+
+def _client_host(request) -> Optional[str]:
+    return request.client.host if request.client else None
+
+def _services_caveat(service: Optional[str], tier: int) -> Dict[str, Any]:
+    """new_challenge arguments scoping the macaroon to the service, if any."""
+    if service is None:
+        return {}
+    return {"services": {service: tier}}
+
+
+def Flask_l402_decorator(authenticator, pricing_func, service: str = None, tier: int = 0):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -49,7 +275,7 @@ def Flask_l402_decorator(authenticator, pricing_func):
                     header = request.headers.get("Authorization")
                     if header:
                         try:
-                            await authenticator.validate_l402_header(header)
+                            await authenticator.validate_l402_header(header, service, tier)
                             if asyncio.iscoroutinefunction(func):
                                 response = await func(*args, **kwargs)
                             else:
@@ -59,8 +285,16 @@ def Flask_l402_decorator(authenticator, pricing_func):
                         except Exception as e:
                             pass
 
-                    amount, currency, description = pricing_func(request)
-                    macaroon, payment_request = await authenticator.new_challenge(amount, currency, description)
+                    try:
+                        macaroon, payment_request = await authenticator.new_challenge(
+                            *pricing_func(request), **_services_caveat(service, tier),
+                            client_id=request.remote_addr,
+                        )
+                    except AdmissionRejected as e:
+                        response = make_response(str(e), e.status_code)
+                        response.headers["Retry-After"] = str(e.retry_after)
+                        return response
+
                     response = make_response("Payment Required", 402)
                     response.headers["WWW-Authenticate"] = f'L402 macaroon="{macaroon}", invoice="{payment_request}"'
                     return response
@@ -72,20 +306,26 @@ def Flask_l402_decorator(authenticator, pricing_func):
     return decorator
 
 
-def FastHTML_l402_decorator(authenticator: Authenticator, pricing_func):
+def FastHTML_l402_decorator(authenticator: Authenticator, pricing_func, service: str = None, tier: int = 0):
     def decorator(func):
         @wraps(func)
         async def wrapper(req, *args, **kwargs):
             header = req.headers.get("Authorization")
             if header:
                 try:
-                    await authenticator.validate_l402_header(header)
+                    await authenticator.validate_l402_header(header, service, tier)
                     return await func(req, *args, **kwargs)
                 except Exception:
                     pass
 
-            amount, currency, description = pricing_func(req)
-            macaroon, payment_request = await authenticator.new_challenge(amount, currency, description)
+            try:
+                macaroon, payment_request = await authenticator.new_challenge(
+                    *pricing_func(req), **_services_caveat(service, tier),
+                    client_id=_client_host(req),
+                )
+            except AdmissionRejected as e:
+                return Response(str(e), status_code=e.status_code, headers={"Retry-After": str(e.retry_after)})
+
             resp = Response("Payment Required", status_code=402)
             resp.headers["WWW-Authenticate"] = f'L402 macaroon="{macaroon}", invoice="{payment_request}"'
             return resp
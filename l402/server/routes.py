@@ -0,0 +1,75 @@
+from typing import Any, List, Mapping, Optional
+
+MISSING = object()
+
+
+class _Node:
+    __slots__ = ("children", "param", "value", "wildcard")
+
+    def __init__(self):
+        self.children = {}
+        self.param: Optional[_Node] = None
+        self.value = MISSING
+        self.wildcard = MISSING
+
+
+class RouteTable:
+    """
+    RouteTable maps request paths to values, e.g. the prices of the routes,
+    with a trie of path segments built once.
+
+    Patterns are paths made of literal segments, `{name}` segments matching
+    any one segment, and a final `*` matching the rest of the path, possibly
+    empty: "/health", "/items/{id}", "/static/*". Literal segments take
+    precedence over `{name}` ones, and those over `*`. Trailing slashes are
+    ignored.
+    """
+
+    def __init__(self, routes: Optional[Mapping[str, Any]] = None):
+        self._root = _Node()
+        for pattern, value in (routes or {}).items():
+            self.add(pattern, value)
+
+    def add(self, pattern: str, value: Any):
+        """Add a route, replacing the value of an existing identical pattern."""
+        segments = _segments(pattern)
+        node = self._root
+        for i, segment in enumerate(segments):
+            if segment == "*":
+                if i != len(segments) - 1:
+                    raise ValueError(f"Wildcards must be the last segment: {pattern}")
+                node.wildcard = value
+                return
+            if segment.startswith("{") and segment.endswith("}"):
+                node.param = node.param or _Node()
+                node = node.param
+            else:
+                node = node.children.setdefault(segment, _Node())
+        node.value = value
+
+    def match(self, path: str, default: Any = None) -> Any:
+        """Return the value of the route matching the path, `default` if none does."""
+        value = _match(self._root, _segments(path), 0)
+        return default if value is MISSING else value
+
+
+def _segments(path: str) -> List[str]:
+    path = path.strip("/")
+    return path.split("/") if path else []
+
+def _match(node: _Node, segments: List[str], i: int):
+    if i == len(segments):
+        return node.value if node.value is not MISSING else node.wildcard
+
+    child = node.children.get(segments[i])
+    if child is not None:
+        value = _match(child, segments, i + 1)
+        if value is not MISSING:
+            return value
+
+    if node.param is not None:
+        value = _match(node.param, segments, i + 1)
+        if value is not MISSING:
+            return value
+
+    return node.wildcard
@@ -0,0 +1,117 @@
+import os
+import hmac
+import time
+import base64
+import hashlib
+import struct
+from typing import Mapping, NamedTuple, Optional
+
+from .exceptions import InvalidSessionToken
+from .caveats import format_services, parse_services
+
+# The header carrying the session tokens, in responses and requests.
+SESSION_HEADER = "L402-Session"
+
+# version, flags, token_id, expires_at (unix seconds), max_calls (only set
+# with FLAG_METERED), followed by the services caveat value when
+# FLAG_SERVICES is set.
+PAYLOAD = struct.Struct(">BB32sII")
+VERSION = 0
+FLAG_METERED = 0x01
+FLAG_SERVICES = 0x02
+MAC_SIZE = 16
+# Larger max_calls caveats are stored as this, a limit no session reaches.
+MAX_CALLS_LIMIT = 0xFFFFFFFF
+
+
+class Session(NamedTuple):
+    """The token id and caveats a session token was issued for."""
+    token_id: bytes
+    expires_at: int
+    max_calls: Optional[int]
+    services: Optional[Mapping[str, int]]
+
+
+class SessionTokens:
+    """
+    SessionTokens issues and verifies compact session tokens.
+
+    A session token is a small fixed-layout payload, the token id and the
+    caveats of an already validated macaroon, signed with a truncated
+    HMAC-SHA256. Verifying it is one HMAC, instead of deserializing and
+    verifying the macaroon, checking the preimage and looking the root key
+    up.
+
+    Session tokens are bearer credentials valid for `ttl` seconds, or until
+    the macaroon expires if that is sooner, even if the root key is deleted
+    meanwhile. Usage-metered macaroons are still charged every call. All the
+    workers of a server must share the same `secret`.
+    """
+
+    def __init__(self, secret: bytes = None, ttl: int = 300):
+        """
+        Args:
+            secret (bytes): The HMAC key, a random one for this process if
+                not set.
+            ttl (int): Seconds a session token is valid for.
+        """
+        self.secret = secret or os.urandom(32)
+        self.ttl = ttl
+
+    def issue(self, token_id: bytes, valid_until: Optional[int] = None, max_calls: Optional[int] = None,
+              services: Optional[Mapping[str, int]] = None) -> str:
+        """Return a session token for the token id and caveats of a validated macaroon."""
+        expires_at = int(time.time()) + self.ttl
+        if valid_until is not None:
+            expires_at = min(expires_at, valid_until)
+
+        flags = 0
+        tail = b""
+        if max_calls is not None:
+            flags |= FLAG_METERED
+        if services is not None:
+            flags |= FLAG_SERVICES
+            tail = format_services(services).encode()
+
+        max_calls = min(max(max_calls or 0, 0), MAX_CALLS_LIMIT)
+        payload = PAYLOAD.pack(VERSION, flags, token_id, max(expires_at, 0), max_calls) + tail
+        token = payload + self._sign(payload)
+        return base64.urlsafe_b64encode(token).rstrip(b"=").decode()
+
+    def verify(self, token: str) -> Session:
+        """
+        Return the session of a session token.
+
+        Raises:
+            InvalidSessionToken: If the token is malformed, forged or expired.
+        """
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        except (ValueError, TypeError):
+            raise InvalidSessionToken("Malformed session token.")
+
+        if len(raw) < PAYLOAD.size + MAC_SIZE:
+            raise InvalidSessionToken("Malformed session token.")
+
+        payload, signature = raw[:-MAC_SIZE], raw[-MAC_SIZE:]
+        if not hmac.compare_digest(self._sign(payload), signature):
+            raise InvalidSessionToken("Invalid session token signature.")
+
+        version, flags, token_id, expires_at, max_calls = PAYLOAD.unpack_from(payload)
+        if version != VERSION:
+            raise InvalidSessionToken(f"Invalid session token version: {version}")
+        if time.time() > expires_at:
+            raise InvalidSessionToken("Session token expired.")
+
+        services = None
+        if flags & FLAG_SERVICES:
+            tail = payload[PAYLOAD.size:].decode()
+            services = parse_services(tail) if tail else {}
+
+        if not flags & FLAG_METERED:
+            max_calls = None
+
+        return Session(token_id, expires_at, max_calls, services)
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self.secret, payload, hashlib.sha256).digest()[:MAC_SIZE]
@@ -0,0 +1,124 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+from .macaroons import MacaroonService
+from .exceptions import UsageLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+
+class UsageMeter:
+    """
+    UsageMeter counts the calls made with usage-metered macaroons.
+
+    Counters live in memory and only the increments are written to the
+    `MacaroonService`, in batches: when `flush_interval` seconds have passed
+    since the last flush or when `max_pending` tokens have unflushed calls.
+    On a crash at most the calls of that window are lost, i.e. served for
+    free. With several workers each one keeps its own counters on top of the
+    persisted usage, so a token may be used up to once more per worker and
+    flush window before all of them see it exhausted.
+
+    It does not start background tasks and its counters are guarded by a
+    lock, so it works from any event loop, including the per-request loops
+    of the Flask decorator, running on concurrent threads. Call `flush` on
+    shutdown to persist the remaining calls. Errors of the flushes triggered
+    by `consume` are logged, the calls stay pending for the next one.
+    """
+
+    def __init__(self, macaroon_service: MacaroonService, flush_interval: float = 1.0,
+                 max_pending: int = 1000, max_tokens: int = 100_000):
+        """
+        Args:
+            macaroon_service (MacaroonService): Persists the usage of the tokens.
+            flush_interval (float): Maximum seconds between flushes while
+                there is traffic.
+            max_pending (int): Number of tokens with unflushed calls that
+                triggers a flush.
+            max_tokens (int): Maximum number of counters kept in memory, the
+                least recently used ones are reloaded when needed.
+        """
+        self.macaroon_service = macaroon_service
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_tokens = max_tokens
+
+        self._lock = threading.Lock()
+        self._counters = OrderedDict()
+        self._pending: Dict[bytes, int] = {}
+        self._last_flush = time.monotonic()
+
+    async def consume(self, token_id: bytes, limit: int, calls: int = 1) -> int:
+        """
+        Record `calls` calls made with the token and return the calls left.
+
+        Raises:
+            UsageLimitExceeded: If the token does not have enough calls left,
+                nothing is recorded in that case.
+        """
+        with self._lock:
+            used = self._counters.get(token_id)
+            if used is not None:
+                flush = self._record(token_id, used, limit, calls)
+
+        if used is None:
+            persisted = await self.macaroon_service.get_usage(token_id)
+            with self._lock:
+                # A concurrent call may have loaded and used the token meanwhile.
+                used = self._counters.setdefault(token_id, persisted)
+                flush = self._record(token_id, used, limit, calls)
+
+        if flush:
+            try:
+                await self.flush()
+            except Exception:
+                # The call is counted and paid for, a storage error must not
+                # deny it.
+                logger.exception("Failed to persist the usage of the macaroons, retrying on the next flush.")
+
+        return limit - used - calls
+
+    async def flush(self):
+        """Write the pending calls to the macaroon service in one batch."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+
+        try:
+            await self.macaroon_service.record_usage(batch)
+        except Exception:
+            # Keep the calls for the next flush.
+            with self._lock:
+                for token_id, calls in batch.items():
+                    self._pending[token_id] = self._pending.get(token_id, 0) + calls
+            raise
+
+    def _record(self, token_id: bytes, used: int, limit: int, calls: int) -> bool:
+        """Count the calls of a loaded token and return whether a flush is due, with the lock held."""
+        self._counters.move_to_end(token_id)
+        if used + calls > limit:
+            raise UsageLimitExceeded(f"Usage limit of {limit} calls exceeded.")
+
+        self._counters[token_id] = used + calls
+        self._pending[token_id] = self._pending.get(token_id, 0) + calls
+        self._evict()
+
+        return len(self._pending) >= self.max_pending or time.monotonic() - self._last_flush >= self.flush_interval
+
+    def _evict(self):
+        """Drop the least recently used counters without pending calls."""
+        excess = len(self._counters) - self.max_tokens
+        if excess <= 0:
+            return
+
+        for token_id in list(self._counters):
+            if excess <= 0:
+                break
+            if token_id not in self._pending:
+                del self._counters[token_id]
+                excess -= 1
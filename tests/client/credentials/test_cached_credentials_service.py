@@ -0,0 +1,143 @@
+import pytest
+from l402.client.credentials import (
+    L402Credentials, CredentialsCache, CachedAsyncService, CachedCredentialsService,
+    SqliteCredentialsService,
+)
+from l402.client.credentials.cached_credentials_service import MISS
+
+def make_credentials(macaroon="macaroon", location="https://example.com"):
+    credentials = L402Credentials(macaroon, "preimage", "invoice")
+    credentials.set_location(location)
+    return credentials
+
+@pytest.fixture
+def clock(mocker):
+    now = [1000.0]
+    mocker.patch("l402.client.credentials.cached_credentials_service.time.monotonic", side_effect=lambda: now[0])
+    return now
+
+def test_cache_ttl(clock):
+    cache = CredentialsCache(ttl=10)
+    credentials = make_credentials()
+    cache.put(credentials.location, credentials)
+
+    assert cache.get(credentials.location) is credentials
+    clock[0] += 11
+    assert cache.get(credentials.location) is MISS
+    assert len(cache) == 0
+
+def test_cache_lru_eviction():
+    cache = CredentialsCache(max_size=2)
+    cache.put("a", make_credentials("a"))
+    cache.put("b", make_credentials("b"))
+    cache.get("a")
+    cache.put("c", make_credentials("c"))
+
+    assert cache.get("b") is MISS
+    assert cache.get("a") is not MISS
+    assert cache.get("c") is not MISS
+
+def test_cache_negative_entries(clock):
+    cache = CredentialsCache(ttl=10, negative_ttl=1)
+    cache.put("a", None)
+    assert cache.get("a") is None
+
+    clock[0] += 2
+    assert cache.get("a") is MISS
+
+    cache = CredentialsCache(ttl=10)
+    cache.put("a", None)
+    assert cache.get("a") is MISS
+
+@pytest.mark.asyncio
+async def test_cached_async_service_get(mocker):
+    inner = mocker.AsyncMock()
+    inner.get.return_value = make_credentials()
+    service = CachedAsyncService(inner)
+
+    first = await service.get("https://example.com")
+    second = await service.get("https://example.com")
+
+    assert first is second
+    inner.get.assert_awaited_once_with("https://example.com")
+
+@pytest.mark.asyncio
+async def test_cached_async_service_store_warms_cache(mocker):
+    inner = mocker.AsyncMock()
+    service = CachedAsyncService(inner)
+    credentials = make_credentials()
+
+    await service.store(credentials)
+
+    assert await service.get(credentials.location) is credentials
+    inner.store.assert_awaited_once_with(credentials)
+    inner.get.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_cached_async_service_invalidate(mocker):
+    inner = mocker.AsyncMock()
+    service = CachedAsyncService(inner)
+    credentials = make_credentials()
+    await service.store(credentials)
+
+    await service.invalidate(credentials.location)
+    inner.get.return_value = None
+
+    assert await service.get(credentials.location) is None
+    inner.invalidate.assert_awaited_once_with(credentials.location)
+    inner.get.assert_awaited_once_with(credentials.location)
+
+def test_cached_credentials_service():
+    service = CachedCredentialsService(SqliteCredentialsService(":memory:"))
+    credentials = make_credentials()
+    service.store(credentials)
+
+    assert service.get(credentials.location) is credentials
+
+    service.invalidate(credentials.location)
+    assert service.get(credentials.location) is None
+
+def test_cached_credentials_service_without_invalidate(mocker):
+    inner = mocker.Mock(spec=["get", "store"])
+    service = CachedCredentialsService(inner)
+    credentials = make_credentials()
+    service.store(credentials)
+
+    service.invalidate(credentials.location)
+    inner.get.return_value = None
+    assert service.get(credentials.location) is None
+
+def test_cache_prefix_match():
+    cache = CredentialsCache()
+    credentials = make_credentials(location="https://example.com/api/*")
+    cache.put(credentials.location, credentials)
+
+    assert cache.get("https://example.com/api/items/1") is credentials
+    assert cache.get("https://example.com/other") is MISS
+
+    cache.discard("https://example.com/api/items/1")
+    assert cache.get("https://example.com/api/items/1") is MISS
+
+@pytest.mark.asyncio
+async def test_cached_async_service_prefix_credentials(mocker):
+    inner = mocker.AsyncMock()
+    inner.get.return_value = make_credentials(location="https://example.com/api/*")
+    service = CachedAsyncService(inner)
+
+    await service.get("https://example.com/api/items/1")
+    await service.get("https://example.com/api/items/2")
+
+    inner.get.assert_awaited_once_with("https://example.com/api/items/1")
+
+@pytest.mark.asyncio
+async def test_cached_async_service_prefix_store_clears_misses(mocker):
+    inner = mocker.AsyncMock()
+    inner.get.return_value = None
+    service = CachedAsyncService(inner, negative_ttl=60)
+
+    assert await service.get("https://example.com/api/items/1") is None
+
+    credentials = make_credentials(location="https://example.com/api/*")
+    await service.store(credentials)
+
+    assert await service.get("https://example.com/api/items/1") is credentials
@@ -0,0 +1,57 @@
+import pytest
+from l402.client.credentials import (
+    CredentialsPolicy, ExactPolicy, OriginPolicy, PathPrefixPolicy, PatternPolicy,
+    PrefixIndex, candidate_locations,
+)
+
+URL = "https://api.example.com/v0/items/1?page=2"
+
+def test_candidate_locations():
+    assert candidate_locations(URL) == [
+        URL,
+        "https://api.example.com/v0/items/*",
+        "https://api.example.com/v0/*",
+        "https://api.example.com/*",
+    ]
+
+def test_candidate_locations_origin_only():
+    assert candidate_locations("https://example.com") == [
+        "https://example.com",
+        "https://example.com/*",
+    ]
+
+def test_prefix_index_longest_match():
+    index = PrefixIndex([
+        ("https://api.example.com/*", "origin"),
+        ("https://api.example.com/v0/*", "v0"),
+    ])
+
+    assert index.longest_match(URL) == ("https://api.example.com/v0/*", "v0")
+    assert index.longest_match("https://api.example.com/v1/items") == ("https://api.example.com/*", "origin")
+    assert index.longest_match("https://other.example.com/v0/items") is None
+
+    index[URL] = "exact"
+    assert index.longest_match(URL) == (URL, "exact")
+
+    del index[URL]
+    assert len(index) == 2
+
+@pytest.mark.parametrize("policy, expected", [
+    (CredentialsPolicy(), URL),
+    (ExactPolicy(), URL),
+    (OriginPolicy(), "https://api.example.com/*"),
+    (PathPrefixPolicy(), "https://api.example.com/v0/items/*"),
+    (PathPrefixPolicy(depth=0), "https://api.example.com/*"),
+    (PathPrefixPolicy(depth=1), "https://api.example.com/v0/*"),
+    (PathPrefixPolicy(depth=10), "https://api.example.com/v0/items/*"),
+    (PatternPolicy(["https://api.example.com/v0/*"]), "https://api.example.com/v0/*"),
+    (PatternPolicy(["https://other.example.com/*"]), URL),
+    (PatternPolicy(["https://other.example.com/*"], OriginPolicy()), "https://api.example.com/*"),
+])
+def test_policy_scope(policy, expected):
+    assert policy.scope(URL) == expected
+
+def test_scope_matches_url():
+    for policy in (OriginPolicy(), PathPrefixPolicy(), PathPrefixPolicy(depth=1)):
+        assert policy.scope(URL) in candidate_locations(URL)
+        assert policy.scope(URL) in candidate_locations("https://api.example.com/v0/items/2")
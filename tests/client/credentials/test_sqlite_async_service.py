@@ -1,3 +1,6 @@
+import asyncio
+import sqlite3
+import threading
 import pytest
 from l402.client.credentials import L402Credentials, SqliteAsyncService
 
@@ -55,4 +58,139 @@ async def test_store_different_locations(db):
 
     retrieved_credentials2 = await db.get("https://example2.com")
     assert retrieved_credentials2 is not None
-    assert retrieved_credentials2.macaroon == "macaroon2"
\ No newline at end of file
+    assert retrieved_credentials2.macaroon == "macaroon2"
+
+@pytest.fixture
+def file_db(tmp_path):
+    service = SqliteAsyncService(str(tmp_path / "credentials.db"))
+    yield service
+    service.close()
+
+@pytest.mark.asyncio
+async def test_file_database_uses_wal(file_db):
+    mode = file_db.conn.execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+
+@pytest.mark.asyncio
+async def test_concurrent_stores_are_batched(file_db, mocker):
+    flush = mocker.spy(file_db, "_flush")
+
+    credentials = []
+    for i in range(50):
+        creds = L402Credentials(f"macaroon{i}", f"preimage{i}", f"invoice{i}")
+        creds.set_location(f"https://example.com/{i}")
+        credentials.append(creds)
+
+    await asyncio.gather(*[file_db.store(creds) for creds in credentials])
+
+    assert flush.call_count < len(credentials)
+    for i in range(50):
+        retrieved = await file_db.get(f"https://example.com/{i}")
+        assert retrieved.macaroon == f"macaroon{i}"
+
+@pytest.mark.asyncio
+async def test_sqlite_runs_off_the_event_loop(file_db, mocker):
+    threads = set()
+    query = file_db._query
+
+    def record_thread(location):
+        threads.add(threading.current_thread())
+        return query(location)
+
+    mocker.patch.object(file_db, "_query", side_effect=record_thread)
+    await file_db.get("https://example.com")
+
+    assert threads and threading.main_thread() not in threads
+
+@pytest.mark.asyncio
+async def test_store_failure_is_raised(file_db):
+    credentials = L402Credentials(None, "preimage", "invoice")
+    credentials.set_location("https://example.com")
+
+    with pytest.raises(sqlite3.IntegrityError):
+        await file_db.store(credentials)
+
+@pytest.mark.asyncio
+async def test_store_failure_only_fails_its_own_store(file_db):
+    credentials = []
+    for i in range(5):
+        creds = L402Credentials(f"macaroon{i}" if i != 2 else None, "preimage", "invoice")
+        creds.set_location(f"https://example.com/{i}")
+        credentials.append(creds)
+
+    # Hold the writer until all the stores are queued, so they share a batch.
+    queued = threading.Event()
+    file_db._writer.submit(queued.wait)
+    stores = asyncio.gather(*[file_db.store(creds) for creds in credentials], return_exceptions=True)
+    await asyncio.sleep(0)
+    assert len(file_db._pending) == 5
+    queued.set()
+    results = await stores
+
+    assert isinstance(results[2], sqlite3.IntegrityError)
+    assert [result for i, result in enumerate(results) if i != 2] == [None] * 4
+    for i in (0, 1, 3, 4):
+        assert (await file_db.get(f"https://example.com/{i}")).macaroon == f"macaroon{i}"
+
+@pytest.mark.asyncio
+async def test_get_longest_prefix_match(db):
+    credentials1 = L402Credentials("macaroon1", "preimage1", "invoice1")
+    credentials1.set_location("https://prefix.example.com/*")
+    await db.store(credentials1)
+
+    credentials2 = L402Credentials("macaroon2", "preimage2", "invoice2")
+    credentials2.set_location("https://prefix.example.com/api/*")
+    await db.store(credentials2)
+
+    retrieved_credentials = await db.get("https://prefix.example.com/api/items/1")
+    assert retrieved_credentials.macaroon == "macaroon2"
+    assert retrieved_credentials.location == "https://prefix.example.com/api/*"
+
+    retrieved_credentials = await db.get("https://prefix.example.com/other")
+    assert retrieved_credentials.macaroon == "macaroon1"
+
+    assert await db.get("https://other.example.com/api/items/1") is None
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("url", ["https://shadow.example.com/x", "https://shadow.example.com/"])
+async def test_exact_url_is_not_shadowed_by_prefix(db, url):
+    exact = L402Credentials("exact", "preimage", "invoice")
+    exact.set_location(url)
+    await db.store(exact)
+
+    # Stored later, with a location as long as or longer than the URL.
+    prefix = L402Credentials("prefix", "preimage", "invoice")
+    prefix.set_location("https://shadow.example.com/*")
+    await db.store(prefix)
+
+    assert (await db.get(url)).macaroon == "exact"
+    assert (await db.get("https://shadow.example.com/y")).macaroon == "prefix"
+
+@pytest.mark.asyncio
+async def test_invalidate_deletes_matched_location(db):
+    credentials1 = L402Credentials("macaroon1", "preimage1", "invoice1")
+    credentials1.set_location("https://invalidate.example.com/*")
+    await db.store(credentials1)
+
+    credentials2 = L402Credentials("macaroon2", "preimage2", "invoice2")
+    credentials2.set_location("https://invalidate.example.com/items/1")
+    await db.store(credentials2)
+
+    await db.invalidate("https://invalidate.example.com/items/1")
+
+    retrieved_credentials = await db.get("https://invalidate.example.com/items/1")
+    assert retrieved_credentials.macaroon == "macaroon1"
+
+@pytest.mark.asyncio
+async def test_store_prunes_superseded_credentials(file_db):
+    credentials = []
+    for i in range(3):
+        creds = L402Credentials(f"macaroon{i}", "preimage", "invoice")
+        creds.set_location("https://example.com/pruned")
+        credentials.append(creds)
+
+    await asyncio.gather(*[file_db.store(creds) for creds in credentials])
+
+    rows = file_db.conn.execute("SELECT macaroon FROM credentials").fetchall()
+    assert rows == [("macaroon2",)]
+
@@ -51,4 +51,62 @@ def test_store_different_locations(db):
 
     retrieved_credentials2 = db.get("https://example2.com")
     assert retrieved_credentials2 is not None
-    assert retrieved_credentials2.macaroon == "macaroon2"
\ No newline at end of file
+    assert retrieved_credentials2.macaroon == "macaroon2"
+
+def test_get_longest_prefix_match(db):
+    credentials1 = L402Credentials("macaroon1", "preimage1", "invoice1")
+    credentials1.set_location("https://prefix.example.com/*")
+    db.store(credentials1)
+
+    credentials2 = L402Credentials("macaroon2", "preimage2", "invoice2")
+    credentials2.set_location("https://prefix.example.com/api/*")
+    db.store(credentials2)
+
+    retrieved_credentials = db.get("https://prefix.example.com/api/items/1")
+    assert retrieved_credentials.macaroon == "macaroon2"
+    assert retrieved_credentials.location == "https://prefix.example.com/api/*"
+
+    retrieved_credentials = db.get("https://prefix.example.com/other")
+    assert retrieved_credentials.macaroon == "macaroon1"
+
+    assert db.get("https://other.example.com/api/items/1") is None
+
+@pytest.mark.parametrize("url", ["https://shadow.example.com/x", "https://shadow.example.com/"])
+def test_exact_url_is_not_shadowed_by_prefix(db, url):
+    exact = L402Credentials("exact", "preimage", "invoice")
+    exact.set_location(url)
+    db.store(exact)
+
+    # Stored later, with a location as long as or longer than the URL.
+    prefix = L402Credentials("prefix", "preimage", "invoice")
+    prefix.set_location("https://shadow.example.com/*")
+    db.store(prefix)
+
+    assert db.get(url).macaroon == "exact"
+    assert db.get("https://shadow.example.com/y").macaroon == "prefix"
+
+def test_invalidate_deletes_matched_location(db):
+    credentials1 = L402Credentials("macaroon1", "preimage1", "invoice1")
+    credentials1.set_location("https://invalidate.example.com/*")
+    db.store(credentials1)
+
+    credentials2 = L402Credentials("macaroon2", "preimage2", "invoice2")
+    credentials2.set_location("https://invalidate.example.com/items/1")
+    db.store(credentials2)
+
+    db.invalidate("https://invalidate.example.com/items/1")
+
+    retrieved_credentials = db.get("https://invalidate.example.com/items/1")
+    assert retrieved_credentials.macaroon == "macaroon1"
+
+def test_store_prunes_superseded_credentials(db):
+    for i in range(3):
+        credentials = L402Credentials(f"macaroon{i}", "preimage", "invoice")
+        credentials.set_location("https://example.com/pruned")
+        db.store(credentials)
+
+    rows = db.conn.execute(
+        "SELECT macaroon FROM credentials WHERE location = ?", ("https://example.com/pruned",)
+    ).fetchall()
+    assert rows == [("macaroon2",)]
+
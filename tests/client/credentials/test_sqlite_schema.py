@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+from l402.client.credentials.sqlite_schema import SCHEMA_VERSION, migrate
+
+def _indexes(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """A credentials.db created before the schema was versioned."""
+    path = str(tmp_path / "credentials.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE credentials (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            location TEXT NOT NULL,
+            macaroon TEXT NOT NULL,
+            preimage TEXT,
+            invoice TEXT NOT NULL,
+            created_at DATETIME NOT NULL
+        );
+        CREATE INDEX credentials_location_index ON credentials (location);
+    """)
+    conn.executemany(
+        "INSERT INTO credentials (location, macaroon, preimage, invoice, created_at) VALUES (?, ?, ?, ?, ?)",
+        [
+            ("https://example.com/a", "old", "preimage", "invoice", "2024-01-01T00:00:00"),
+            ("https://example.com/a", "new", "preimage", "invoice", "2024-01-02T00:00:00"),
+            ("https://example.com/b", "only", "preimage", "invoice", "2024-01-01T00:00:00"),
+        ],
+    )
+    conn.commit()
+    yield conn
+    conn.close()
+
+def test_migrate_new_database():
+    conn = sqlite3.connect(":memory:")
+    migrate(conn)
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert "credentials_location_created_at_index" in _indexes(conn)
+
+def test_migrate_legacy_database(legacy_db):
+    migrate(legacy_db)
+
+    rows = legacy_db.execute("SELECT location, macaroon FROM credentials ORDER BY location").fetchall()
+    assert rows == [("https://example.com/a", "new"), ("https://example.com/b", "only")]
+    assert legacy_db.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+
+    indexes = _indexes(legacy_db)
+    assert "credentials_location_created_at_index" in indexes
+    assert "credentials_location_index" not in indexes
+
+def test_migrate_is_idempotent(legacy_db):
+    migrate(legacy_db)
+    migrate(legacy_db)
+
+    assert legacy_db.execute("SELECT count(*) FROM credentials").fetchone()[0] == 2
+
+def test_lookup_uses_composite_index(legacy_db):
+    migrate(legacy_db)
+
+    plan = legacy_db.execute("""
+        EXPLAIN QUERY PLAN
+        SELECT macaroon FROM credentials WHERE location = ? ORDER BY created_at DESC LIMIT 1
+    """, ("https://example.com/a",)).fetchall()
+    assert any("credentials_location_created_at_index" in row[-1] for row in plan)
@@ -2,7 +2,7 @@ import pytest
 import json
 from unittest.mock import patch, Mock
 
-from l402.client.preimage_provider import AlbyAPI
+from l402.client.preimage_provider import AlbyAPI, AsyncAlbyAPI
 
 @pytest.fixture
 def alby_api():
@@ -82,4 +82,46 @@ def test_get_preimage_invalid_json_response(mock_post, alby_api):
     with pytest.raises(Exception) as exc_info:
         alby_api.get_preimage(invoice)
 
-    assert str(exc_info.value) == "Invalid JSON response: Invalid JSON"
\ No newline at end of file
+    assert str(exc_info.value) == "Invalid JSON response: Invalid JSON"
+
+@pytest.mark.asyncio
+@patch("httpx.AsyncClient.post")
+async def test_async_get_preimage_success(mock_post):
+    preimage = "2f84e22556af9919f695d7761f404e98ff98058b7d32074de8c0c83bf63eecd7"
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.json.return_value = {"payment_preimage": preimage}
+    mock_post.return_value = mock_response
+
+    async with AsyncAlbyAPI("your_api_key") as alby_api:
+        assert await alby_api.get_preimage("invoice1") == preimage
+        assert await alby_api.get_preimage("invoice2") == preimage
+        http_client = alby_api._http_client
+
+        assert mock_post.call_count == 2
+        mock_post.assert_called_with(
+            f"{alby_api.alby_url}/payments/bolt11",
+            headers={
+                "Authorization": f"Bearer {alby_api.api_key}",
+                "Accept": "application/json",
+                "Content-Type": "application/json"
+            },
+            content=json.dumps({'invoice': "invoice2"})
+        )
+
+    assert http_client.is_closed
+    assert alby_api._http_client is None
+
+
+@pytest.mark.asyncio
+@patch("httpx.AsyncClient.post")
+async def test_async_get_preimage_unexpected_response(mock_post):
+    mock_response = Mock()
+    mock_response.status_code = 500
+    mock_response.text = "Internal Server Error"
+    mock_post.return_value = mock_response
+
+    alby_api = AsyncAlbyAPI("your_api_key")
+    with pytest.raises(Exception, match="Unexpected response 500"):
+        await alby_api.get_preimage("invoice")
+    await alby_api.aclose()
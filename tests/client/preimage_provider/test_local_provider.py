@@ -0,0 +1,29 @@
+import pytest
+
+from l402.client.preimage_provider import LocalPreimageProvider
+from l402.server.invoice_provider import LocalInvoiceProvider
+
+@pytest.fixture
+def invoice_provider():
+    return LocalInvoiceProvider()
+
+def test_get_preimage_success(invoice_provider):
+    payment_request, _ = invoice_provider.new_invoice(1, "USD", "Test invoice")
+    preimage_provider = LocalPreimageProvider(invoice_provider)
+
+    preimage = preimage_provider.get_preimage(payment_request)
+    assert preimage == invoice_provider.lookup_preimage(payment_request)
+
+def test_get_preimage_unknown_invoice(invoice_provider):
+    preimage_provider = LocalPreimageProvider(invoice_provider)
+
+    with pytest.raises(Exception, match="Unknown invoice"):
+        preimage_provider.get_preimage("lnbcrt1unknown")
+
+def test_get_preimage_latency(invoice_provider, mocker):
+    payment_request, _ = invoice_provider.new_invoice(1, "USD", "Test invoice")
+    preimage_provider = LocalPreimageProvider(invoice_provider, latency=0.25)
+    sleep = mocker.patch("l402.client.preimage_provider.local_provider.time.sleep")
+
+    preimage_provider.get_preimage(payment_request)
+    sleep.assert_called_once_with(0.25)
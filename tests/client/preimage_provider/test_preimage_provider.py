@@ -0,0 +1,38 @@
+import threading
+import pytest
+
+from l402.client.preimage_provider import (
+    PreimageProvider, AsyncPreimageProvider, ThreadedPreimageProvider, as_async_preimage_provider,
+)
+
+class ThreadRecordingProvider(PreimageProvider):
+    def __init__(self):
+        self.threads = []
+
+    def get_preimage(self, invoice: str) -> str:
+        self.threads.append(threading.current_thread())
+        return f"preimage for {invoice}"
+
+class AsyncProvider(AsyncPreimageProvider):
+    async def get_preimage(self, invoice: str) -> str:
+        return "preimage"
+
+@pytest.mark.asyncio
+async def test_threaded_preimage_provider():
+    provider = ThreadRecordingProvider()
+    threaded = ThreadedPreimageProvider(provider)
+
+    preimage = await threaded.get_preimage("invoice")
+
+    assert preimage == "preimage for invoice"
+    assert provider.threads[0] is not threading.main_thread()
+
+def test_as_async_preimage_provider():
+    provider = ThreadRecordingProvider()
+    adapted = as_async_preimage_provider(provider)
+    assert isinstance(adapted, ThreadedPreimageProvider)
+    assert adapted.provider is provider
+
+    async_provider = AsyncProvider()
+    assert as_async_preimage_provider(async_provider) is async_provider
+    assert as_async_preimage_provider(None) is None
@@ -1,6 +1,11 @@
+import asyncio
+from contextlib import asynccontextmanager
 import pytest
-from httpx import Response
+from httpx import Response, Limits
 from l402.client import Client, L402Credentials
+from l402.client.credentials import PathPrefixPolicy
+from l402.client.preimage_provider import ThreadedPreimageProvider
+from l402.client.payment_lock import FilePaymentLock
 
 @pytest.mark.asyncio
 async def test_add_authorization_header(mocker):
@@ -72,7 +77,7 @@ async def test_make_request_with_existing_creds(mocker):
     response_mock = mocker.MagicMock(spec=Response)
     response_mock.status_code = 200
     async_client_mock = mocker.AsyncMock()
-    async_client_mock.__aenter__.return_value.request.return_value = response_mock
+    async_client_mock.request.return_value = response_mock
     mocker.patch("httpx.AsyncClient", return_value=async_client_mock)
 
     add_authorization_header_mock = mocker.patch.object(client, "_add_authorization_header")
@@ -82,7 +87,7 @@ async def test_make_request_with_existing_creds(mocker):
     assert response == response_mock
     client.credentials_service.get.assert_called_once_with(url)
     add_authorization_header_mock.assert_called_once_with(kwargs, creds)
-    async_client_mock.__aenter__.return_value.request.assert_awaited_once_with(method, url, **kwargs)
+    async_client_mock.request.assert_awaited_once_with(method, url, **kwargs)
 
 @pytest.mark.asyncio
 async def test_make_request_success_without_402(mocker):
@@ -97,7 +102,7 @@ async def test_make_request_success_without_402(mocker):
     response_mock = mocker.MagicMock(spec=Response)
     response_mock.status_code = 200
     async_client_mock = mocker.AsyncMock()
-    async_client_mock.__aenter__.return_value.request.return_value = response_mock
+    async_client_mock.request.return_value = response_mock
     mocker.patch("httpx.AsyncClient", return_value=async_client_mock)
 
     add_authorization_header_mock = mocker.patch.object(client, "_add_authorization_header")
@@ -107,7 +112,7 @@ async def test_make_request_success_without_402(mocker):
     assert response == response_mock
     client.credentials_service.get.assert_called_once_with(url)
     add_authorization_header_mock.assert_not_called()
-    async_client_mock.__aenter__.return_value.request.assert_awaited_once_with(method, url, **kwargs)
+    async_client_mock.request.assert_awaited_once_with(method, url, **kwargs)
 
 @pytest.mark.asyncio
 async def test_make_request_with_402_handling(mocker):
@@ -124,7 +129,7 @@ async def test_make_request_with_402_handling(mocker):
     response_mock_200 = mocker.MagicMock(spec=Response)
     response_mock_200.status_code = 200
     async_client_mock = mocker.AsyncMock()
-    async_client_mock.__aenter__.return_value.request.side_effect = [response_mock_402, response_mock_200]
+    async_client_mock.request.side_effect = [response_mock_402, response_mock_200]
     mocker.patch("httpx.AsyncClient", return_value=async_client_mock)
 
     creds = mocker.MagicMock(spec=L402Credentials)
@@ -139,4 +144,326 @@ async def test_make_request_with_402_handling(mocker):
 
     add_authorization_header_mock.assert_called_once_with(kwargs, creds)
 
-    assert async_client_mock.__aenter__.return_value.request.await_count == 2
\ No newline at end of file
+    assert async_client_mock.request.await_count == 2
+
+@pytest.mark.asyncio
+async def test_concurrent_402_single_payment(mocker):
+    client = Client(preimage_provider=mocker.AsyncMock(), credentials_service=mocker.AsyncMock())
+    client.credentials_service.get.return_value = None
+
+    url = "http://example.com"
+    sent = []
+
+    async def fake_request(method, url, **kwargs):
+        headers = kwargs.get("headers", {})
+        sent.append(headers.get("Authorization"))
+        # Let every request reach the server before any payment completes.
+        await asyncio.sleep(0.01)
+        response = mocker.MagicMock(spec=Response)
+        response.status_code = 200 if "Authorization" in headers else 402
+        return response
+
+    async_client_mock = mocker.AsyncMock()
+    async_client_mock.request.side_effect = fake_request
+    mocker.patch("httpx.AsyncClient", return_value=async_client_mock)
+
+    creds = L402Credentials("macaroon", "preimage", "invoice")
+
+    async def fake_payment(url, response):
+        await asyncio.sleep(0.01)
+        return creds
+
+    handle_402_mock = mocker.patch.object(client, "_handle_402_payment_required", side_effect=fake_payment)
+
+    responses = await asyncio.gather(*[client.request("GET", url) for _ in range(5)])
+
+    assert all(response.status_code == 200 for response in responses)
+    handle_402_mock.assert_awaited_once()
+    client.credentials_service.invalidate.assert_not_called()
+    assert sent.count(creds.authentication_header()) == 5
+    assert client._flights == {}
+
+@pytest.mark.asyncio
+async def test_rejected_credentials_trigger_new_payment(mocker):
+    client = Client(preimage_provider=mocker.AsyncMock(), credentials_service=mocker.AsyncMock())
+
+    url = "http://example.com"
+    old_creds = L402Credentials("old_macaroon", "preimage", "invoice")
+    new_creds = L402Credentials("new_macaroon", "preimage", "invoice")
+    client.credentials_service.get.return_value = old_creds
+
+    response_402 = mocker.MagicMock(spec=Response)
+    response_402.status_code = 402
+    response_200 = mocker.MagicMock(spec=Response)
+    response_200.status_code = 200
+    async_client_mock = mocker.AsyncMock()
+    async_client_mock.request.side_effect = [response_402, response_200]
+    mocker.patch("httpx.AsyncClient", return_value=async_client_mock)
+
+    handle_402_mock = mocker.patch.object(client, "_handle_402_payment_required", return_value=new_creds)
+
+    response = await client.request("GET", url)
+
+    assert response == response_200
+    client.credentials_service.invalidate.assert_awaited_once_with(url)
+    handle_402_mock.assert_awaited_once_with(url, response_402)
+
+@pytest.mark.asyncio
+async def test_rejected_credentials_with_service_without_invalidate(mocker):
+    class GetStoreService:
+        async def get(self, location):
+            return L402Credentials("old_macaroon", "preimage", "invoice")
+
+        async def store(self, credentials):
+            pass
+
+    client = Client(preimage_provider=mocker.AsyncMock(), credentials_service=GetStoreService())
+
+    response_402 = mocker.MagicMock(spec=Response)
+    response_402.status_code = 402
+    response_200 = mocker.MagicMock(spec=Response)
+    response_200.status_code = 200
+    async_client_mock = mocker.AsyncMock()
+    async_client_mock.request.side_effect = [response_402, response_200]
+    mocker.patch("httpx.AsyncClient", return_value=async_client_mock)
+    mocker.patch.object(client, "_handle_402_payment_required",
+                        return_value=L402Credentials("new_macaroon", "preimage", "invoice"))
+
+    assert await client.request("GET", "http://example.com") == response_200
+
+@pytest.mark.asyncio
+async def test_payment_lock_reuses_credentials_paid_elsewhere(mocker, tmp_path):
+    client = Client(preimage_provider=mocker.AsyncMock(), credentials_service=mocker.AsyncMock(),
+                    payment_lock=FilePaymentLock(str(tmp_path)))
+
+    url = "http://example.com"
+    old_creds = L402Credentials("old_macaroon", "preimage", "invoice")
+    # Stored by another process while this one waited for the lock.
+    other_creds = L402Credentials("other_macaroon", "preimage", "invoice")
+    client.credentials_service.get.side_effect = [old_creds, other_creds]
+
+    response_402 = mocker.MagicMock(spec=Response)
+    response_402.status_code = 402
+    response_200 = mocker.MagicMock(spec=Response)
+    response_200.status_code = 200
+    async_client_mock = mocker.AsyncMock()
+    async_client_mock.request.side_effect = [response_402, response_200]
+    mocker.patch("httpx.AsyncClient", return_value=async_client_mock)
+
+    handle_402_mock = mocker.patch.object(client, "_handle_402_payment_required")
+
+    response = await client.request("GET", url)
+
+    assert response == response_200
+    handle_402_mock.assert_not_called()
+    client.credentials_service.invalidate.assert_not_called()
+    retry_headers = async_client_mock.request.call_args.kwargs["headers"]
+    assert retry_headers["Authorization"] == other_creds.authentication_header()
+
+@pytest.mark.asyncio
+async def test_preflight_sends_body_once(mocker):
+    client = Client(preimage_provider=mocker.AsyncMock(), credentials_service=mocker.AsyncMock(), preflight="HEAD")
+    client.credentials_service.get.return_value = None
+
+    url = "http://example.com/upload"
+    creds = L402Credentials("macaroon", "preimage", "invoice")
+    response_402 = mocker.MagicMock(spec=Response)
+    response_402.status_code = 402
+    response_200 = mocker.MagicMock(spec=Response)
+    response_200.status_code = 200
+
+    probes = []
+    @asynccontextmanager
+    async def stream(method, url, **kwargs):
+        probes.append((method, dict(kwargs["headers"])))
+        yield response_402
+
+    async_client_mock = mocker.AsyncMock()
+    async_client_mock.stream = stream
+    async_client_mock.request.return_value = response_200
+    mocker.patch("httpx.AsyncClient", return_value=async_client_mock)
+    handle_402_mock = mocker.patch.object(client, "_handle_402_payment_required", return_value=creds)
+
+    response = await client.request("PUT", url, content=b"payload", headers={"X-Upload": "1"})
+
+    assert response == response_200
+    assert probes == [("HEAD", {"X-Upload": "1"})]
+    handle_402_mock.assert_awaited_once_with(url, response_402)
+    async_client_mock.request.assert_awaited_once()
+    assert async_client_mock.request.call_args.kwargs["content"] == b"payload"
+    assert async_client_mock.request.call_args.kwargs["headers"]["Authorization"] == creds.authentication_header()
+
+@pytest.mark.asyncio
+async def test_stream_pays_on_headers(mocker):
+    client = Client(preimage_provider=mocker.AsyncMock(), credentials_service=mocker.AsyncMock())
+    client.credentials_service.get.return_value = None
+
+    url = "http://example.com/download"
+    creds = L402Credentials("macaroon", "preimage", "invoice")
+    response_402 = mocker.MagicMock(spec=Response)
+    response_402.status_code = 402
+    response_200 = mocker.MagicMock(spec=Response)
+    response_200.status_code = 200
+
+    opened, closed = [], []
+    @asynccontextmanager
+    async def stream(method, url, **kwargs):
+        response = response_402 if not opened else response_200
+        opened.append(kwargs.get("headers", {}).get("Authorization"))
+        yield response
+        closed.append(response)
+
+    async_client_mock = mocker.AsyncMock()
+    async_client_mock.stream = stream
+    mocker.patch("httpx.AsyncClient", return_value=async_client_mock)
+    handle_402_mock = mocker.patch.object(client, "_handle_402_payment_required", return_value=creds)
+
+    async with client.stream("GET", url) as response:
+        assert response is response_200
+        # The challenge is closed before the paid response is opened.
+        assert closed == [response_402]
+
+    assert closed == [response_402, response_200]
+    assert opened == [None, creds.authentication_header()]
+    handle_402_mock.assert_awaited_once_with(url, response_402)
+    response_402.read.assert_not_called()
+    assert client._flights == {}
+
+@pytest.mark.asyncio
+async def test_unrelated_requests_run_concurrently(mocker):
+    client = Client(preimage_provider=mocker.AsyncMock(), credentials_service=mocker.AsyncMock())
+    client.credentials_service.get.return_value = None
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def fake_request(method, url, **kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        response = mocker.MagicMock(spec=Response)
+        response.status_code = 200
+        return response
+
+    async_client_mock = mocker.AsyncMock()
+    async_client_mock.request.side_effect = fake_request
+    mocker.patch("httpx.AsyncClient", return_value=async_client_mock)
+
+    await asyncio.gather(*[client.request("GET", f"http://example.com/{i}") for i in range(3)])
+
+    assert max_in_flight == 3
+
+@pytest.mark.asyncio
+async def test_http_client_is_reused(mocker):
+    client = Client(preimage_provider=mocker.AsyncMock(), credentials_service=mocker.AsyncMock())
+    client.credentials_service.get.return_value = None
+
+    response_mock = mocker.MagicMock(spec=Response)
+    response_mock.status_code = 200
+    async_client_mock = mocker.AsyncMock()
+    async_client_mock.request.return_value = response_mock
+    async_client_cls = mocker.patch("httpx.AsyncClient", return_value=async_client_mock)
+
+    async with client:
+        await client.request("GET", "http://example.com/a")
+        await client.request("GET", "http://example.com/b")
+
+    async_client_cls.assert_called_once()
+    assert async_client_mock.request.await_count == 2
+    async_client_mock.aclose.assert_awaited_once()
+    assert client._http_client is None
+
+def test_http_client_configuration(mocker):
+    limits = Limits(max_connections=5, max_keepalive_connections=5)
+    client = Client(limits=limits, http2=True, timeout=5.0)
+    async_client_cls = mocker.patch("httpx.AsyncClient")
+
+    client._get_http_client()
+
+    async_client_cls.assert_called_once_with(limits=limits, http2=True, timeout=5.0)
+
+@pytest.mark.asyncio
+async def test_policy_scopes_payments(mocker):
+    client = Client(preimage_provider=mocker.AsyncMock(), credentials_service=mocker.AsyncMock(),
+                    policy=PathPrefixPolicy())
+    client.credentials_service.get.return_value = None
+
+    async def fake_request(method, url, **kwargs):
+        await asyncio.sleep(0.01)
+        response = mocker.MagicMock(spec=Response)
+        response.status_code = 200 if "Authorization" in kwargs.get("headers", {}) else 402
+        return response
+
+    async_client_mock = mocker.AsyncMock()
+    async_client_mock.request.side_effect = fake_request
+    mocker.patch("httpx.AsyncClient", return_value=async_client_mock)
+
+    creds = L402Credentials("macaroon", "preimage", "invoice")
+    handle_402_mock = mocker.patch.object(client, "_handle_402_payment_required", return_value=creds)
+
+    await asyncio.gather(*[client.request("GET", f"http://example.com/items/{i}") for i in range(3)])
+
+    handle_402_mock.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_handle_402_stores_policy_scope(mocker):
+    client = Client(preimage_provider=mocker.AsyncMock(), credentials_service=mocker.AsyncMock(),
+                    policy=PathPrefixPolicy())
+    client.preimage_provider.get_preimage.return_value = "preimage"
+
+    response = mocker.MagicMock(spec=Response)
+    response.headers = {"WWW-Authenticate": 'L402 macaroon="macaroon", invoice="invoice"'}
+
+    creds = await client._handle_402_payment_required("http://example.com/items/1", response)
+
+    assert creds.location == "http://example.com/items/*"
+
+@pytest.mark.asyncio
+async def test_prefetch(mocker):
+    client = Client(preimage_provider=mocker.AsyncMock(), credentials_service=mocker.AsyncMock(),
+                    policy=PathPrefixPolicy())
+
+    existing_creds = L402Credentials("existing", "preimage", "invoice")
+    new_creds = L402Credentials("new", "preimage", "invoice")
+    client.credentials_service.get.side_effect = lambda url: existing_creds if "/paid/" in url else None
+
+    status_codes = {"http://example.com/items/1": 402, "http://example.com/free/1": 200}
+    probed = []
+
+    @asynccontextmanager
+    async def fake_stream(method, url, **kwargs):
+        probed.append((method, url))
+        response = mocker.MagicMock(spec=Response)
+        response.status_code = status_codes[url]
+        yield response
+
+    async_client_mock = mocker.MagicMock()
+    async_client_mock.stream = fake_stream
+    mocker.patch("httpx.AsyncClient", return_value=async_client_mock)
+    handle_402_mock = mocker.patch.object(client, "_handle_402_payment_required", return_value=new_creds)
+
+    result = await client.prefetch([
+        "http://example.com/items/1",
+        "http://example.com/items/2",
+        "http://example.com/free/1",
+        "http://example.com/paid/1",
+    ], concurrency=2)
+
+    assert result == {
+        "http://example.com/items/1": new_creds,
+        "http://example.com/items/2": new_creds,
+        "http://example.com/free/1": None,
+        "http://example.com/paid/1": existing_creds,
+    }
+    assert sorted(probed) == [("GET", "http://example.com/free/1"), ("GET", "http://example.com/items/1")]
+    handle_402_mock.assert_awaited_once()
+    assert client._flights == {}
+
+def test_sync_preimage_provider_is_adapted(mocker):
+    provider = mocker.Mock()
+    client = Client(preimage_provider=provider, credentials_service=mocker.AsyncMock())
+
+    assert isinstance(client.preimage_provider, ThreadedPreimageProvider)
+    assert client.preimage_provider.provider is provider
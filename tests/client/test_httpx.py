@@ -0,0 +1,183 @@
+import httpx
+import pytest
+
+from l402.client import httpx as l402_httpx
+from l402.client.credentials import L402Credentials
+from l402.client.origin_cache import OriginCache, origin_of
+
+CHALLENGE = 'L402 macaroon="macaroon", invoice="invoice"'
+AUTH_HEADER = "L402 macaroon:preimage"
+
+@pytest.fixture
+def credentials_service(mocker):
+    service = mocker.AsyncMock()
+    service.get.return_value = None
+    return service
+
+@pytest.fixture
+def preimage_provider(mocker):
+    provider = mocker.AsyncMock()
+    provider.get_preimage.return_value = "preimage"
+    return provider
+
+@pytest.fixture
+def configured(preimage_provider, credentials_service):
+    l402_httpx.configure(preimage_provider, credentials_service)
+
+def paid_api(request):
+    """Answers 402 on /paid unless the request carries the credentials."""
+    if request.url.path.startswith("/paid") and request.headers.get("Authorization") != AUTH_HEADER:
+        return httpx.Response(402, headers={"WWW-Authenticate": CHALLENGE})
+    return httpx.Response(200, text="ok")
+
+def make_client(**kwargs):
+    return l402_httpx.AsyncClient(transport=httpx.MockTransport(paid_api), **kwargs)
+
+def test_not_configured(mocker):
+    mocker.patch.object(l402_httpx, "_default_preimage_provider", None)
+    with pytest.raises(Exception, match="You must configure the client before using it."):
+        l402_httpx.AsyncClient()
+
+@pytest.mark.asyncio
+async def test_402_handling(configured, credentials_service, preimage_provider):
+    async with make_client() as client:
+        response = await client.get("https://api.example.com/paid")
+
+    assert response.status_code == 200
+    preimage_provider.get_preimage.assert_awaited_once_with("invoice")
+    stored = credentials_service.store.call_args[0][0]
+    assert stored.location == "https://api.example.com/paid"
+
+@pytest.mark.asyncio
+async def test_free_origin_skips_lookups(configured, credentials_service):
+    async with make_client() as client:
+        for _ in range(3):
+            response = await client.get("https://free.example.com/resource")
+            assert response.status_code == 200
+
+    credentials_service.get.assert_awaited_once_with("https://free.example.com/resource")
+
+@pytest.mark.asyncio
+async def test_402_flips_free_origin(configured, credentials_service, preimage_provider):
+    async with make_client() as client:
+        await client.get("https://api.example.com/free")
+        response = await client.get("https://api.example.com/paid")
+        assert response.status_code == 200
+
+        await client.get("https://api.example.com/free")
+
+    assert credentials_service.get.await_count == 3
+    preimage_provider.get_preimage.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_stored_credentials_used_after_skipped_lookup(configured, credentials_service, preimage_provider):
+    async with make_client() as client:
+        await client.get("https://api.example.com/free")
+
+        credentials_service.get.return_value = L402Credentials("macaroon", "preimage", "invoice")
+        response = await client.get("https://api.example.com/paid")
+
+    assert response.status_code == 200
+    preimage_provider.get_preimage.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_origin_cache_disabled(configured, credentials_service):
+    async with make_client(l402_origin_ttl=0) as client:
+        await client.get("https://free.example.com/resource")
+        await client.get("https://free.example.com/resource")
+
+    assert credentials_service.get.await_count == 2
+
+@pytest.mark.asyncio
+async def test_rejected_credentials_with_service_without_invalidate(preimage_provider):
+    class GetStoreService:
+        def __init__(self):
+            self.credentials = L402Credentials("old_macaroon", "preimage", "invoice")
+
+        async def get(self, location):
+            return self.credentials
+
+        async def store(self, credentials):
+            self.credentials = credentials
+
+    service = GetStoreService()
+    l402_httpx.configure(preimage_provider, service)
+
+    async with make_client() as client:
+        response = await client.get("https://api.example.com/paid")
+
+    assert response.status_code == 200
+    assert service.credentials.macaroon == "macaroon"
+
+def test_origin_cache_ttl_and_size(mocker):
+    now = [1000.0]
+    mocker.patch("l402.client.origin_cache.time.monotonic", side_effect=lambda: now[0])
+    cache = OriginCache(max_size=2, ttl=10)
+
+    cache.mark_free("https://a.com")
+    cache.mark_paid("https://b.com")
+    cache.mark_free("https://b.com")
+    assert cache.is_free("https://a.com")
+    assert not cache.is_free("https://b.com")
+
+    cache.mark_free("https://c.com")
+    assert len(cache) == 2
+    assert not cache.is_free("https://a.com")
+
+    now[0] += 11
+    assert not cache.is_free("https://c.com")
+
+def test_origin_of():
+    assert origin_of(httpx.URL("https://example.com/a?b=c")) == "https://example.com"
+    assert origin_of(httpx.URL("http://example.com:8080/a")) == "http://example.com:8080"
+
+@pytest.mark.asyncio
+async def test_preflight_sends_body_once(configured, preimage_provider):
+    seen = []
+
+    def api(request):
+        seen.append((request.method, request.content))
+        return paid_api(request)
+
+    async with l402_httpx.AsyncClient(transport=httpx.MockTransport(api), l402_preflight="HEAD") as client:
+        response = await client.post("https://api.example.com/paid", content=b"x" * 1024)
+
+    assert response.status_code == 200
+    assert seen == [("HEAD", b""), ("POST", b"x" * 1024)]
+    preimage_provider.get_preimage.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_preflight_skipped_without_body(configured):
+    seen = []
+
+    def api(request):
+        seen.append(request.method)
+        return paid_api(request)
+
+    async with l402_httpx.AsyncClient(transport=httpx.MockTransport(api), l402_preflight="HEAD") as client:
+        response = await client.get("https://api.example.com/paid")
+
+    assert response.status_code == 200
+    assert seen == ["GET", "GET"]
+
+@pytest.mark.asyncio
+async def test_stream_yields_paid_body_in_chunks(configured, preimage_provider):
+    chunks = [b"a" * 1024] * 8
+
+    class Body(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            for chunk in chunks:
+                yield chunk
+
+    def api(request):
+        if request.headers.get("Authorization") != AUTH_HEADER:
+            return httpx.Response(402, headers={"WWW-Authenticate": CHALLENGE}, stream=Body())
+        return httpx.Response(200, stream=Body())
+
+    async with l402_httpx.AsyncClient(transport=httpx.MockTransport(api)) as client:
+        async with client.stream("GET", "https://api.example.com/paid") as response:
+            assert response.status_code == 200
+            received = [chunk async for chunk in response.aiter_raw()]
+
+    assert received == chunks
+    preimage_provider.get_preimage.assert_awaited_once()
@@ -0,0 +1,176 @@
+import asyncio
+import pytest
+from unittest.mock import patch, Mock
+
+from l402.client import AsyncHubService, HubService, L402Credentials
+
+@pytest.fixture
+def hub():
+    return AsyncHubService(api_key="hub_api_key", api_url="https://hub.example.com")
+
+def test_missing_api_key(monkeypatch):
+    monkeypatch.delenv("HUB_API_KEY", raising=False)
+    with pytest.raises(ValueError, match="API key must be provided"):
+        HubService()
+
+@pytest.mark.asyncio
+@patch("httpx.AsyncClient.get")
+async def test_async_get(mock_get, hub):
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.json.return_value = {"macaroon": "macaroon", "preimage": "preimage", "invoice": "invoice"}
+    mock_get.return_value = mock_response
+
+    credentials = await hub.get("https://example.com/a b")
+
+    assert credentials.macaroon == "macaroon"
+    assert credentials.preimage == "preimage"
+    mock_get.assert_called_once_with(
+        "https://hub.example.com/v0/l402/purchases/by-url?l402_url=https%3A//example.com/a%20b"
+    )
+    assert hub._get_http_client().headers["Authorization"] == "Token hub_api_key"
+    await hub.aclose()
+
+@pytest.mark.asyncio
+@patch("httpx.AsyncClient.get")
+async def test_async_get_not_found(mock_get, hub):
+    mock_response = Mock()
+    mock_response.status_code = 404
+    mock_get.return_value = mock_response
+
+    assert await hub.get("https://example.com") is None
+    await hub.aclose()
+
+@pytest.mark.asyncio
+@patch("httpx.AsyncClient.post")
+async def test_async_get_preimage(mock_post, hub):
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.json.return_value = {"preimage": "preimage"}
+    mock_post.return_value = mock_response
+
+    assert await hub.get_preimage("invoice") == "preimage"
+    assert mock_post.call_args.kwargs["json"]["invoice"] == "invoice"
+    await hub.aclose()
+
+@pytest.mark.asyncio
+@patch("httpx.AsyncClient.post")
+async def test_async_get_preimage_failure(mock_post, hub):
+    mock_response = Mock()
+    mock_response.status_code = 500
+    mock_response.text = "Internal Server Error"
+    mock_post.return_value = mock_response
+
+    with pytest.raises(Exception, match="Failed to pay invoice"):
+        await hub.get_preimage("invoice")
+    await hub.aclose()
+
+@pytest.mark.asyncio
+@patch("httpx.AsyncClient.get")
+async def test_async_get_is_cached(mock_get, hub):
+    found = Mock()
+    found.status_code = 200
+    found.json.return_value = {"macaroon": "macaroon", "preimage": "preimage", "invoice": "invoice"}
+    not_found = Mock()
+    not_found.status_code = 404
+    mock_get.side_effect = lambda url: found if "paid" in url else not_found
+
+    for _ in range(3):
+        assert (await hub.get("https://example.com/paid")).macaroon == "macaroon"
+        assert await hub.get("https://example.com/free") is None
+
+    assert mock_get.call_count == 2
+
+    await hub.invalidate("https://example.com/paid")
+    await hub.get("https://example.com/paid")
+    assert mock_get.call_count == 3
+    await hub.aclose()
+
+@pytest.mark.asyncio
+async def test_async_store_warms_cache(hub, mocker):
+    fetch = mocker.patch.object(hub, "_fetch")
+    credentials = L402Credentials("macaroon", "preimage", "invoice")
+    credentials.set_location("https://example.com")
+
+    await hub.store(credentials)
+
+    assert await hub.get("https://example.com") is credentials
+    fetch.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_async_store_clears_covered_misses(hub, mocker):
+    async def not_found(location):
+        return hub._process_purchase(location, Mock(status_code=404))
+
+    fetch = mocker.patch.object(hub, "_fetch", side_effect=not_found)
+    assert await hub.get("https://example.com/items/1") is None
+    assert await hub.get("https://example.com/items/2") is None
+
+    # Paid for items/1, scoped to all the items.
+    credentials = L402Credentials("macaroon", "preimage", "invoice")
+    credentials.set_location("https://example.com/items/*")
+    await hub.store(credentials)
+
+    assert await hub.get("https://example.com/items/2") is credentials
+    assert fetch.await_count == 2
+
+@pytest.mark.asyncio
+async def test_async_concurrent_lookups_are_coalesced(hub, mocker):
+    async def slow_fetch(location):
+        await asyncio.sleep(0.01)
+        return None
+
+    fetch = mocker.patch.object(hub, "_fetch", side_effect=slow_fetch)
+
+    await asyncio.gather(*[hub.get("https://example.com") for _ in range(5)])
+
+    fetch.assert_awaited_once_with("https://example.com")
+    assert hub._lookups == {}
+
+@pytest.mark.asyncio
+async def test_async_get_many(hub, mocker):
+    credentials = L402Credentials("macaroon", "preimage", "invoice")
+    credentials.set_location("https://example.com/cached")
+    await hub.store(credentials)
+
+    async def fetch(location):
+        return None
+
+    fetch_mock = mocker.patch.object(hub, "_fetch", side_effect=fetch)
+
+    result = await hub.get_many([
+        "https://example.com/cached", "https://example.com/a", "https://example.com/b", "https://example.com/a",
+    ])
+
+    assert result == {
+        "https://example.com/cached": credentials,
+        "https://example.com/a": None,
+        "https://example.com/b": None,
+    }
+    assert fetch_mock.await_count == 2
+
+def test_sync_get_is_cached(mocker):
+    hub = HubService(api_key="hub_api_key", api_url="https://hub.example.com")
+    not_found = Mock()
+    not_found.status_code = 404
+    get = mocker.patch.object(hub._session, "get", return_value=not_found)
+
+    assert hub.get_many(["https://example.com", "https://example.com"]) == {"https://example.com": None}
+    assert hub.get("https://example.com") is None
+    get.assert_called_once()
+
+def test_sync_store_clears_covered_misses(mocker):
+    hub = HubService(api_key="hub_api_key", api_url="https://hub.example.com")
+    not_found = Mock()
+    not_found.status_code = 404
+    get = mocker.patch.object(hub._session, "get", return_value=not_found)
+    assert hub.get("https://example.com/items/1") is None
+    assert hub.get("https://example.com/items/2") is None
+
+    # Paid for items/1, scoped to all the items.
+    credentials = L402Credentials("macaroon", "preimage", "invoice")
+    credentials.set_location("https://example.com/items/*")
+    hub.store(credentials)
+
+    assert hub.get("https://example.com/items/2") is credentials
+    assert get.call_count == 2
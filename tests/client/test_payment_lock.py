@@ -0,0 +1,92 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from l402.client.payment_lock import FilePaymentLock, PaymentLockTimeout
+
+LOCATION = "https://api.example.com/v1/*"
+
+@pytest.fixture
+def payment_lock(tmp_path):
+    return FilePaymentLock(str(tmp_path), poll_interval=0.01)
+
+def _hold_lock(directory, location, ready, release):
+    with FilePaymentLock(directory).acquire(location):
+        ready.set()
+        release.wait(5)
+
+def test_acquire_creates_private_lock_file(payment_lock, tmp_path):
+    with payment_lock.acquire(LOCATION):
+        files = list(tmp_path.iterdir())
+
+    assert len(files) == 1
+    assert files[0].stat().st_mode & 0o777 == 0o600
+
+def test_acquire_is_exclusive_between_threads(payment_lock):
+    active, overlaps = [], []
+
+    def pay():
+        with payment_lock.acquire(LOCATION):
+            active.append(1)
+            overlaps.append(len(active))
+            time.sleep(0.01)
+            active.pop()
+
+    threads = [threading.Thread(target=pay) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert overlaps == [1] * 8
+
+def test_acquire_locations_are_independent(payment_lock):
+    with payment_lock.acquire(LOCATION):
+        with payment_lock.acquire("https://other.example.com/*"):
+            pass
+
+def test_acquire_excludes_other_processes(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    ready, release = ctx.Event(), ctx.Event()
+    holder = ctx.Process(target=_hold_lock, args=(str(tmp_path), LOCATION, ready, release))
+    holder.start()
+    try:
+        assert ready.wait(5)
+        with pytest.raises(PaymentLockTimeout):
+            with FilePaymentLock(str(tmp_path), timeout=0.1, poll_interval=0.01).acquire(LOCATION):
+                pass
+    finally:
+        release.set()
+        holder.join(5)
+
+    with FilePaymentLock(str(tmp_path), timeout=1).acquire(LOCATION):
+        pass
+
+@pytest.mark.asyncio
+async def test_acquire_async_does_not_block_the_loop(payment_lock):
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.005)
+
+    async def pay():
+        async with payment_lock.acquire_async(LOCATION):
+            pass
+
+    task = asyncio.create_task(ticker())
+    try:
+        with payment_lock.acquire(LOCATION):
+            waiter = asyncio.create_task(pay())
+            await asyncio.sleep(0.05)
+            assert not waiter.done()
+        await asyncio.wait_for(waiter, 1)
+    finally:
+        task.cancel()
+
+    assert ticks > 1
@@ -1,7 +1,10 @@
+import threading
 import pytest
 import requests
-from l402.client.requests import SyncClient, Session
-from l402.client.credentials import L402Credentials
+from requests.adapters import HTTPAdapter
+from l402.client.requests import SyncClient, Session, L402Adapter, L402Session
+from l402.client.credentials import CredentialsService, L402Credentials, SqliteCredentialsService
+from l402.client.payment_lock import FilePaymentLock
 
 # Constants
 TEST_MACAROON = "AgELZmV3c2F0cy5jb20CQgAAIHP9p+tLogUGNL0tgYsllbz3830vlSCc8urox4tIJgmyjCg6CeqRv5DMI0hfiZDI93gDGFci27ePiHda6UYAfAACH2V4cGlyZXNfYXQ9MjAyNC0xMC0xMFQxNDo1MToyNVoAAjBleHRlcm5hbF9pZD01MWJlMjlhZi1jMjQzLTQ4MDctOWM5Ni1hNjk3YTEwZTNkYWQAAAYgAcdSlT10N+ivLreBf+kfHnEeuXdatvg8E3NqUjZ8iMk="
@@ -95,6 +98,43 @@ def test_request_with_existing_creds(client, mocker, mock_session):
     }
     mock_session.request.assert_called_once_with(method, url, **expected_kwargs)
 
+class GetStoreService:
+    """A duck-typed credentials service predating invalidate."""
+
+    def __init__(self):
+        self.credentials = L402Credentials("old_macaroon", "old_preimage", TEST_INVOICE)
+
+    def get(self, location):
+        return self.credentials
+
+    def store(self, credentials):
+        self.credentials = credentials
+
+class AsyncInvalidateService(GetStoreService, CredentialsService):
+    """A synchronous service inheriting the asynchronous invalidate of the ABC."""
+
+    def __init__(self):
+        GetStoreService.__init__(self)
+        self.invalidated = []
+
+    async def invalidate(self, location):
+        self.invalidated.append(location)
+
+@pytest.mark.parametrize("service_class", [GetStoreService, AsyncInvalidateService])
+def test_rejected_credentials_with_any_service(mock_preimage_provider, mock_response, mock_session, mocker,
+                                               service_class):
+    service = service_class()
+    client = SyncClient(mock_preimage_provider, service)
+    mock_response._content = b"Payment Required"
+    response_200 = requests.Response()
+    response_200.status_code = 200
+    mock_session.request.side_effect = [mock_response, response_200]
+    mocker.patch("requests.Session", return_value=mock_session)
+
+    assert client.request("GET", TEST_URL) is response_200
+    assert service.credentials.macaroon == TEST_MACAROON
+    assert getattr(service, "invalidated", [TEST_URL]) == [TEST_URL]
+
 def test_request_with_402_handling(client, mocker, mock_response, mock_session):
     url = "http://example.com"
     method = "GET"
@@ -118,6 +158,151 @@ def test_request_with_402_handling(client, mocker, mock_response, mock_session):
     client.credentials_service.store.assert_called_once()
     assert mock_session.request.call_count == 2
 
+def test_session_is_reused(client, mocker, mock_session):
+    client.credentials_service.get.return_value = None
+
+    response = requests.Response()
+    response.status_code = 200
+    mock_session.request.return_value = response
+    session_cls = mocker.patch("requests.Session", return_value=mock_session)
+
+    client.request("GET", "http://example.com/a")
+    client.request("GET", "http://example.com/b")
+
+    session_cls.assert_called_once()
+    assert mock_session.request.call_count == 2
+
+    client.close()
+    mock_session.close.assert_called_once()
+
+def test_session_pool_size(mock_preimage_provider, credentials_service):
+    client = SyncClient(mock_preimage_provider, credentials_service, pool_connections=4, pool_maxsize=32)
+
+    adapter = client._get_session().get_adapter("https://example.com")
+    assert adapter._pool_connections == 4
+    assert adapter._pool_maxsize == 32
+
+def test_prefetch(client, mocker, mock_response, mock_session):
+    existing_creds = L402Credentials(TEST_MACAROON, TEST_PREIMAGE, TEST_INVOICE)
+    client.credentials_service.get.side_effect = lambda url: existing_creds if url.endswith("/paid") else None
+
+    response_200 = requests.Response()
+    response_200.status_code = 200
+    responses = {TEST_URL: mock_response, "http://example.com/free": response_200}
+    mocker.patch.object(mock_response, "close")
+    mocker.patch.object(response_200, "close")
+    mock_session.request.side_effect = lambda method, url, **kwargs: responses[url]
+    mocker.patch("requests.Session", return_value=mock_session)
+
+    result = client.prefetch([TEST_URL, "http://example.com/free", "http://example.com/paid"], concurrency=2)
+
+    assert result[TEST_URL].macaroon == TEST_MACAROON
+    assert result[TEST_URL].preimage == TEST_PREIMAGE
+    assert result["http://example.com/free"] is None
+    assert result["http://example.com/paid"] is existing_creds
+    assert mock_session.request.call_count == 2
+    mock_session.request.assert_any_call("GET", TEST_URL, stream=True)
+    mock_response.close.assert_called_once()
+    client.credentials_service.store.assert_called_once()
+
+def test_prefetch_with_sqlite_credentials_service(mock_preimage_provider, mock_response, mock_session, mocker,
+                                                  tmp_path):
+    service = SqliteCredentialsService(str(tmp_path / "credentials.db"))
+    client = SyncClient(mock_preimage_provider, service)
+
+    response_200 = requests.Response()
+    response_200.status_code = 200
+    mocker.patch.object(mock_response, "close")
+    mocker.patch.object(response_200, "close")
+    mock_session.request.side_effect = lambda method, url, **kwargs: (
+        mock_response if url.startswith(TEST_URL) else response_200
+    )
+    mocker.patch("requests.Session", return_value=mock_session)
+
+    urls = [f"{TEST_URL}/{i}" for i in range(4)] + ["http://example.com/free"]
+    result = client.prefetch(urls, concurrency=4)
+
+    assert result["http://example.com/free"] is None
+    for url in urls[:4]:
+        assert result[url].macaroon == TEST_MACAROON
+        assert service.get(url).macaroon == TEST_MACAROON
+
+class TestL402Adapter:
+    @pytest.fixture
+    def adapter(self, mock_preimage_provider, credentials_service):
+        return L402Adapter(mock_preimage_provider, credentials_service, pool_maxsize=16)
+
+    @pytest.fixture
+    def prepared_request(self):
+        return requests.Request("GET", TEST_URL).prepare()
+
+    def test_send_with_existing_creds(self, adapter, prepared_request, credentials_service, mocker):
+        credentials_service.get.return_value = L402Credentials(TEST_MACAROON, TEST_PREIMAGE, TEST_INVOICE)
+        response_200 = requests.Response()
+        response_200.status_code = 200
+        send = mocker.patch.object(HTTPAdapter, "send", return_value=response_200)
+
+        response = adapter.send(prepared_request)
+
+        assert response is response_200
+        sent_request = send.call_args[0][0]
+        assert sent_request.headers["Authorization"] == f"L402 {TEST_MACAROON}:{TEST_PREIMAGE}"
+        assert "Authorization" not in prepared_request.headers
+
+    def test_send_with_402_handling(self, adapter, prepared_request, mock_response, credentials_service, mocker):
+        credentials_service.get.return_value = None
+        mock_response._content = b"Payment Required"
+        response_200 = requests.Response()
+        response_200.status_code = 200
+        send = mocker.patch.object(HTTPAdapter, "send", side_effect=[mock_response, response_200])
+
+        response = adapter.send(prepared_request)
+
+        assert response is response_200
+        assert response.history == [mock_response]
+        assert send.call_count == 2
+        retried_request = send.call_args_list[1][0][0]
+        assert retried_request.headers["Authorization"] == f"L402 {TEST_MACAROON}:{TEST_PREIMAGE}"
+        assert "Authorization" not in prepared_request.headers
+        credentials_service.store.assert_called_once()
+
+    def test_send_with_rejected_creds_leaves_request_untouched(self, adapter, prepared_request, mock_response,
+                                                              credentials_service, mocker):
+        credentials_service.get.return_value = L402Credentials("old_macaroon", "old_preimage", TEST_INVOICE)
+        mock_response._content = b"Payment Required"
+        response_200 = requests.Response()
+        response_200.status_code = 200
+        send = mocker.patch.object(HTTPAdapter, "send", side_effect=[mock_response, response_200])
+
+        adapter.send(prepared_request)
+
+        assert [call[0][0].headers["Authorization"] for call in send.call_args_list] == [
+            "L402 old_macaroon:old_preimage", f"L402 {TEST_MACAROON}:{TEST_PREIMAGE}",
+        ]
+        assert "Authorization" not in prepared_request.headers
+
+    def test_send_releases_challenge_before_paying(self, adapter, prepared_request, mock_response,
+                                                   credentials_service, mock_preimage_provider, mocker):
+        credentials_service.get.return_value = None
+        events = []
+        mocker.patch.object(mock_response, "close", side_effect=lambda: events.append("released"))
+        mock_preimage_provider.get_preimage.side_effect = lambda invoice: events.append("paid") or TEST_PREIMAGE
+        response_200 = requests.Response()
+        response_200.status_code = 200
+        mocker.patch.object(HTTPAdapter, "send", side_effect=[mock_response, response_200])
+
+        adapter.send(prepared_request, stream=True)
+
+        assert events == ["released", "paid"]
+
+    def test_l402_session_mounts_adapter(self, mock_preimage_provider, credentials_service):
+        session = L402Session(mock_preimage_provider, credentials_service, pool_maxsize=8)
+
+        for url in ("https://example.com", "http://example.com"):
+            adapter = session.get_adapter(url)
+            assert isinstance(adapter, L402Adapter)
+            assert adapter._pool_maxsize == 8
+
 class TestSession:
     @pytest.fixture
     def session(self):
@@ -139,6 +324,13 @@ class TestSession:
         assert isinstance(session._client, SyncClient)
         assert session.is_configured
 
+    def test_prefetch_configured(self, session, mock_preimage_provider, credentials_service, mocker):
+        session.configure(mock_preimage_provider, credentials_service)
+        mocker.patch.object(session._client, "prefetch", return_value={})
+
+        assert session.prefetch(["http://example.com"], concurrency=4) == {}
+        session._client.prefetch.assert_called_once_with(["http://example.com"], concurrency=4)
+
     def test_request_not_configured(self, session):
         with pytest.raises(Exception, match="No request client configured."):
             session.request("GET", "http://example.com")
@@ -153,7 +345,7 @@ class TestSession:
         assert response == mock_response
         session._client.request.assert_called_once_with("GET", "http://example.com")
 
-    @pytest.mark.parametrize("method", ["get", "post", "put", "delete"])
+    @pytest.mark.parametrize("method", ["get", "post", "put", "delete", "patch", "head", "options"])
     def test_http_methods(self, session, mock_preimage_provider, credentials_service, mocker, method):
         session.configure(mock_preimage_provider, credentials_service)
         mock_response = mocker.Mock(spec=requests.Response)
@@ -164,3 +356,65 @@ class TestSession:
         assert response == mock_response
         session.request.assert_called_once_with(method.upper(), "http://example.com", data={"key": "value"})
 
+
+def test_request_with_payment_lock_pays_once(mock_preimage_provider, mock_response, mock_session, mocker, tmp_path):
+    db_path = str(tmp_path / "credentials.db")
+    payment_lock = FilePaymentLock(str(tmp_path / "locks"), poll_interval=0.01)
+
+    def send(method, url, **kwargs):
+        if "Authorization" in kwargs.get("headers", {}):
+            response = requests.Response()
+            response.status_code = 200
+            return response
+        return mock_response
+
+    mock_session.request.side_effect = send
+    mocker.patch("requests.Session", return_value=mock_session)
+
+    # Each worker has its own client and connection to the shared database,
+    # as separate processes would.
+    results = []
+    def worker():
+        client = SyncClient(mock_preimage_provider, SqliteCredentialsService(db_path), payment_lock=payment_lock)
+        results.append(client.request("GET", TEST_URL).status_code)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [200] * 4
+    mock_preimage_provider.get_preimage.assert_called_once_with(TEST_INVOICE)
+
+def test_request_with_preflight_sends_body_once(mock_preimage_provider, credentials_service, mock_response, mock_session, mocker):
+    credentials_service.get.return_value = None
+    client = SyncClient(mock_preimage_provider, credentials_service, preflight="HEAD")
+    response_200 = requests.Response()
+    response_200.status_code = 200
+    mocker.patch.object(mock_response, "close")
+    mock_session.request.side_effect = [mock_response, response_200]
+    mocker.patch("requests.Session", return_value=mock_session)
+
+    response = client.request("POST", TEST_URL, data=b"payload")
+
+    assert response is response_200
+    assert mock_session.request.call_count == 2
+    mock_session.request.assert_any_call("HEAD", TEST_URL, stream=True)
+    assert mock_session.request.call_args.args == ("POST", TEST_URL)
+    assert mock_session.request.call_args.kwargs["data"] == b"payload"
+    assert "Authorization" in mock_session.request.call_args.kwargs["headers"]
+
+def test_request_stream_releases_challenge(client, mock_response, mock_session, mocker):
+    client.credentials_service.get.return_value = None
+    response_200 = requests.Response()
+    response_200.status_code = 200
+    mocker.patch.object(mock_response, "close")
+    mock_session.request.side_effect = [mock_response, response_200]
+    mocker.patch("requests.Session", return_value=mock_session)
+
+    response = client.request("GET", TEST_URL, stream=True)
+
+    assert response is response_200
+    mock_response.close.assert_called_once()
+    assert all(call.kwargs["stream"] for call in mock_session.request.call_args_list)
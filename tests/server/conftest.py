@@ -0,0 +1,28 @@
+import pytest
+
+from l402.server import Authenticator, MacaroonService
+from l402.server.invoice_provider import LocalInvoiceProvider
+
+class InMemoryMacaroonService(MacaroonService):
+    """The test client runs the app in another thread, away from SQLite connections."""
+
+    def __init__(self):
+        self.root_keys = {}
+        self.usage = {}
+
+    async def insert_root_key(self, token_id, root_key, macaroon, expires_at=None):
+        self.root_keys[token_id] = root_key
+
+    async def get_root_key(self, token_id):
+        return self.root_keys.get(token_id)
+
+    async def get_usage(self, token_id):
+        return self.usage.get(token_id, 0)
+
+    async def record_usage(self, usage):
+        for token_id, calls in usage.items():
+            self.usage[token_id] = self.usage.get(token_id, 0) + calls
+
+@pytest.fixture
+def authenticator():
+    return Authenticator("test_location", LocalInvoiceProvider(), InMemoryMacaroonService())
@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+
+from l402.server.invoice_provider import InvoiceProvider, LocalInvoiceProvider
+
+
+class SlowInvoiceProvider(InvoiceProvider):
+    def __init__(self, fail_on=None):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_on = fail_on
+
+    async def create_invoice(self, amount, currency, description):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if description == self.fail_on:
+                raise ValueError(f"Failed to create invoice: {description}")
+            return f"lnbc{amount}", description
+        finally:
+            self.in_flight -= 1
+
+@pytest.mark.asyncio
+async def test_create_invoices_preserves_order():
+    provider = SlowInvoiceProvider()
+    requests = [(i, "sats", f"invoice {i}") for i in range(5)]
+
+    invoices = await provider.create_invoices(requests)
+
+    assert invoices == [(f"lnbc{i}", f"invoice {i}") for i in range(5)]
+
+@pytest.mark.asyncio
+async def test_create_invoices_bounded_concurrency():
+    provider = SlowInvoiceProvider()
+    requests = [(i, "sats", f"invoice {i}") for i in range(20)]
+
+    await provider.create_invoices(requests, max_concurrency=3)
+
+    assert provider.max_in_flight == 3
+
+@pytest.mark.asyncio
+async def test_create_invoices_failure():
+    provider = SlowInvoiceProvider(fail_on="invoice 2")
+    requests = [(i, "sats", f"invoice {i}") for i in range(5)]
+
+    with pytest.raises(ValueError, match="invoice 2"):
+        await provider.create_invoices(requests, max_concurrency=5)
+
+@pytest.mark.asyncio
+async def test_local_provider_create_invoices():
+    provider = LocalInvoiceProvider()
+    invoices = await provider.create_invoices([(1, "sats", "a"), (2, "sats", "b")])
+
+    assert len(invoices) == 2
+    for payment_request, _ in invoices:
+        assert provider.lookup_preimage(payment_request) is not None
@@ -0,0 +1,100 @@
+import hashlib
+import pytest
+
+from l402.server import Authenticator
+from l402.server.invoice_provider import LocalInvoiceProvider
+from l402.server.invoice_provider.local_provider import (
+    BECH32_CHARSET, _bech32_hrp_expand, _bech32_polymod,
+)
+from l402.server.macaroons import SqliteMacaroonService
+from l402.client.preimage_provider import LocalPreimageProvider
+
+
+def decode_bech32(invoice):
+    hrp, _, data = invoice.rpartition("1")
+    words = [BECH32_CHARSET.index(c) for c in data]
+    return hrp, words
+
+def words_to_bytes(words):
+    acc, bits, out = 0, 0, bytearray()
+    for word in words:
+        acc = (acc << 5) | word
+        bits += 5
+        if bits >= 8:
+            bits -= 8
+            out.append((acc >> bits) & 0xff)
+    return bytes(out)
+
+def tagged_field(words, field_tag):
+    # Skip the 35-bit timestamp and walk the tagged fields.
+    i = 7
+    while i < len(words) - 104 - 6:
+        tag, length = words[i], words[i + 1] * 32 + words[i + 2]
+        if tag == field_tag:
+            return words[i + 3:i + 3 + length]
+        i += 3 + length
+    return None
+
+def payment_hash_field(words):
+    field = tagged_field(words, 1)
+    return words_to_bytes(field)[:32] if field is not None else None
+
+@pytest.mark.asyncio
+async def test_create_invoice_is_valid_bech32():
+    provider = LocalInvoiceProvider()
+    payment_request, payment_hash = await provider.create_invoice(100, "sats", "Test invoice")
+
+    hrp, words = decode_bech32(payment_request)
+    assert hrp == "lnbcrt1000n"
+    assert _bech32_polymod(_bech32_hrp_expand(hrp) + words) == 1
+    assert payment_hash_field(words).hex() == payment_hash
+
+@pytest.mark.asyncio
+async def test_long_description_is_truncated():
+    provider = LocalInvoiceProvider()
+    payment_request, payment_hash = await provider.create_invoice(100, "sats", "é" * 1000)
+
+    hrp, words = decode_bech32(payment_request)
+    assert _bech32_polymod(_bech32_hrp_expand(hrp) + words) == 1
+    assert payment_hash_field(words).hex() == payment_hash
+    description = words_to_bytes(tagged_field(words, 13)).decode()
+    assert description == "é" * 319
+
+@pytest.mark.asyncio
+async def test_create_invoice_amountless_for_fiat():
+    provider = LocalInvoiceProvider(network="bc")
+    payment_request, _ = await provider.create_invoice(100, "USD", "Test invoice")
+
+    hrp, _ = decode_bech32(payment_request)
+    assert hrp == "lnbc"
+
+@pytest.mark.asyncio
+async def test_preimage_matches_payment_hash():
+    provider = LocalInvoiceProvider()
+    payment_request, payment_hash = await provider.create_invoice(1, "USD", "Test invoice")
+
+    preimage = provider.lookup_preimage(payment_request)
+    assert hashlib.sha256(bytes.fromhex(preimage)).hexdigest() == payment_hash
+
+@pytest.mark.asyncio
+async def test_max_invoices_evicts_oldest():
+    provider = LocalInvoiceProvider(max_invoices=2)
+    first, _ = await provider.create_invoice(1, "USD", "first")
+    await provider.create_invoice(1, "USD", "second")
+    await provider.create_invoice(1, "USD", "third")
+
+    assert provider.lookup_preimage(first) is None
+    assert len(provider.preimages) == 2
+
+@pytest.mark.asyncio
+async def test_full_l402_flow():
+    invoice_provider = LocalInvoiceProvider()
+    preimage_provider = LocalPreimageProvider(invoice_provider)
+    macaroon_service = SqliteMacaroonService(":memory:")
+    authenticator = Authenticator("localhost", invoice_provider, macaroon_service)
+
+    macaroon, invoice = await authenticator.new_challenge(1, "USD", "Test challenge")
+    preimage = preimage_provider.get_preimage(invoice)
+
+    await authenticator.validate_l402_header(f"L402 {macaroon}:{preimage}")
+    macaroon_service.close()
@@ -0,0 +1,157 @@
+import os
+import multiprocessing
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock
+
+import pytest
+
+from l402.server.macaroons import MacaroonService, SharedMemoryMacaroonService
+from l402.server.macaroons.shared_memory_macaroon_service import HEADER, SLOT
+
+@pytest.fixture
+def service():
+    service = AsyncMock(spec=MacaroonService)
+    service.get_root_key_with_expiry.return_value = (None, None)
+    return service
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "root-keys.cache")
+
+@pytest.fixture
+def cache(service, path):
+    cache = SharedMemoryMacaroonService(service, path, slots=64)
+    yield cache
+    cache.close()
+
+def test_file_is_private(cache, path):
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert os.path.getsize(path) == HEADER.size + 64 * SLOT.size
+
+def test_default_path_is_private(service, tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+
+    cache = SharedMemoryMacaroonService(service, slots=64)
+    cache.close()
+
+    assert os.path.dirname(cache.path) == str(tmp_path / f"l402-{os.getuid()}")
+    assert os.stat(os.path.dirname(cache.path)).st_mode & 0o777 == 0o700
+
+def test_shared_default_directory_is_rejected(service, tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    os.mkdir(tmp_path / f"l402-{os.getuid()}", 0o777)
+    os.chmod(tmp_path / f"l402-{os.getuid()}", 0o777)
+
+    with pytest.raises(RuntimeError):
+        SharedMemoryMacaroonService(service, slots=64)
+
+def test_file_accessible_by_others_is_rejected(service, path):
+    with open(path, "wb"):
+        pass
+    os.chmod(path, 0o644)
+
+    with pytest.raises(RuntimeError):
+        SharedMemoryMacaroonService(service, path, slots=64)
+
+def test_symlink_is_rejected(service, path, tmp_path):
+    os.symlink(tmp_path / "elsewhere", path)
+
+    with pytest.raises(OSError):
+        SharedMemoryMacaroonService(service, path, slots=64)
+
+def test_slots_mismatch(cache, service, path):
+    with pytest.raises(ValueError):
+        SharedMemoryMacaroonService(service, path, slots=128)
+
+@pytest.mark.asyncio
+async def test_insert_root_key_populates_cache(cache, service):
+    token_id, root_key = os.urandom(32), os.urandom(32)
+
+    await cache.insert_root_key(token_id, root_key, "macaroon")
+
+    assert await cache.get_root_key(token_id) == root_key
+    service.insert_root_key.assert_awaited_once_with(token_id, root_key, "macaroon")
+    service.get_root_key_with_expiry.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_miss_loads_from_service(cache, service):
+    token_id, root_key = os.urandom(32), os.urandom(32)
+    service.get_root_key_with_expiry.return_value = (root_key, None)
+
+    assert await cache.get_root_key(token_id) == root_key
+    assert await cache.get_root_key(token_id) == root_key
+    service.get_root_key_with_expiry.assert_awaited_once_with(token_id)
+
+@pytest.mark.asyncio
+async def test_miss_caches_the_expiry(cache, service):
+    token_id, root_key = os.urandom(32), os.urandom(32)
+    expires_at = datetime.now() + timedelta(seconds=60)
+    service.get_root_key_with_expiry.return_value = (root_key, expires_at)
+
+    assert await cache.get_root_key(token_id) == root_key
+    _, cached_expires_at = await cache.get_root_key_with_expiry(token_id)
+    assert cached_expires_at == expires_at.replace(microsecond=0)
+
+    service.get_root_key_with_expiry.return_value = (root_key, datetime.now() - timedelta(seconds=1))
+    other_token_id = os.urandom(32)
+    await cache.get_root_key(other_token_id)
+    assert cache.lookup(other_token_id) is None
+
+@pytest.mark.asyncio
+async def test_unknown_token_is_not_cached(cache, service):
+    token_id = os.urandom(32)
+
+    assert await cache.get_root_key(token_id) is None
+    assert await cache.get_root_key(token_id) is None
+    assert service.get_root_key_with_expiry.await_count == 2
+
+@pytest.mark.asyncio
+async def test_expired_entry_is_a_miss(cache, service):
+    token_id, root_key = os.urandom(32), os.urandom(32)
+    await cache.insert_root_key(token_id, root_key, "macaroon", expires_at=datetime.now() - timedelta(seconds=1))
+
+    assert cache.lookup(token_id) is None
+
+def test_corrupted_entry_is_a_miss(cache):
+    token_id, root_key = os.urandom(32), os.urandom(32)
+    cache.put(token_id, root_key)
+
+    # Flip a byte of the root key, as a torn write would.
+    offset = cache._offset(token_id) + 4 + 32
+    cache._mmap[offset] ^= 0xFF
+
+    assert cache.lookup(token_id) is None
+
+def test_entry_being_written_is_a_miss(cache):
+    token_id, root_key = os.urandom(32), os.urandom(32)
+    cache.put(token_id, root_key)
+
+    offset = cache._offset(token_id)
+    cache._mmap[offset] += 1
+
+    assert cache.lookup(token_id) is None
+
+def test_colliding_entry_replaces_the_slot(cache):
+    token_a = bytes(32)
+    token_b = (64).to_bytes(8, "little") + bytes(24)
+    cache.put(token_a, os.urandom(32))
+    cache.put(token_b, os.urandom(32))
+
+    assert cache.lookup(token_a) is None
+    assert cache.lookup(token_b) is not None
+
+def _put_from_other_process(path, token_id, root_key):
+    cache = SharedMemoryMacaroonService(None, path, slots=64)
+    cache.put(token_id, root_key)
+    cache.close()
+
+def test_entries_are_shared_between_processes(cache, path):
+    token_id, root_key = os.urandom(32), os.urandom(32)
+
+    ctx = multiprocessing.get_context("fork")
+    worker = ctx.Process(target=_put_from_other_process, args=(path, token_id, root_key))
+    worker.start()
+    worker.join(5)
+
+    assert worker.exitcode == 0
+    assert cache.lookup(token_id) == root_key
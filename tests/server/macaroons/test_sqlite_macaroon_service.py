@@ -1,14 +1,14 @@
 import os
 import sqlite3
 import pytest
-from datetime import datetime
+from datetime import datetime, timedelta
 from l402.server.macaroons import SqliteMacaroonService
 
 @pytest.fixture
 def macaroon_service():
     service = SqliteMacaroonService(":memory:")
     yield service
-    service.conn.close()
+    service.close()
 
 @pytest.mark.asyncio
 async def test_insert_and_get_root_key(macaroon_service):
@@ -57,4 +57,55 @@ def test_adapt_datetime():
     dt = datetime.now()
     adapted_dt = sqlite3.adapt(dt)
     assert isinstance(adapted_dt, str)
-    assert adapted_dt == dt.isoformat()
\ No newline at end of file
+    assert adapted_dt == dt.isoformat()
+
+@pytest.mark.asyncio
+async def test_record_and_get_usage(macaroon_service):
+    token_id1 = os.urandom(32)
+    token_id2 = os.urandom(32)
+
+    assert await macaroon_service.get_usage(token_id1) == 0
+
+    await macaroon_service.record_usage({token_id1: 3, token_id2: 1})
+    await macaroon_service.record_usage({token_id1: 2})
+
+    assert await macaroon_service.get_usage(token_id1) == 5
+    assert await macaroon_service.get_usage(token_id2) == 1
+
+@pytest.mark.asyncio
+async def test_delete_expired_root_keys(macaroon_service):
+    expired = os.urandom(32)
+    valid = os.urandom(32)
+    forever = os.urandom(32)
+
+    await macaroon_service.insert_root_key(expired, os.urandom(32), "m1", expires_at=datetime.now() - timedelta(seconds=1))
+    await macaroon_service.insert_root_key(valid, os.urandom(32), "m2", expires_at=datetime.now() + timedelta(hours=1))
+    await macaroon_service.insert_root_key(forever, os.urandom(32), "m3")
+    await macaroon_service.record_usage({expired: 1})
+
+    assert await macaroon_service.delete_expired_root_keys() == 1
+
+    assert await macaroon_service.get_root_key(expired) is None
+    assert await macaroon_service.get_root_key(valid) is not None
+    assert await macaroon_service.get_root_key(forever) is not None
+    assert await macaroon_service.get_usage(expired) == 0
+
+def test_existing_table_gets_expires_at(tmp_path):
+    path = str(tmp_path / "authenticator.db")
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE macaroons (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            token_id BLOB UNIQUE NOT NULL,
+            root_key BLOB NOT NULL,
+            macaroon TEXT,
+            created_at DATETIME NOT NULL
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+    service = SqliteMacaroonService(path)
+    columns = [row[1] for row in service.conn.execute("PRAGMA table_info(macaroons)")]
+    assert "expires_at" in columns
+    service.close()
@@ -0,0 +1,131 @@
+import asyncio
+import pytest
+
+from l402.server import AdmissionController, TooManyChallenges, ChallengesOverloaded
+
+@pytest.mark.asyncio
+async def test_rate_limit_per_client(mocker):
+    now = mocker.patch("l402.server.admission.time.monotonic", return_value=100.0)
+    admission = AdmissionController(rate=1.0, burst=2)
+
+    for _ in range(2):
+        async with admission.admit("client"):
+            pass
+
+    with pytest.raises(TooManyChallenges) as exc_info:
+        async with admission.admit("client"):
+            pass
+    assert exc_info.value.retry_after == 1
+    assert exc_info.value.status_code == 429
+
+    # Other clients have their own bucket, and tokens come back over time.
+    async with admission.admit("other"):
+        pass
+    now.return_value = 101.0
+    async with admission.admit("client"):
+        pass
+
+    assert admission.metrics()["rate_limited"] == 1
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("max_queue", [0, 1])
+async def test_overloaded_challenges_do_not_take_tokens(max_queue):
+    # Slow enough that no token comes back during the test.
+    admission = AdmissionController(max_concurrency=1, max_queue=max_queue, queue_timeout=0.01, rate=0.001, burst=1)
+
+    async with admission.admit("other"):
+        for _ in range(3):
+            with pytest.raises(ChallengesOverloaded):
+                async with admission.admit("client"):
+                    pass
+
+    # The shed requests did not use the only token of the client.
+    async with admission.admit("client"):
+        pass
+    assert admission.metrics()["rate_limited"] == 0
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_queues():
+    admission = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=1.0)
+    order = []
+
+    async def challenge(name, delay):
+        async with admission.admit():
+            order.append(name)
+            await asyncio.sleep(delay)
+
+    first = asyncio.create_task(challenge("first", 0.05))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(challenge("second", 0))
+    await asyncio.sleep(0)
+    assert admission.metrics()["queued"] == 1
+
+    await asyncio.gather(first, second)
+    assert order == ["first", "second"]
+    assert admission.metrics() == {"admitted": 2, "rate_limited": 0, "overloaded": 0, "active": 0, "queued": 0}
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_right_away():
+    admission = AdmissionController(max_concurrency=1, max_queue=0, retry_after=5)
+
+    async with admission.admit():
+        with pytest.raises(ChallengesOverloaded) as exc_info:
+            async with admission.admit():
+                pass
+
+    assert exc_info.value.retry_after == 5
+    assert exc_info.value.status_code == 503
+
+@pytest.mark.asyncio
+async def test_queue_timeout_releases_the_waiter():
+    admission = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=0.01)
+
+    async with admission.admit():
+        with pytest.raises(ChallengesOverloaded):
+            async with admission.admit():
+                pass
+        assert admission.metrics()["queued"] == 0
+
+    # The slot is free again once released.
+    async with admission.admit():
+        assert admission.metrics()["active"] == 1
+    assert admission.metrics()["active"] == 0
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_leak_the_slot():
+    admission = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=1.0)
+
+    async def wait_for_slot():
+        async with admission.admit():
+            pass
+
+    async with admission.admit():
+        waiter = asyncio.create_task(wait_for_slot())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    assert admission.metrics()["active"] == 0
+
+@pytest.mark.asyncio
+async def test_waiter_cancelled_after_the_grant_does_not_leak_the_slot(mocker):
+    admission = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=1.0)
+    grant = admission._grant
+
+    async def wait_for_slot():
+        async with admission.admit():
+            pass
+
+    def grant_and_cancel(waiter):
+        grant(waiter)
+        waiter_task.cancel()
+
+    mocker.patch.object(admission, "_grant", side_effect=grant_and_cancel)
+    async with admission.admit():
+        waiter_task = asyncio.create_task(wait_for_slot())
+        await asyncio.sleep(0)
+
+    # Python 3.12+ cancels the task, older versions let it use the slot.
+    await asyncio.gather(waiter_task, return_exceptions=True)
+    assert admission.metrics()["active"] == 0
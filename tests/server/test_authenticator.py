@@ -1,10 +1,13 @@
 import pytest
 import os
+import time
 from unittest.mock import AsyncMock, MagicMock
 
 from pymacaroons import Macaroon
 
-from l402.server import Authenticator, InvoiceProvider, MacaroonService, InvalidOrMissingL402Header, InvalidMacaroon
+from l402.server.invoice_provider import LocalInvoiceProvider
+from l402.server.macaroons import SqliteMacaroonService
+from l402.server import Authenticator, InvoiceProvider, MacaroonService, InvalidOrMissingL402Header, InvalidMacaroon, ExpiredMacaroon, ServiceNotAllowed, UsageLimitExceeded, SessionTokens
 
 
 def test_encode_decode_identifier():
@@ -157,4 +160,205 @@ async def test_validate_macaroon_invalid_root_key():
     encoded_macaroon = "AgENdGVzdF9sb2NhdGlvbgJCAAA4yq2-D2ES2bY46a4kM49-m9kwozhxANp3ZkTlaWXJwQmKfNPv5fe5YlC6ILL7ZMNRu1dAL3dTdW9MVcG86F7jAAAGIMSJ0L0eYt4Vlcdg3vNG1LmjvxNQxlufF0c15WFYpmgp"
     mac = Macaroon.deserialize(encoded_macaroon)
     with pytest.raises(InvalidMacaroon, match="Macaroon verification failed."):
-        await authenticator._validate_macaroon(mac, token_id)
\ No newline at end of file
+        await authenticator._validate_macaroon(mac, token_id)
+
+@pytest.fixture
+def local_authenticator():
+    invoice_provider = LocalInvoiceProvider()
+    macaroon_service = SqliteMacaroonService(":memory:")
+    authenticator = Authenticator("test_location", invoice_provider, macaroon_service)
+    yield authenticator
+    macaroon_service.close()
+
+def _paid_header(authenticator, macaroon, payment_request):
+    preimage = authenticator.invoice_provider.lookup_preimage(payment_request)
+    return f"L402 {macaroon}:{preimage}"
+
+@pytest.mark.asyncio
+async def test_new_challenge_with_max_calls(local_authenticator):
+    macaroon, _ = await local_authenticator.new_challenge(1, "sats", "metered", max_calls=2)
+
+    mac = Macaroon.deserialize(macaroon)
+    assert [c.caveat_id for c in mac.first_party_caveats()] == [b"max_calls=2"]
+
+@pytest.mark.asyncio
+async def test_new_challenge_with_max_calls_needs_usage_metering():
+    class RootKeysOnly(MacaroonService):
+        async def insert_root_key(self, token_id, root_key, macaroon, expires_at=None):
+            pass
+
+        async def get_root_key(self, token_id):
+            return None
+
+    invoice_provider = AsyncMock(spec=InvoiceProvider)
+    authenticator = Authenticator("test_location", invoice_provider, RootKeysOnly())
+
+    with pytest.raises(RuntimeError, match="does not support usage metering"):
+        await authenticator.new_challenge(1, "sats", "metered", max_calls=2)
+    invoice_provider.create_invoice.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_validate_metered_macaroon(local_authenticator):
+    macaroon, payment_request = await local_authenticator.new_challenge(1, "sats", "metered", max_calls=2)
+    header = _paid_header(local_authenticator, macaroon, payment_request)
+
+    await local_authenticator.validate_l402_header(header)
+    await local_authenticator.validate_l402_header(header)
+    with pytest.raises(UsageLimitExceeded):
+        await local_authenticator.validate_l402_header(header)
+
+@pytest.mark.asyncio
+async def test_validate_attenuated_max_calls_uses_lowest(local_authenticator):
+    macaroon, payment_request = await local_authenticator.new_challenge(1, "sats", "metered", max_calls=1)
+    mac = Macaroon.deserialize(macaroon)
+    mac.add_first_party_caveat("max_calls=100")
+    header = _paid_header(local_authenticator, mac.serialize(), payment_request)
+
+    await local_authenticator.validate_l402_header(header)
+    with pytest.raises(UsageLimitExceeded):
+        await local_authenticator.validate_l402_header(header)
+
+@pytest.mark.asyncio
+async def test_validate_unknown_caveat_fails(local_authenticator):
+    macaroon, payment_request = await local_authenticator.new_challenge(1, "sats", "unmetered")
+    mac = Macaroon.deserialize(macaroon)
+    mac.add_first_party_caveat("unknown=1")
+    header = _paid_header(local_authenticator, mac.serialize(), payment_request)
+
+    with pytest.raises(InvalidMacaroon):
+        await local_authenticator.validate_l402_header(header)
+
+@pytest.mark.asyncio
+async def test_new_challenge_with_expiry(local_authenticator, mocker):
+    mocker.patch("l402.server.authenticator.time.time", return_value=1_700_000_000)
+    insert_root_key = mocker.spy(local_authenticator.macaroon_service, "insert_root_key")
+
+    macaroon, _ = await local_authenticator.new_challenge(1, "sats", "expiring", expires_in=60)
+
+    mac = Macaroon.deserialize(macaroon)
+    assert [c.caveat_id for c in mac.first_party_caveats()] == [b"valid_until=1700000060"]
+    assert insert_root_key.call_args.kwargs["expires_at"].timestamp() == 1_700_000_060
+
+@pytest.mark.asyncio
+async def test_validate_expired_macaroon_skips_storage(local_authenticator, mocker):
+    macaroon, payment_request = await local_authenticator.new_challenge(1, "sats", "expiring", expires_in=60)
+    header = _paid_header(local_authenticator, macaroon, payment_request)
+    await local_authenticator.validate_l402_header(header)
+
+    get_root_key = mocker.spy(local_authenticator.macaroon_service, "get_root_key")
+    mocker.patch("l402.server.authenticator.time.time", return_value=time.time() + 61)
+
+    with pytest.raises(ExpiredMacaroon):
+        await local_authenticator.validate_l402_header(header)
+    get_root_key.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_validate_attenuated_expiry_uses_earliest(local_authenticator):
+    macaroon, payment_request = await local_authenticator.new_challenge(1, "sats", "expiring", expires_in=60)
+    mac = Macaroon.deserialize(macaroon)
+    mac.add_first_party_caveat(f"valid_until={int(time.time()) - 1}")
+    header = _paid_header(local_authenticator, mac.serialize(), payment_request)
+
+    with pytest.raises(ExpiredMacaroon):
+        await local_authenticator.validate_l402_header(header)
+
+@pytest.mark.asyncio
+async def test_new_challenge_collects_expired_root_keys():
+    mock_invoice_provider = AsyncMock(spec=InvoiceProvider)
+    mock_invoice_provider.create_invoice.return_value = ("lnbc...", "38caadbe0f6112d9b638e9ae24338f7e9bd930a3387100da776644e56965c9c1")
+    mock_macaroon_service = AsyncMock(spec=MacaroonService)
+
+    authenticator = Authenticator("test_location", mock_invoice_provider, mock_macaroon_service, gc_interval=3600)
+    await authenticator.new_challenge(1, "sats", "gc")
+    mock_macaroon_service.delete_expired_root_keys.assert_not_called()
+
+    authenticator._next_gc = 0
+    await authenticator.new_challenge(1, "sats", "gc")
+    await authenticator.new_challenge(1, "sats", "gc")
+    mock_macaroon_service.delete_expired_root_keys.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_validate_services(local_authenticator, mocker):
+    macaroon, payment_request = await local_authenticator.new_challenge(
+        1, "sats", "bundle", services={"search": 1, "export": 0},
+    )
+    header = _paid_header(local_authenticator, macaroon, payment_request)
+
+    await local_authenticator.validate_l402_header(header, "search", 1)
+    await local_authenticator.validate_l402_header(header, "export")
+
+    get_root_key = mocker.spy(local_authenticator.macaroon_service, "get_root_key")
+    with pytest.raises(ServiceNotAllowed):
+        await local_authenticator.validate_l402_header(header, "export", 1)
+    with pytest.raises(ServiceNotAllowed):
+        await local_authenticator.validate_l402_header(header, "admin")
+    with pytest.raises(ServiceNotAllowed):
+        await local_authenticator.validate_l402_header(header)
+    get_root_key.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_validate_attenuated_services(local_authenticator):
+    macaroon, payment_request = await local_authenticator.new_challenge(
+        1, "sats", "bundle", services={"search": 0, "export": 0},
+    )
+    mac = Macaroon.deserialize(macaroon)
+    mac.add_first_party_caveat("services=search:0")
+    header = _paid_header(local_authenticator, mac.serialize(), payment_request)
+
+    await local_authenticator.validate_l402_header(header, "search")
+    with pytest.raises(ServiceNotAllowed):
+        await local_authenticator.validate_l402_header(header, "export")
+
+@pytest.mark.asyncio
+async def test_session_token_carries_the_macaroon_caveats(local_authenticator, mocker):
+    local_authenticator.session_tokens = SessionTokens()
+    macaroon, payment_request = await local_authenticator.new_challenge(
+        1, "sats", "session", max_calls=2, services={"search": 1, "export": 0},
+    )
+    mac = Macaroon.deserialize(macaroon)
+    mac.add_first_party_caveat("services=search:0,admin:1")
+    header = _paid_header(local_authenticator, mac.serialize(), payment_request)
+
+    token = await local_authenticator.new_session_token(header, "search")
+
+    get_root_key = mocker.spy(local_authenticator.macaroon_service, "get_root_key")
+    await local_authenticator.validate_session_token(token, "search")
+    with pytest.raises(ServiceNotAllowed):
+        await local_authenticator.validate_session_token(token, "search", 1)
+    with pytest.raises(ServiceNotAllowed):
+        await local_authenticator.validate_session_token(token, "export")
+    with pytest.raises(UsageLimitExceeded):
+        await local_authenticator.validate_session_token(token, "search")
+    get_root_key.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_validate_l402_caveats(local_authenticator):
+    macaroon, payment_request = await local_authenticator.new_challenge(
+        1, "sats", "caveats", max_calls=2, expires_in=60, services={"search": 1},
+    )
+    mac = Macaroon.deserialize(macaroon)
+    mac.add_first_party_caveat("max_calls=1")
+    header = _paid_header(local_authenticator, mac.serialize(), payment_request)
+
+    caveats = await local_authenticator.validate_l402_caveats(header, "search")
+
+    assert caveats.max_calls == 1
+    assert 0 < caveats.valid_until - time.time() <= 60
+    assert caveats.services == {"search": 1}
+
+@pytest.mark.asyncio
+async def test_session_token_for_a_huge_max_calls(local_authenticator):
+    local_authenticator.session_tokens = SessionTokens()
+    macaroon, payment_request = await local_authenticator.new_challenge(1, "sats", "session", max_calls=2**40)
+    header = _paid_header(local_authenticator, macaroon, payment_request)
+
+    token = await local_authenticator.new_session_token(header)
+    await local_authenticator.validate_session_token(token)
+
+@pytest.mark.asyncio
+async def test_new_session_token_validates_the_header(local_authenticator):
+    local_authenticator.session_tokens = SessionTokens()
+    macaroon, _ = await local_authenticator.new_challenge(1, "sats", "session")
+
+    with pytest.raises(ValueError):
+        await local_authenticator.new_session_token(f"L402 {macaroon}:{'00' * 32}")
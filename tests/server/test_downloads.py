@@ -0,0 +1,143 @@
+import re
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from l402.server import PaidDownloads
+
+CHALLENGE_PATTERN = re.compile(r'L402 macaroon="(.*?)", invoice="(.*?)"')
+CONTENT = bytes(range(256)) * 4
+
+@pytest.fixture
+def file_path(tmp_path):
+    path = tmp_path / "item.bin"
+    path.write_bytes(CONTENT)
+    return str(path)
+
+@pytest.fixture
+def downloads(authenticator):
+    return PaidDownloads(authenticator)
+
+@pytest.fixture
+def client(downloads, file_path):
+    app = FastAPI()
+
+    @app.get("/download")
+    async def download(req: Request):
+        return await downloads.serve(req, file_path, (100, "USD", "Download"), filename="item.bin")
+
+    return TestClient(app)
+
+@pytest.fixture
+def headers(authenticator, client):
+    response = client.get("/download")
+    assert response.status_code == 402
+    macaroon, invoice = CHALLENGE_PATTERN.match(response.headers["WWW-Authenticate"]).groups()
+    preimage = authenticator.invoice_provider.lookup_preimage(invoice)
+    return {"Authorization": f"L402 {macaroon}:{preimage}"}
+
+def test_unpaid_download_gets_a_challenge(client):
+    response = client.get("/download", headers={"Range": "bytes=0-9"})
+    assert response.status_code == 402
+    assert response.headers["WWW-Authenticate"].startswith("L402 ")
+
+def test_invalid_credentials_get_a_new_challenge(client):
+    response = client.get("/download", headers={"Authorization": "L402 invalid:invalid"})
+    assert response.status_code == 402
+
+def test_whole_file(client, headers):
+    response = client.get("/download", headers=headers)
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["accept-ranges"] == "bytes"
+    assert 'filename="item.bin"' in response.headers["content-disposition"]
+
+@pytest.mark.parametrize("byte_range, start, end", [
+    ("bytes=0-9", 0, 9),
+    ("bytes=1000-", 1000, 1023),
+    ("bytes=-24", 1000, 1023),
+    ("bytes=1000-5000", 1000, 1023),
+])
+def test_byte_range(client, headers, byte_range, start, end):
+    response = client.get("/download", headers={**headers, "Range": byte_range})
+    assert response.status_code == 206
+    assert response.content == CONTENT[start:end + 1]
+    assert response.headers["content-range"] == f"bytes {start}-{end}/{len(CONTENT)}"
+    assert response.headers["content-length"] == str(end - start + 1)
+
+@pytest.mark.parametrize("byte_range", ["bytes=1024-", "bytes=10-5", "bytes=-0"])
+def test_unsatisfiable_range(client, headers, byte_range):
+    response = client.get("/download", headers={**headers, "Range": byte_range})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+def test_multiple_ranges(client, headers):
+    response = client.get("/download", headers={**headers, "Range": "bytes=0-9,20-29"})
+    # Left to FileResponse, older Starlette versions send the whole file.
+    if response.status_code == 200:
+        assert response.content == CONTENT
+    else:
+        assert response.status_code == 206
+        assert response.headers["content-type"].startswith("multipart/byteranges")
+
+def test_if_range(client, headers):
+    etag = client.get("/download", headers=headers).headers["etag"]
+
+    response = client.get("/download", headers={**headers, "Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 206
+
+    response = client.get("/download", headers={**headers, "Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+def _paid_headers(authenticator, **kwargs):
+    macaroon, invoice = asyncio.run(authenticator.new_challenge(100, "USD", "Download", **kwargs))
+    preimage = authenticator.invoice_provider.lookup_preimage(invoice)
+    return {"Authorization": f"L402 {macaroon}:{preimage}"}
+
+def test_download_session_is_validated_once(authenticator, client, headers, mocker):
+    validate = mocker.spy(authenticator, "validate_l402_caveats")
+
+    for offset in range(0, len(CONTENT), 256):
+        response = client.get("/download", headers={**headers, "Range": f"bytes={offset}-{offset + 255}"})
+        assert response.content == CONTENT[offset:offset + 256]
+
+    assert validate.call_count == 1
+
+def test_expired_download_session_is_validated_again(authenticator, downloads, client, headers, mocker):
+    downloads.session_ttl = 0
+    validate = mocker.spy(authenticator, "validate_l402_caveats")
+
+    client.get("/download", headers={**headers, "Range": "bytes=0-9"})
+    client.get("/download", headers={**headers, "Range": "bytes=10-19"})
+
+    assert validate.call_count == 2
+
+def test_whole_downloads_are_validated_every_time(authenticator, client, headers, mocker):
+    validate = mocker.spy(authenticator, "validate_l402_caveats")
+
+    client.get("/download", headers=headers)
+    client.get("/download", headers=headers)
+
+    assert validate.call_count == 2
+
+def test_metered_downloads_are_charged_every_request(authenticator, client):
+    headers = _paid_headers(authenticator, max_calls=2)
+
+    assert client.get("/download", headers=headers).status_code == 200
+    # A range can cover the whole file too, it is not a free continuation.
+    assert client.get("/download", headers={**headers, "Range": "bytes=0-"}).status_code == 206
+    assert client.get("/download", headers={**headers, "Range": "bytes=0-"}).status_code == 402
+    assert client.get("/download", headers=headers).status_code == 402
+
+def test_download_session_ends_with_the_macaroon(authenticator, downloads, client):
+    headers = _paid_headers(authenticator, expires_in=2)
+
+    response = client.get("/download", headers={**headers, "Range": "bytes=0-9"})
+    assert response.status_code == 206
+
+    [expires_at] = downloads._sessions.values()
+    assert expires_at <= time.monotonic() + 2
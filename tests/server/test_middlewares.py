@@ -0,0 +1,256 @@
+import re
+import asyncio
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from l402.server import AdmissionController, FastAPIL402Guard, FastAPIL402Middleware, SessionTokens
+
+CHALLENGE_PATTERN = re.compile(r'L402 macaroon="(.*?)", invoice="(.*?)"')
+
+def make_app(authenticator, **kwargs):
+    app = FastAPI()
+
+    @app.get("/search")
+    def search():
+        return {"route": "search"}
+
+    @app.get("/search/advanced")
+    def advanced_search():
+        return {"route": "advanced"}
+
+    @app.get("/export")
+    def export():
+        return {"route": "export"}
+
+    @app.get("/items/{item_id}")
+    def item(item_id: int):
+        return {"route": "item", "id": item_id}
+
+    app.add_middleware(
+        FastAPIL402Middleware,
+        authenticator=authenticator,
+        pricing_func=lambda request: (1, "sats", request.url.path),
+        **kwargs,
+    )
+    return TestClient(app)
+
+def pay(authenticator, response):
+    assert response.status_code == 402
+    macaroon, invoice = CHALLENGE_PATTERN.match(response.headers["WWW-Authenticate"]).groups()
+    preimage = authenticator.invoice_provider.lookup_preimage(invoice)
+    return {"Authorization": f"L402 {macaroon}:{preimage}"}
+
+def test_challenge_and_paid_request(authenticator):
+    client = make_app(authenticator)
+
+    response = client.get("/search")
+    assert response.json() == {"detail": "Payment Required"}
+
+    headers = pay(authenticator, response)
+    assert client.get("/search", headers=headers).json() == {"route": "search"}
+
+def test_service_macaroon_unlocks_the_service_routes(authenticator):
+    client = make_app(authenticator, services={
+        "/search": "search",
+        "/search/advanced": ("search", 1),
+        "/export": "export",
+    })
+
+    headers = pay(authenticator, client.get("/search"))
+
+    assert client.get("/search", headers=headers).status_code == 200
+    # Higher tiers and other services need their own payment.
+    assert client.get("/search/advanced", headers=headers).status_code == 402
+    assert client.get("/export", headers=headers).status_code == 402
+
+def test_service_of_parameterized_routes(authenticator):
+    client = make_app(authenticator, services={"/items/{id}": "items", "/search": "search"})
+
+    headers = pay(authenticator, client.get("/items/1"))
+
+    assert client.get("/items/1", headers=headers).status_code == 200
+    assert client.get("/items/2", headers=headers).status_code == 200
+    assert client.get("/search", headers=headers).status_code == 402
+
+def test_higher_tier_unlocks_lower_tiers(authenticator):
+    client = make_app(authenticator, services={
+        "/search": "search",
+        "/search/advanced": ("search", 1),
+    })
+
+    headers = pay(authenticator, client.get("/search/advanced"))
+
+    assert client.get("/search/advanced", headers=headers).status_code == 200
+    assert client.get("/search", headers=headers).status_code == 200
+
+def test_challenges_over_the_client_rate_are_shed(authenticator):
+    authenticator.admission = AdmissionController(rate=0.001, burst=1)
+    client = make_app(authenticator)
+
+    assert client.get("/search").status_code == 402
+
+    response = client.get("/search")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+    # Paid requests are not subject to admission control.
+    headers = pay(authenticator, make_app(authenticator, client_id_func=lambda request: "other").get("/search"))
+    assert client.get("/search", headers=headers).status_code == 200
+
+def test_session_token_replaces_the_l402_header(authenticator, mocker):
+    authenticator.session_tokens = SessionTokens()
+    client = make_app(authenticator)
+
+    response = client.get("/search", headers=pay(authenticator, client.get("/search")))
+    session = {"L402-Session": response.headers["L402-Session"]}
+
+    validate = mocker.spy(authenticator, "validate_l402_header")
+    assert client.get("/search", headers=session).json() == {"route": "search"}
+    validate.assert_not_called()
+
+    response = client.get("/search", headers={"L402-Session": "forged"})
+    assert response.status_code == 402
+
+def test_failing_handler_is_called_once_with_both_credentials(authenticator):
+    authenticator.session_tokens = SessionTokens()
+    calls = []
+    app = FastAPI()
+
+    @app.post("/orders")
+    def order():
+        calls.append("order")
+        raise RuntimeError("Handler failed.")
+
+    app.add_middleware(
+        FastAPIL402Middleware,
+        authenticator=authenticator,
+        pricing_func=lambda request: (1, "sats", request.url.path),
+    )
+    client = TestClient(app, raise_server_exceptions=False)
+
+    headers = pay(authenticator, client.post("/orders"))
+    headers["L402-Session"] = authenticator.session_tokens.issue(bytes(32))
+
+    response = client.post("/orders", headers=headers)
+    assert response.status_code == 500
+    assert calls == ["order"]
+
+def make_speculative_app(authenticator, events, mocker):
+    validate = authenticator.validate_l402_header
+
+    async def slow_validate(*args):
+        await asyncio.sleep(0.05)
+        events.append("validated")
+        await validate(*args)
+
+    mocker.patch.object(authenticator, "validate_l402_header", side_effect=slow_validate)
+
+    app = FastAPI()
+
+    @app.get("/search")
+    async def search():
+        events.append("handler")
+        return {"route": "search"}
+
+    @app.get("/export")
+    async def export():
+        events.append("handler")
+        return {"route": "export"}
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int):
+        events.append("handler")
+        return {"route": "item"}
+
+    app.add_middleware(
+        FastAPIL402Middleware,
+        authenticator=authenticator,
+        pricing_func=lambda request: (1, "sats", request.url.path),
+        speculative=["/search", "/items/{id}"],
+    )
+    return TestClient(app)
+
+def test_speculative_route_runs_the_handler_during_validation(authenticator, mocker):
+    events = []
+    client = make_speculative_app(authenticator, events, mocker)
+
+    headers = pay(authenticator, client.get("/search"))
+    assert client.get("/search", headers=headers).json() == {"route": "search"}
+    assert events == ["handler", "validated"]
+
+    events.clear()
+    headers = pay(authenticator, client.get("/items/1"))
+    assert client.get("/items/1", headers=headers).json() == {"route": "item"}
+    assert events == ["handler", "validated"]
+
+    events.clear()
+    headers = pay(authenticator, client.get("/export"))
+    assert client.get("/export", headers=headers).json() == {"route": "export"}
+    assert events == ["validated", "handler"]
+
+def test_speculative_response_is_discarded_on_invalid_credentials(authenticator, mocker):
+    events = []
+    client = make_speculative_app(authenticator, events, mocker)
+
+    macaroon, _ = CHALLENGE_PATTERN.match(client.get("/search").headers["WWW-Authenticate"]).groups()
+    response = client.get("/search", headers={"Authorization": f"L402 {macaroon}:{'00' * 32}"})
+
+    assert response.status_code == 402
+    assert response.json() == {"detail": "Payment Required"}
+    assert events == ["handler", "validated"]
+
+def test_route_table(authenticator, mocker):
+    client = make_app(authenticator, routes={
+        "/search": (2, "sats", "Search"),
+        "/search/*": None,
+    })
+    validate = mocker.spy(authenticator, "validate_l402_header")
+    create_invoice = mocker.spy(authenticator.invoice_provider, "create_invoice")
+
+    assert client.get("/search/advanced", headers={"Authorization": "L402 a:b"}).json() == {"route": "advanced"}
+    validate.assert_not_called()
+
+    response = client.get("/search")
+    assert response.status_code == 402
+    assert create_invoice.call_args.args[:2] == (2, "sats")
+
+def test_route_table_falls_back_to_pricing_func(authenticator):
+    client = make_app(authenticator, routes={"/search": None})
+
+    assert client.get("/search").json() == {"route": "search"}
+    assert client.get("/export").status_code == 402
+
+def test_guard(authenticator):
+    app = FastAPI()
+    guard = FastAPIL402Guard(authenticator, (1, "sats", "Search"), service="search")
+
+    @app.get("/search", dependencies=[Depends(guard)])
+    def search():
+        return {"route": "search"}
+
+    @app.get("/health")
+    def health():
+        return {"route": "health"}
+
+    client = TestClient(app)
+    assert client.get("/health").json() == {"route": "health"}
+
+    response = client.get("/search")
+    assert response.json() == {"detail": "Payment Required"}
+    assert client.get("/search", headers=pay(authenticator, response)).json() == {"route": "search"}
+
+def test_guard_issues_session_tokens(authenticator):
+    authenticator.session_tokens = SessionTokens()
+    app = FastAPI()
+
+    @app.get("/search", dependencies=[Depends(FastAPIL402Guard(authenticator, (1, "sats", "Search")))])
+    def search():
+        return {"route": "search"}
+
+    client = TestClient(app)
+    response = client.get("/search", headers=pay(authenticator, client.get("/search")))
+    session = {"L402-Session": response.headers["L402-Session"]}
+
+    assert client.get("/search", headers=session).json() == {"route": "search"}
@@ -0,0 +1,49 @@
+import pytest
+
+from l402.server import RouteTable
+
+@pytest.fixture
+def table():
+    return RouteTable({
+        "/health": None,
+        "/items/{id}": "item",
+        "/items/featured": "featured",
+        "/items/{id}/download": "download",
+        "/static/*": "static",
+        "/api/*": "api",
+        "/api/free": None,
+    })
+
+@pytest.mark.parametrize("path, value", [
+    ("/health", None),
+    ("/health/", None),
+    ("/items/1", "item"),
+    ("/items/featured", "featured"),
+    ("/items/1/download", "download"),
+    ("/static", "static"),
+    ("/static/css/site.css", "static"),
+    ("/api/free", None),
+    ("/api/search", "api"),
+])
+def test_match(table, path, value):
+    assert table.match(path, "unmatched") == value
+
+@pytest.mark.parametrize("path", ["/", "/items", "/items/1/other", "/healthz"])
+def test_unmatched(table, path):
+    assert table.match(path, "unmatched") == "unmatched"
+
+def test_literal_falls_back_to_parameter():
+    table = RouteTable({"/items/featured/top": "top", "/items/{id}/download": "download"})
+
+    assert table.match("/items/featured/download") == "download"
+    assert table.match("/items/featured/top") == "top"
+
+def test_catch_all():
+    table = RouteTable({"/*": "paid", "/health": None})
+
+    assert table.match("/") == "paid"
+    assert table.match("/health", "unmatched") is None
+
+def test_wildcard_must_be_last():
+    with pytest.raises(ValueError):
+        RouteTable({"/static/*/file": "static"})
@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from l402.server import SessionTokens, InvalidSessionToken
+
+TOKEN_ID = bytes(range(32))
+
+def test_issue_and_verify():
+    tokens = SessionTokens(secret=b"secret")
+    token = tokens.issue(TOKEN_ID)
+
+    session = tokens.verify(token)
+    assert session.token_id == TOKEN_ID
+    assert session.max_calls is None
+    assert session.services is None
+    assert len(token) < 100
+
+def test_caveats_round_trip():
+    tokens = SessionTokens(secret=b"secret")
+    token = tokens.issue(TOKEN_ID, max_calls=0, services={"search": 1, "export": 0})
+
+    session = tokens.verify(token)
+    assert session.max_calls == 0
+    assert session.services == {"search": 1, "export": 0}
+
+@pytest.mark.parametrize("max_calls, stored", [(-1, 0), (2**32, 2**32 - 1), (10**30, 2**32 - 1)])
+def test_out_of_range_max_calls_are_clamped(max_calls, stored):
+    tokens = SessionTokens(secret=b"secret")
+    assert tokens.verify(tokens.issue(TOKEN_ID, max_calls=max_calls)).max_calls == stored
+
+def test_expiry_is_capped_by_valid_until():
+    tokens = SessionTokens(secret=b"secret", ttl=300)
+    valid_until = int(time.time()) + 10
+
+    assert tokens.verify(tokens.issue(TOKEN_ID, valid_until=valid_until)).expires_at == valid_until
+
+def test_expired_token(mocker):
+    tokens = SessionTokens(secret=b"secret", ttl=60)
+    token = tokens.issue(TOKEN_ID)
+
+    mocker.patch("l402.server.session_tokens.time.time", return_value=time.time() + 61)
+    with pytest.raises(InvalidSessionToken, match="expired"):
+        tokens.verify(token)
+
+def test_token_signed_with_another_secret():
+    token = SessionTokens(secret=b"other").issue(TOKEN_ID)
+
+    with pytest.raises(InvalidSessionToken, match="signature"):
+        SessionTokens(secret=b"secret").verify(token)
+
+def test_tampered_token():
+    tokens = SessionTokens(secret=b"secret")
+    token = tokens.issue(TOKEN_ID, services={"search": 0})
+    tampered = token[:-30] + ("A" if token[-30] != "A" else "B") + token[-29:]
+
+    with pytest.raises(InvalidSessionToken):
+        tokens.verify(tampered)
+
+@pytest.mark.parametrize("token", ["", "AAAA", "not base64!"])
+def test_malformed_token(token):
+    with pytest.raises(InvalidSessionToken):
+        SessionTokens(secret=b"secret").verify(token)
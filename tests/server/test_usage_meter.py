@@ -0,0 +1,163 @@
+import os
+import sys
+import asyncio
+import threading
+import pytest
+from unittest.mock import AsyncMock
+
+from l402.server import UsageMeter, UsageLimitExceeded
+from l402.server.macaroons import SqliteMacaroonService
+
+@pytest.fixture
+def macaroon_service():
+    service = AsyncMock()
+    service.get_usage.return_value = 0
+    return service
+
+@pytest.mark.asyncio
+async def test_consume_counts_calls(macaroon_service):
+    meter = UsageMeter(macaroon_service, flush_interval=60)
+    token_id = os.urandom(32)
+
+    assert await meter.consume(token_id, 3) == 2
+    assert await meter.consume(token_id, 3) == 1
+    assert await meter.consume(token_id, 3) == 0
+    with pytest.raises(UsageLimitExceeded):
+        await meter.consume(token_id, 3)
+
+    # The usage is loaded once and not written on every call.
+    macaroon_service.get_usage.assert_awaited_once_with(token_id)
+    macaroon_service.record_usage.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_consume_starts_from_persisted_usage(macaroon_service):
+    macaroon_service.get_usage.return_value = 2
+    meter = UsageMeter(macaroon_service)
+
+    assert await meter.consume(os.urandom(32), 3) == 0
+
+@pytest.mark.asyncio
+async def test_flush_batches_increments(macaroon_service):
+    meter = UsageMeter(macaroon_service, flush_interval=60)
+    token_a, token_b = os.urandom(32), os.urandom(32)
+
+    await meter.consume(token_a, 10)
+    await meter.consume(token_a, 10)
+    await meter.consume(token_b, 10)
+    await meter.flush()
+    await meter.flush()
+
+    macaroon_service.record_usage.assert_awaited_once_with({token_a: 2, token_b: 1})
+
+@pytest.mark.asyncio
+async def test_flush_when_max_pending_is_reached(macaroon_service):
+    meter = UsageMeter(macaroon_service, flush_interval=60, max_pending=2)
+
+    await meter.consume(os.urandom(32), 10)
+    macaroon_service.record_usage.assert_not_called()
+    await meter.consume(os.urandom(32), 10)
+    macaroon_service.record_usage.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_flush_after_interval(macaroon_service):
+    meter = UsageMeter(macaroon_service, flush_interval=0)
+    token_id = os.urandom(32)
+
+    await meter.consume(token_id, 10)
+
+    macaroon_service.record_usage.assert_awaited_once_with({token_id: 1})
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_pending_calls(macaroon_service):
+    meter = UsageMeter(macaroon_service, flush_interval=60)
+    token_id = os.urandom(32)
+    await meter.consume(token_id, 10)
+
+    macaroon_service.record_usage.side_effect = Exception("database is down")
+    with pytest.raises(Exception, match="database is down"):
+        await meter.flush()
+
+    macaroon_service.record_usage.side_effect = None
+    await meter.consume(token_id, 10)
+    await meter.flush()
+    macaroon_service.record_usage.assert_awaited_with({token_id: 2})
+
+@pytest.mark.asyncio
+async def test_failed_flush_does_not_deny_the_call(macaroon_service, caplog):
+    meter = UsageMeter(macaroon_service, flush_interval=0)
+    token_id = os.urandom(32)
+    macaroon_service.record_usage.side_effect = Exception("database is down")
+
+    assert await meter.consume(token_id, 10) == 9
+    assert await meter.consume(token_id, 10) == 8
+    assert "Failed to persist the usage" in caplog.text
+
+    macaroon_service.record_usage.side_effect = None
+    await meter.flush()
+    macaroon_service.record_usage.assert_awaited_with({token_id: 2})
+
+@pytest.mark.asyncio
+async def test_evicts_flushed_counters(macaroon_service):
+    meter = UsageMeter(macaroon_service, flush_interval=60, max_tokens=2)
+    tokens = [os.urandom(32) for _ in range(3)]
+
+    await meter.consume(tokens[0], 10)
+    await meter.flush()
+    await meter.consume(tokens[1], 10)
+    await meter.consume(tokens[2], 10)
+
+    assert list(meter._counters) == tokens[1:]
+
+def test_concurrent_threads_count_every_call(macaroon_service):
+    # Like the per-request event loops of the Flask decorator.
+    meter = UsageMeter(macaroon_service, flush_interval=0, max_tokens=2)
+    tokens = [os.urandom(32) for _ in range(4)]
+    lock = threading.Lock()
+    recorded = {}
+
+    def record_usage(usage):
+        with lock:
+            for token_id, calls in usage.items():
+                recorded[token_id] = recorded.get(token_id, 0) + calls
+
+    def get_usage(token_id):
+        with lock:
+            return recorded.get(token_id, 0)
+
+    macaroon_service.record_usage.side_effect = record_usage
+    macaroon_service.get_usage.side_effect = get_usage
+
+    async def consume():
+        for _ in range(1000):
+            for token_id in tokens:
+                await meter.consume(token_id, 10**6)
+
+    threads = [threading.Thread(target=asyncio.run, args=(consume(),)) for _ in range(4)]
+    switch_interval = sys.getswitchinterval()
+    # Switch threads often, for the races to show up.
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    asyncio.run(meter.flush())
+
+    assert recorded == {token_id: 4000 for token_id in tokens}
+
+@pytest.mark.asyncio
+async def test_sqlite_macaroon_service_persists_usage():
+    service = SqliteMacaroonService(":memory:")
+    token_id = os.urandom(32)
+
+    meter = UsageMeter(service, flush_interval=60)
+    await meter.consume(token_id, 5)
+    await meter.consume(token_id, 5)
+    await meter.flush()
+
+    # A new meter, e.g. after a restart, resumes from the persisted usage.
+    meter = UsageMeter(service)
+    assert await meter.consume(token_id, 5) == 2
+    service.close()